@@ -0,0 +1,94 @@
+import argparse
+import sys
+
+import numpy as np
+import polars as pl
+
+from code.estimation.bootstrap import _all_signs, wild_cluster_bootstrap
+from code.estimation.fixed_effects import feols, group_codes
+
+# Check of wild_cluster_bootstrap against brute force: every one of the 2^G Rademacher weight vectors builds the
+# bootstrap outcome (restricted or unrestricted fit plus weighted residuals), the model is refitted by feols with
+# clustered standard errors, and its t statistic is compared with the bootstrap's draw. Cases cover FE nested in the
+# clusters, FE crossed with them, both at once, and no FE.
+CASES = {
+    "no FE": [],
+    "nested FE": ["unit"],
+    "crossed FE": ["period"],
+    "nested and crossed FE": ["unit", "period"],
+}
+
+
+def synthetic_panel(n_clusters=7, units_per_cluster=4, n_periods=30, seed=0):
+    rng = np.random.default_rng(seed)
+    units = n_clusters * units_per_cluster
+    unit, period = np.repeat(np.arange(units), n_periods), np.tile(np.arange(n_periods), units)
+    n = len(unit)
+    return (pl.DataFrame({
+        "unit": unit,
+        "period": period,
+        "cluster": unit // units_per_cluster,
+        "x1": rng.normal(size=n),
+        "x2": rng.normal(size=n),
+        "noise": rng.normal(size=n),
+        "period_effect": rng.normal(size=n_periods)[period],
+        "unit_effect": rng.normal(size=units)[unit],
+    })
+            .with_columns(
+        (0.1 * pl.col("x1") + 0.5 * pl.col("x2") + pl.col("period_effect") + pl.col("unit_effect")
+         + (1 + pl.col("cluster")) * pl.col("noise")).alias("y")))
+
+
+def brute_force_t(data, y, x, param, cluster, fe, impose_null, null_value=0.0):
+    # t statistics of the refitted models, one per weight vector in the order of the enumeration
+    full = feols(data, y, x, fe=fe, vcov="cluster", cluster=cluster)
+    if impose_null:
+        residuals = feols(data.with_columns(pl.col(y) - null_value * pl.col(param)), y,
+                          [term for term in x if term != param], fe=fe, vcov="cluster", cluster=cluster).residuals
+        center = null_value
+    else:
+        residuals = full.residuals
+        center = full.coef[full.terms.index(param)]
+    fitted = data.get_column(y).to_numpy() - residuals
+    codes = group_codes(data, cluster)
+    n_clusters = int(codes.max()) + 1
+    t_draws = []
+    for v in _all_signs(n_clusters, 0, 2 ** n_clusters).T:
+        refit = feols(data.with_columns(pl.Series(y, fitted + v[codes] * residuals)), y, x, fe=fe, vcov="cluster",
+                      cluster=cluster)
+        j = refit.terms.index(param)
+        t_draws.append((refit.coef[j] - center) / np.sqrt(refit.vcov[j, j]))
+    return np.array(t_draws)
+
+
+def check(data, tol):
+    rows = []
+    for case, fe in CASES.items():
+        for impose_null in [True, False]:
+            result = wild_cluster_bootstrap(data, "y", ["x1", "x2"], "x1", "cluster", fe=fe, draws=9999,
+                                            impose_null=impose_null)
+            expected = brute_force_t(data, "y", ["x1", "x2"], "x1", "cluster", fe, impose_null)
+            error = float(np.abs(result.t_draws - expected).max())
+            rows.append({"case": case, "bootstrap": "WCR" if impose_null else "WCU", "draws": result.draws,
+                         "max_abs_error": error, "status": "equal" if error <= tol else "different"})
+    return pl.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the wild cluster bootstrap against brute-force refits.")
+    parser.add_argument("--clusters", type=int, default=7)
+    parser.add_argument("--units-per-cluster", type=int, default=4)
+    parser.add_argument("--periods", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tol", type=float, default=1e-6, help="Largest absolute difference of the t statistics.")
+    args = parser.parse_args(argv)
+
+    data = synthetic_panel(args.clusters, args.units_per_cluster, args.periods, args.seed)
+    report = check(data, args.tol)
+    with pl.Config(tbl_rows=-1):
+        print(report)
+    return 0 if (report["status"] == "equal").all() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
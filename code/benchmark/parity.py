@@ -0,0 +1,104 @@
+import argparse
+import shutil
+import sys
+from pathlib import Path
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from code.benchmark.synthetic import SyntheticRawData
+from code.preprocessing.preprocess import DataPreprocessor
+from code.preprocessing.stages import TARGETS, with_dependencies
+
+# Parity of the duckdb engine of DataPreprocessor with the Polars one: both engines build the same targets from the
+# same raw data, and every output file is compared. Tables are compared up to the order of their rows and columns
+# (pivoted columns come in the order of the categories, which depends on which engine saw them first), with floats
+# equal within rel_tol (the engines sum means in a different order). Columns that hold one arbitrary reading of a
+# monitor day in the daily AQS files, and the group ids that create_micro_dataset numbers in an arbitrary order, are
+# left out. Other files are compared byte for byte.
+READING_FILES = ["chicago_co_2000_2012_daily", "chicago_no2_2000_2012_daily", "chicago_ozone_2000_2012_daily"]
+READING_COLUMNS = ["24_hour_local", "sample_measurement", "detection_limit", "measurement_uncertainty",
+                   "qualifier_description"]
+GROUP_ID_COLUMNS = ["route_side", "month_year", "route_date"]
+
+
+def read_table(path):
+    if path.suffix == ".parquet":
+        return pl.read_parquet(path)
+    if path.suffix == ".ipc":
+        return pl.read_ipc(path)
+    return pl.read_csv(path, infer_schema_length=None)
+
+
+def compare_file(polars_path, duckdb_path, rel_tol, abs_tol):
+    # (status, detail) of one output file
+    if not duckdb_path.exists():
+        return "missing", "not written by the duckdb engine"
+    if polars_path.suffix not in [".csv", ".parquet", ".ipc"]:
+        return ("equal", "") if polars_path.read_bytes() == duckdb_path.read_bytes() else ("different", "bytes")
+    excluded = [*(READING_COLUMNS if polars_path.stem in READING_FILES else []), *GROUP_ID_COLUMNS]
+    left, right = [read_table(path).drop(excluded, strict=False) for path in [polars_path, duckdb_path]]
+    try:
+        assert_frame_equal(left, right, check_row_order=False, check_column_order=False,
+                          rel_tol=rel_tol, abs_tol=abs_tol)
+    except AssertionError as error:
+        return "different", str(error).splitlines()[0]
+    return "equal", ""
+
+
+def compare_outputs(polars_path, duckdb_path, rel_tol=1e-9, abs_tol=1e-12):
+    names = sorted({path.name for path in [*polars_path.iterdir(), *duckdb_path.iterdir()] if path.is_file()})
+    rows = []
+    for name in names:
+        if not (polars_path / name).exists():
+            status, detail = "extra", "not written by the polars engine"
+        else:
+            status, detail = compare_file(polars_path / name, duckdb_path / name, rel_tol, abs_tol)
+        rows.append({"file": name, "status": status, "detail": detail})
+    return pl.DataFrame(rows, schema={"file": pl.String, "status": pl.String, "detail": pl.String})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the duckdb engine of DataPreprocessor writes the same "
+                                                 "outputs as the Polars engine.")
+    parser.add_argument("--input", type=Path, default=None,
+                        help="Raw data to build from. Defaults to synthetic raw data of --scale.")
+    parser.add_argument("--scale", type=float, default=0.01)
+    parser.add_argument("--start-year", type=int, default=2000)
+    parser.add_argument("--end-year", type=int, default=2002)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=["all", "micro_bands"])
+    parser.add_argument("--format", choices=["csv", "parquet", "ipc"], default="csv",
+                        help="Storage format of the intermediate files.")
+    parser.add_argument("--memory-limit", type=int, default=None,
+                        help="Memory limit (MB) of the DuckDB database.")
+    parser.add_argument("--rel-tol", type=float, default=1e-9)
+    parser.add_argument("--abs-tol", type=float, default=1e-12)
+    parser.add_argument("--work-path", type=Path, default=Path("parity_data"))
+    parser.add_argument("--output", type=Path, default=Path("parity_report.csv"))
+    parser.add_argument("--keep-data", action="store_true")
+    args = parser.parse_args(argv)
+
+    raw_path = args.input
+    if raw_path is None:
+        raw_path = args.work_path / "raw"
+        SyntheticRawData(raw_path, scale=args.scale, start_year=args.start_year, end_year=args.end_year,
+                         seed=args.seed).generate()
+    stages = with_dependencies([stage for target in args.targets for stage in TARGETS[target]])
+    for engine in ["polars", "duckdb"]:
+        DataPreprocessor(raw_path, args.work_path / engine, storage_format=args.format, engine=engine,
+                         memory_limit=None if engine == "polars" or args.memory_limit is None else
+                         args.memory_limit * 1024 ** 2).run(stages)
+
+    report = compare_outputs(args.work_path / "polars", args.work_path / "duckdb", args.rel_tol, args.abs_tol)
+    report.write_csv(args.output)
+    with pl.Config(tbl_rows=-1, fmt_str_lengths=100):
+        print(report)
+
+    if not args.keep_data:
+        shutil.rmtree(args.work_path, ignore_errors=True)
+    return 0 if (report["status"] == "equal").all() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,419 @@
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+
+STATE_CODE = 17
+COUNTY_CODE = 31
+
+# (site_num, poc) of the monitors DataPreprocessor keeps, by pollutant
+POLLUTANT_MONITORS = {
+    "co": [(3103, 1), (4002, 1), (6004, 1), (63, 1)],
+    "pm10": [(1016, 3), (22, 3)],
+    "no2": [(3103, 1), (4002, 1), (63, 1)],
+    "ozone": [(64, 1), (7002, 1), (4002, 1), (1003, 2), (72, 1)],
+}
+
+AQS_FILES = {
+    "co": ["co_chicago_20000101_20041231.txt", "co_chicago_20050101_20091231.txt",
+           "co_chicago_20100101_20121231.txt"],
+    "pm10": ["pm10_chicago_20000101_20041231.txt", "pm10_chicago_20050101_20091231.txt",
+             "pm10_chicago_20100101_20121231.txt"],
+    "no2": ["no2_chicago_20000101_20041231.txt", "no2_chicago_20050101_20091231.txt",
+            "no2_chicago_20100101_20121231.txt"],
+    "ozone": ["ozone_chicago_20000101_20050101.txt", "ozone_chicago_20050102_20091231.txt",
+              "ozone_chicago_20100101_20121231.txt"],
+}
+
+AQS_PARAMETERS = {
+    # parameter code, parameter name, units, typical hourly level, AQI parameter name
+    "co": (42101, "Carbon monoxide", "Parts per million", 0.5, "Carbon monoxide"),
+    "pm10": (81102, "PM10 Total 0-10um STP", "Micrograms/cubic meter (25 C)", 28.0, "PM10 Total 0-10um STP"),
+    "no2": (42602, "Nitrogen dioxide (NO2)", "Parts per billion", 22.0, "Nitrogen dioxide (NO2)"),
+    "ozone": (44201, "Ozone", "Parts per million", 0.03, "Ozone"),
+}
+
+AQS_COLUMNS = ["State Code", "County Code", "Site Num", "Parameter Code", "POC", "Latitude", "Longitude", "Datum",
+               "Parameter Name", "Sample Duration", "Pollutant Standard", "Date Local", "24 Hour Local", "Date GMT",
+               "24 Hour GMT", "Year GMT", "Day In Year GMT", "Sample Measurement", "Units of Measure",
+               "Sample Frequency", "Detection Limit", "Measurement Uncertainty", "Qualifier Description",
+               "Method Type", "Method Description", "Horizontal Accuracy"]
+
+FBI_CODES = ["01A", "02", "03", "04A", "04B", "05", "06", "07", "09", "08A", "08B", "10", "11", "14", "15", "16",
+             "17", "18", "19", "20", "24", "26"]
+FBI_CODE_WEIGHTS = [0.002, 0.004, 0.04, 0.03, 0.17, 0.06, 0.21, 0.05, 0.002, 0.04, 0.15, 0.01, 0.04, 0.11, 0.01,
+                    0.01, 0.005, 0.09, 0.002, 0.005, 0.002, 0.028]
+
+# Location boxes (lat_min, lat_max, lon_min, lon_max), orientation in degrees of the route segment
+ROUTE_GEOMETRY = {
+    "I90_A": ("I90", (41.86, 41.94), (-87.74, -87.66), 135),
+    "I90_B": ("I90", (41.79, 41.835), (-87.64, -87.62), 90),
+    "I90_C": ("I90", (41.70, 41.77), (-87.60, -87.56), 135),
+    "I94": ("I94", (41.68, 41.745), (-87.66, -87.63), 90),
+    "I55": ("I55", (41.80, 41.85), (-87.74, -87.66), 45),
+    "I290": ("I290", (41.86, 41.89), (-87.74, -87.66), 0),
+    "I57": ("I57", (41.66, 41.72), (-87.68, -87.64), 100),
+}
+
+WEATHER_STATIONS = [
+    # usaf, wban, name, latitude, longitude
+    (725340, 14819, "CHICAGO MIDWAY INTL ARPT", 41.786, -87.752),
+    (725300, 94846, "CHICAGO O'HARE INTL ARPT", 41.995, -87.934),
+    (725305, 94892, "WEST CHICAGO DU PAGE", 41.914, -88.246),
+    (725346, 14855, "CHICAGO/MEIGS", 41.867, -87.600),
+    (744655, 4807, "GARY CHICAGO AIRPORT", 41.617, -87.417),
+    (725347, 4838, "LANSING MUNICIPAL", 41.533, -87.533),
+]
+
+
+class SyntheticRawData:
+    def __init__(self,
+                 output_path: Path,
+                 scale: float = 0.01,
+                 start_year: int = 2000,
+                 end_year: int = 2012,
+                 seed: int = 0,):
+        self.output_path = Path(output_path)
+        self.scale = scale
+        self.start_year = start_year
+        self.end_year = end_year
+        self.rng = np.random.default_rng(seed)
+
+        # Data sets keyed on dates need at least one year before the citylevel sample starts
+        self.dates = pl.date_range(date(start_year, 1, 1), date(end_year, 12, 31), eager=True)
+        self.n_extra_entities = int(round(8 * scale))
+
+        os.makedirs(self.output_path, exist_ok=True)
+
+    def generate(self):
+        self.write_crime_data()
+        self.write_crime_interstate_distance()
+        self.write_aqs_data()
+        self.write_aqi_data()
+        self.write_ghcn_data()
+        self.write_hourly_weather_data()
+        self.write_sky_cover()
+        self.write_micro_dataset()
+
+    # Crime ---------------------------------------------------------------------------------------------------------
+    def write_crime_data(self):
+        # The crime portal extract starts in 2001
+        dates = self.dates.filter(self.dates.dt.year() >= 2001)
+        crimes_per_day = self.rng.poisson(max(1200 * self.scale, 1), dates.len())
+        n = int(crimes_per_day.sum())
+        crime_dates = dates.gather(np.repeat(np.arange(dates.len()), crimes_per_day))
+        seconds = self.rng.integers(0, 24 * 3600, n)
+        # Every FBI code must appear at least once so that the citylevel pivot is complete
+        fbi_code = np.concatenate([FBI_CODES, self.rng.choice(FBI_CODES, n - len(FBI_CODES),
+                                                              p=np.array(FBI_CODE_WEIGHTS) / sum(FBI_CODE_WEIGHTS))])
+        fbi_code = self.rng.permutation(fbi_code)
+        routes = self.rng.choice(list(ROUTE_GEOMETRY), n)
+        latitude, longitude = self._route_locations(routes)
+        ids = self.rng.permutation(n) + 1_000_000
+
+        crime_data = (pl.DataFrame({
+            "ID": ids,
+            "Case Number": [f"H{id_}" for id_ in ids],
+            "date_local": crime_dates,
+            "seconds": seconds,
+            "Block": "0000X W MADISON ST",
+            "IUCR": "0486",
+            "Primary Type": "BATTERY",
+            "Description": "DOMESTIC BATTERY SIMPLE",
+            "Location Description": "STREET",
+            "Arrest": self.rng.random(n) < 0.25,
+            "Domestic": self.rng.random(n) < 0.15,
+            "Beat": self.rng.integers(111, 2535, n),
+            "District": self.rng.integers(1, 26, n),
+            "Ward": self.rng.integers(1, 51, n),
+            "Community Area": self.rng.integers(1, 78, n),
+            "FBI Code": fbi_code,
+            "X Coordinate": ((longitude + 87.9) * 270_000 + 1_100_000).astype(np.int64),
+            "Y Coordinate": ((latitude - 41.64) * 365_000 + 1_813_000).astype(np.int64),
+            "Updated On": "04/15/2016 08:55:02 AM",
+            "Latitude": latitude,
+            "Longitude": longitude,})
+                      .with_columns(
+            (pl.col("date_local").cast(pl.Datetime) + pl.duration(seconds=pl.col("seconds")))
+            .dt.strftime("%m/%d/%Y %I:%M:%S %p").alias("Date"),
+            pl.col("date_local").dt.year().alias("Year"),
+            pl.format("({}, {})", pl.col("Latitude"), pl.col("Longitude")).alias("Location"))
+                      .select("ID", "Case Number", "Date", "Block", "IUCR", "Primary Type", "Description",
+                              "Location Description", "Arrest", "Domestic", "Beat", "District", "Ward",
+                              "Community Area", "FBI Code", "X Coordinate", "Y Coordinate", "Year", "Updated On",
+                              "Latitude", "Longitude", "Location")
+                      )
+        crime_data.write_csv(self.output_path / "chicago_crime.csv")
+        # The interstate near-table only covers part 1 crimes
+        self._crimes = (crime_data
+                        .with_columns(pl.Series("route", routes))
+                        .filter(pl.col("FBI Code").is_in(["01A", "02", "03", "04A", "04B", "05", "06", "07", "09"]))
+                        .select("ID", "Latitude", "Longitude", "route"))
+
+    def _route_locations(self, routes):
+        latitude = np.empty(len(routes))
+        longitude = np.empty(len(routes))
+        for route, (_, lat_range, lon_range, _) in ROUTE_GEOMETRY.items():
+            mask = routes == route
+            latitude[mask] = self.rng.uniform(*lat_range, mask.sum())
+            longitude[mask] = self.rng.uniform(*lon_range, mask.sum())
+        return latitude.round(9), longitude.round(9)
+
+    def write_crime_interstate_distance(self):
+        crimes = self._crimes
+        n = crimes.height
+        route = crimes["route"].to_numpy()
+        orientation = np.array([ROUTE_GEOMETRY[r][3] for r in route])
+        # Crimes fall on either side of the interstate, orthogonal to the segment orientation
+        side = self.rng.integers(0, 2, n)
+        near_angle_1 = ((orientation + 90 + 180 * side + 180) % 360 - 180).round()
+        near_dist_1 = self.rng.uniform(0, 7000, n).round(4)
+        near_dist_2 = (near_dist_1 + self.rng.uniform(2000, 12000, n)).round(4)
+        other_routes = np.array(["I90", "I94", "I55", "I290", "I57"])
+        route_2 = other_routes[self.rng.integers(0, len(other_routes), n)]
+        route_1 = np.array([ROUTE_GEOMETRY[r][0] for r in route])
+        route_2 = np.where(route_2 == route_1, np.where(route_1 == "I94", "I57", "I94"), route_2)
+
+        near_data = (pl.DataFrame({
+            "ID": np.concatenate([crimes["ID"].to_numpy()] * 2),
+            "Latitude": np.concatenate([crimes["Latitude"].to_numpy()] * 2),
+            "Longitude": np.concatenate([crimes["Longitude"].to_numpy()] * 2),
+            "FEAT_SEQ": np.concatenate([np.arange(n)] * 2) + 1,
+            "FREQUENCY": 2,
+            "NEAR_RANK": np.repeat([1, 2], n),
+            "NEAR_DIST": np.concatenate([near_dist_1, near_dist_2]),
+            "NEAR_ANGLE": np.concatenate([near_angle_1, self.rng.uniform(-180, 180, n).round()]),
+            "ROUTE_NUM": np.concatenate([route_1, route_2]),
+            "Shape_Length": np.concatenate([self.rng.uniform(1000, 90000, n).round(3)] * 2)})
+                     .sample(fraction=1, shuffle=True, seed=int(self.rng.integers(0, 2**31)))
+                     .with_row_index("OBJECTID", offset=1)
+                     )
+        near_data.write_csv(self.output_path / "Chicago_Crime_Interstate_Distance_0606.csv")
+
+    # Pollution -----------------------------------------------------------------------------------------------------
+    def write_aqs_data(self):
+        for pollutant, files in AQS_FILES.items():
+            monitors = POLLUTANT_MONITORS[pollutant] + [(9000 + i, 1) for i in range(self.n_extra_entities)]
+            for file in files:
+                start, end = [datetime.strptime(part, "%Y%m%d").date()
+                              for part in file.removesuffix(".txt").split("_")[-2:]]
+                file_dates = self.dates.filter(self.dates.is_between(start, end))
+                if file_dates.len() == 0:
+                    # Files outside the generated year range carry a single day so every file has typed columns
+                    file_dates = pl.Series("date", [start])
+                aqs_data = pl.concat([self._aqs_monitor_data(pollutant, site, poc, file_dates)
+                                      for site, poc in monitors])
+                self._write_aqs_file(aqs_data, self.output_path / file)
+
+    def _aqs_monitor_data(self, pollutant, site, poc, dates):
+        parameter_code, parameter_name, units, level, _ = AQS_PARAMETERS[pollutant]
+        n_days = dates.len()
+        hourly = pl.DataFrame({
+            "date": dates.gather(np.repeat(np.arange(n_days), 24)),
+            "hour": np.tile(np.arange(24), n_days),
+            "Sample Measurement": (level * self.rng.lognormal(0, 0.5, n_days * 24)).round(3),
+            "Sample Duration": "1 HOUR",
+            "Sample Frequency": "",
+        })
+        # Drop roughly 5% of hourly readings to exercise the minimum-coverage filters
+        hourly = hourly.with_columns(
+            pl.when(pl.Series(self.rng.random(hourly.height) < 0.05))
+            .then(None)
+            .otherwise(pl.col("Sample Measurement"))
+            .alias("Sample Measurement"))
+
+        frames = [hourly]
+        if pollutant == "pm10":
+            daily = (hourly
+                     .group_by("date")
+                     .agg(pl.col("Sample Measurement").mean().round(1))
+                     .with_columns(
+                pl.lit(0, dtype=pl.Int64).alias("hour"),
+                pl.lit("24-HR BLK AVG").alias("Sample Duration"),
+                pl.lit("").alias("Sample Frequency"))
+                     .select(hourly.columns))
+            frames.append(daily)
+        elif site >= 9000 and pollutant == "co":
+            # Filter-based monitors report a single daily sample
+            frames = [hourly
+                      .filter(pl.col("hour") == 0)
+                      .with_columns(
+                pl.lit("24 HOUR").alias("Sample Duration"),
+                pl.lit("EVERY 6TH DAY ").alias("Sample Frequency"))]
+
+        latitude, longitude = 41.75 + site % 97 / 400, -87.75 + site % 89 / 400
+        return (pl.concat(frames)
+                .with_columns(
+            pl.lit(STATE_CODE).alias("State Code"),
+            pl.lit(COUNTY_CODE).alias("County Code"),
+            pl.lit(site).alias("Site Num"),
+            pl.lit(parameter_code).alias("Parameter Code"),
+            pl.lit(poc).alias("POC"),
+            pl.lit(latitude).alias("Latitude"),
+            pl.lit(longitude).alias("Longitude"),
+            pl.lit("WGS84").alias("Datum"),
+            pl.lit(parameter_name).alias("Parameter Name"),
+            pl.lit(f"{parameter_name} 1-hour").alias("Pollutant Standard"),
+            pl.col("date").dt.strftime("%Y-%m-%d").alias("Date Local"),
+            pl.format("{}:00", pl.col("hour").cast(pl.String).str.zfill(2)).alias("24 Hour Local"),
+            (pl.col("date").cast(pl.Datetime) + pl.duration(hours=pl.col("hour") + 6)).alias("gmt"),
+            pl.lit(units).alias("Units of Measure"),
+            pl.lit(level / 50).alias("Detection Limit"),
+            pl.lit(None, dtype=pl.String).alias("Measurement Uncertainty"),
+            pl.lit(None, dtype=pl.String).alias("Qualifier Description"),
+            pl.lit("FEM").alias("Method Type"),
+            pl.lit("INSTRUMENTAL").alias("Method Description"),
+            pl.lit(30.0).alias("Horizontal Accuracy"))
+                .with_columns(
+            pl.col("gmt").dt.strftime("%Y-%m-%d").alias("Date GMT"),
+            pl.col("gmt").dt.strftime("%H:%M").alias("24 Hour GMT"),
+            pl.col("gmt").dt.year().alias("Year GMT"),
+            pl.col("gmt").dt.ordinal_day().alias("Day In Year GMT"))
+                .sort("date", "Sample Duration", "hour")
+                .select(AQS_COLUMNS)
+                .cast(pl.String)
+                )
+
+    @staticmethod
+    def _write_aqs_file(data, path):
+        data.write_csv(path)
+        with open(path, "a") as file:
+            file.write("END OF FILE\n")
+
+    def write_aqi_data(self):
+        aqi_dates = pl.date_range(date(self.start_year, 1, 1), date(max(self.end_year, 2015), 12, 31), eager=True)
+        frames = []
+        for pollutant, monitors in POLLUTANT_MONITORS.items():
+            *_, aqi_parameter_name = AQS_PARAMETERS[pollutant]
+            for i, (site, poc) in enumerate(monitors + [(9000 + i, 1) for i in range(self.n_extra_entities)]):
+                frames.append(pl.DataFrame({
+                    "statecode": STATE_CODE,
+                    "countycode": COUNTY_CODE,
+                    "sitenum": site,
+                    "poc": poc,
+                    "parametername": aqi_parameter_name,
+                    "datelocal": aqi_dates.dt.strftime("%Y-%m-%d"),
+                    "aqi": self.rng.gamma(4, 9, aqi_dates.len()).round(),
+                    "cityname": "Chicago" if i % 3 else "Cicero",
+                }))
+        aqi_data = pl.concat(frames).to_pandas()
+        aqi_data.to_stata(self.output_path / "chicago_aqi_2000_2015.dta", write_index=False)
+
+    # Weather -------------------------------------------------------------------------------------------------------
+    def write_ghcn_data(self):
+        ghcn_dates = pl.date_range(date(1991, 1, 1), date(self.end_year, 12, 31), eager=True)
+        n_days = ghcn_dates.len()
+        day_of_year = ghcn_dates.dt.ordinal_day().to_numpy()
+        seasonal = -np.cos(2 * np.pi * (day_of_year - 15) / 365)
+        frames = []
+        for station_id in ["USW00014819", "USW00094846"]:
+            tmax = 150 + 140 * seasonal + self.rng.normal(0, 50, n_days)
+            values = {
+                "TMAX": tmax,
+                "TMIN": tmax - self.rng.uniform(40, 120, n_days),
+                "PRCP": np.where(self.rng.random(n_days) < 0.65, 0, self.rng.gamma(0.8, 80, n_days)),
+                "SNOW": np.where(seasonal > 0.5, self.rng.gamma(0.3, 20, n_days), 0),
+                "SNWD": np.where(seasonal > 0.6, self.rng.gamma(0.5, 30, n_days), 0),
+                "AWND": self.rng.gamma(9, 5, n_days),
+            }
+            for element, value in values.items():
+                frames.append(pl.DataFrame({
+                    "station_id": station_id,
+                    "strdate": ghcn_dates.dt.strftime("%Y%m%d").cast(pl.Int64),
+                    "element": element,
+                    "value": value.round().astype(np.int64),
+                    "mflag": None,
+                    "qflag": pl.Series(np.where(self.rng.random(n_days) < 0.002, "I", "")).replace("", None),
+                    "sflag": "W",
+                    "obstime": 2400,
+                }, schema_overrides={"mflag": pl.String}))
+        pl.concat(frames).sort("station_id", "strdate", "element").write_csv(
+            self.output_path / "chicago_midwayohare_ghcn_daily_1991_2012.csv")
+
+    def write_hourly_weather_data(self):
+        n_days = self.dates.len()
+        n_hours = n_days * 24
+        day_of_year = np.repeat(self.dates.dt.ordinal_day().to_numpy(), 24)
+        seasonal = -np.cos(2 * np.pi * (day_of_year - 15) / 365)
+        frames = []
+        for usaf, wban, name, latitude, longitude in WEATHER_STATIONS[:2 + self.n_extra_entities]:
+            wind_speed = self.rng.gamma(3, 15, n_hours).round()
+            # Daily prevailing wind so that daily averages are directional
+            wind_angle = ((np.repeat(self.rng.uniform(0, 360, n_days), 24) + self.rng.normal(0, 30, n_hours))
+                          % 360 // 10 * 10)
+            calm = self.rng.random(n_hours) < 0.03
+            missing = self.rng.random(n_hours) < 0.01
+            temp = (100 + 130 * seasonal + self.rng.normal(0, 30, n_hours)).round()
+            frames.append(pl.DataFrame({
+                "usaf": usaf,
+                "wban": wban,
+                "year": np.repeat(self.dates.dt.year().to_numpy(), 24),
+                "month": np.repeat(self.dates.dt.month().to_numpy(), 24),
+                "day": np.repeat(self.dates.dt.day().to_numpy(), 24),
+                "hour": np.tile(np.arange(24), n_days),
+                "min": 53,
+                "latitude": latitude,
+                "longitude": longitude,
+                "elevation": 190,
+                "wind_angle": np.where(calm, 999, np.where(missing, 999, wind_angle)).astype(np.int64),
+                "wind_angle_qual": np.where(missing, "9", "5"),
+                "wind_obs_type": np.where(calm, "C", "N"),
+                "wind_speed": np.where(calm, 0, np.where(missing, 9999, wind_speed)).astype(np.int64),
+                "wind_speed_qual": np.where(missing, "9", "5"),
+                "temp": np.where(missing, 9999, temp).astype(np.int64),
+                "temp_qual": np.where(missing, "9", np.where(self.rng.random(n_hours) < 0.5, "5", "A")),
+                "dewpoint": np.where(missing, 9999, temp - self.rng.uniform(10, 80, n_hours).round()).astype(np.int64),
+                "dewpoint_qual": np.where(missing, "9", np.where(self.rng.random(n_hours) < 0.5, "5", "A")),
+                "sealevel_pressure": np.where(missing, 99999,
+                                              10160 + self.rng.normal(0, 70, n_hours).round()).astype(np.int64),
+                "sealevel_pressure_qual": np.where(missing, "9", "5"),
+                "stationname": name,
+            }))
+        weather_data = pl.concat(frames).to_pandas()
+        weather_data.to_stata(self.output_path / "chicago_hourly_weather_stations.dta", write_index=False)
+
+    def write_sky_cover(self):
+        n_days = self.dates.len()
+        hours = np.arange(7, 19)
+        value = self.rng.beta(0.7, 0.7, n_days * len(hours)).round(2).astype(str)
+        value = np.where(self.rng.random(value.size) < 0.02, "M", value)
+        # The station record opens with a missing reading, which makes the column textual on inference
+        value[0] = "M"
+        sky_data = pl.DataFrame({
+            "mm/dd/yyyy": self.dates.gather(np.repeat(np.arange(n_days), len(hours))).dt.strftime("%m/%d/%Y"),
+            "hh": np.tile(hours, n_days),
+            "Sky Cov": value,
+        })
+        header = [f"# Synthetic sky cover for Chicago Midway (MDW), line {i + 1}" for i in range(17)]
+        with open(self.output_path / "sky_cover_MDW.txt", "w") as file:
+            file.write("\n".join(header) + "\n")
+            sky_data.write_csv(file, separator="\t")
+
+    def write_micro_dataset(self):
+        dates = self.dates.filter(self.dates.dt.year().is_between(2001, 2012))
+        panel = (pl.DataFrame({"route_num1_mod": list(ROUTE_GEOMETRY)})
+                 .join(pl.DataFrame({"routeside": [0, 1]}), how="cross")
+                 .join(pl.DataFrame({"violent": [0, 1]}), how="cross")
+                 .join(pl.DataFrame({"date": dates}), how="cross")
+                 .with_columns(
+            pl.Series("insample", self.rng.random(dates.len() * 28) < 0.4).cast(pl.Int8),
+            pl.Series("treatment", self.rng.integers(0, 2, dates.len() * 28)).cast(pl.Int8),
+            pl.Series("num_crimes", self.rng.poisson(max(3 * self.scale * 100, 1), dates.len() * 28)),
+            pl.Series("tmax", self.rng.normal(150, 100, dates.len() * 28).round()),
+            pl.Series("valueTMAX_MIDWAY", self.rng.normal(15, 10, dates.len() * 28).round(1)),
+            pl.Series("valuePRCP_MIDWAY", self.rng.gamma(0.5, 4, dates.len() * 28).round(1)),
+            pl.Series("avg_wind_speed", self.rng.gamma(3, 15, dates.len() * 28).round(1)))
+                 .with_columns(
+            (pl.col("num_crimes") / pl.col("num_crimes").mean().over("violent")).alias("stand_crimes"),
+            (pl.col("route_num1_mod").rank("dense") * 10 + pl.col("routeside")).alias("routeside"),
+            pl.col("date").rank("dense").cast(pl.Int64).alias("routedate"))
+                 .with_columns(
+            (pl.col("routedate") * 10 + pl.col("route_num1_mod").rank("dense")).alias("routedate"))
+                 )
+        micro_data = panel.to_pandas()
+        micro_data["date"] = pd.to_datetime(micro_data["date"])
+        micro_data.to_stata(self.output_path / "micro_dataset.dta", write_index=False, convert_dates={"date": "td"})
@@ -0,0 +1,143 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+
+from code.estimation.fixed_effects import (cluster_adjustment, demean, demeaned_design, group_codes, model_frame,
+                                          nested_in)
+
+# Wild cluster bootstrap of a t test on one coefficient (Cameron, Gelbach and Miller 2008), computed as in Roodman et
+# al. (2019, "Fast and wild"): everything a draw needs is reduced to cluster-level quantities once, so that the
+# bootstrap t statistics of all draws are a (clusters x clusters) @ (clusters x draws) product. The raw data is never
+# touched again, whatever the number of draws. FE that are not nested in the clusters are swept out of the bootstrap
+# outcomes once per cluster (CLUSTER_BLOCK clusters at a time), which stays linear in the weights.
+WEBB = np.sqrt(np.array([1.5, 1.0, 0.5, 0.5, 1.0, 1.5])) * np.array([-1, -1, -1, 1, 1, 1])
+
+SHARD_SIZE = 10_000
+CLUSTER_BLOCK = 64
+
+
+class BootstrapResult:
+    def __init__(self, param, estimate, std_error, t_stat, p_value, t_draws, n_clusters, weights, impose_null,
+                 null_value, enumerated):
+        self.param = param
+        self.estimate = estimate
+        self.std_error = std_error
+        self.t_stat = t_stat
+        self.p_value = p_value
+        self.t_draws = t_draws
+        self.n_clusters = n_clusters
+        self.weights = weights
+        self.impose_null = impose_null
+        self.null_value = null_value
+        # All 2^G Rademacher weight vectors were used instead of random draws
+        self.enumerated = enumerated
+
+    @property
+    def draws(self):
+        return len(self.t_draws)
+
+
+def _weights(weights, n_clusters, draws, seed):
+    rng = np.random.default_rng(seed)
+    if weights == "rademacher":
+        return rng.choice([-1.0, 1.0], size=(n_clusters, draws))
+    return rng.choice(WEBB, size=(n_clusters, draws))
+
+
+def _all_signs(n_clusters, start, stop):
+    # Rows start..stop-1 of the 2^G sign patterns, one weight vector per column
+    patterns = np.arange(start, stop)[None, :] >> np.arange(n_clusters)[:, None]
+    return (patterns & 1) * 2.0 - 1
+
+
+def _bootstrap_shard(numerator, spread, adj, shard):
+    # t statistics of one shard of draws: the coefficient moves by numerator @ v and its cluster scores by spread @ v
+    kind, args = shard
+    v = _all_signs(*args) if kind == "enumerate" else _weights(*args)
+    return (numerator @ v) / np.sqrt(adj * ((spread @ v) ** 2).sum(axis=0))
+
+
+def wild_cluster_bootstrap(data, y, x, param, cluster, fe=(), draws=9999, weights="rademacher", impose_null=True,
+                           null_value=0.0, seed=0, jobs=1, tol=1e-8, max_iter=10_000):
+    # Tests param = null_value in the feols model of y on x (absorbing fe) with CR1 standard errors by cluster.
+    # impose_null=True is the restricted bootstrap (WCR), False the unrestricted one (WCU). With Rademacher weights
+    # and 2^G <= draws, all 2^G weight vectors are enumerated and the p-value is exact. Shards of draws run in jobs
+    # processes; their seeds only depend on seed, so the result does not depend on jobs.
+    if weights not in ["rademacher", "webb"]:
+        raise ValueError(f"Unknown weights {weights!r}. Use 'rademacher' or 'webb'.")
+    frame, terms, fe = model_frame(data, [y], x, fe=fe, columns=[cluster])
+    frame = frame.filter(pl.col(y).is_finite())
+    design = demeaned_design(frame, [y], terms, fe, tol=tol, max_iter=max_iter)
+    if param not in design.names:
+        raise ValueError(f"{param!r} is not an estimated coefficient (dropped: {design.dropped}).")
+    a = design.names.index(param)
+    X, Y = design.X_tilde, design.Y_tilde[:, 0]
+    cluster_codes = group_codes(frame, cluster)
+    n_clusters = int(cluster_codes.max()) + 1
+    adj = cluster_adjustment(design.fe_codes, cluster_codes, design.nobs, X.shape[1] + design.n_fe)
+
+    bread = np.linalg.inv(X.T @ X)
+    coef = bread @ (X.T @ Y)
+    residuals = Y - X @ coef
+    if impose_null:
+        others = [j for j in range(X.shape[1]) if j != a]
+        target = Y - null_value * X[:, a]
+        residuals_boot = target - X[:, others] @ np.linalg.lstsq(X[:, others], target, rcond=None)[0]
+    else:
+        residuals_boot = residuals
+
+    # Cluster-level building blocks: score sums s_g = X_g'u_g and the row of the bread for param applied to the
+    # cluster cross products H_g = X_g'X_g
+    order = np.argsort(cluster_codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(cluster_codes[order]) != 0])
+    ends = np.r_[starts[1:], len(order)]
+    bread_row = bread[a]
+    scores = np.add.reduceat(X[order] * residuals[order, None], starts, axis=0)
+    scores_boot = np.add.reduceat(X[order] * residuals_boot[order, None], starts, axis=0)
+    cross = np.stack([X[order[start:end]].T @ (X[order[start:end]] @ bread_row)
+                      for start, end in zip(starts, ends)])
+
+    std_error = float(np.sqrt(adj * ((scores @ bread_row) ** 2).sum()))
+    t_stat = (coef[a] - null_value) / std_error
+
+    # With weights v the bootstrap coefficient moves by bread_row S'v and the score of cluster g along bread_row
+    # becomes (own v)_g - (cross A S')_g v. The demeaned bootstrap outcome is the fit plus the FE-swept weighted
+    # residuals, so own[g, h] is cluster g's score on the swept residuals of cluster h: v_g c_g on the diagonal when
+    # every FE is nested in the clusters (the residuals are already orthogonal to them).
+    numerator = scores_boot @ bread_row
+    if all(nested_in(codes, cluster_codes) for codes in design.fe_codes):
+        own = np.diag(numerator)
+    else:
+        weight = X[order] @ bread_row
+        own = np.empty((n_clusters, n_clusters))
+        for block in range(0, n_clusters, CLUSTER_BLOCK):
+            clusters = np.arange(block, min(block + CLUSTER_BLOCK, n_clusters))
+            split = np.where(cluster_codes[:, None] == clusters, residuals_boot[:, None], 0.0)
+            swept, _ = demean(split, design.fe_codes, tol=tol, max_iter=max_iter)
+            own[:, clusters] = np.add.reduceat(weight[:, None] * swept[order], starts, axis=0)
+    spread = own - cross @ bread @ scores_boot.T
+
+    enumerated = weights == "rademacher" and 2 ** n_clusters <= draws
+    if enumerated:
+        total = 2 ** n_clusters
+        shards = [("enumerate", (n_clusters, start, min(start + SHARD_SIZE, total)))
+                  for start in range(0, total, SHARD_SIZE)]
+    else:
+        seeds = np.random.SeedSequence(seed).spawn(-(-draws // SHARD_SIZE))
+        shards = [("sample", (weights, n_clusters, min(SHARD_SIZE, draws - i * SHARD_SIZE), shard_seed))
+                  for i, shard_seed in enumerate(seeds)]
+    if jobs > 1 and len(shards) > 1:
+        # Spawned, not forked: a fork after the Polars thread pool has started can deadlock
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+            t_draws = list(executor.map(_bootstrap_shard, *zip(*[(numerator, spread, adj, shard)
+                                                                  for shard in shards])))
+    else:
+        t_draws = [_bootstrap_shard(numerator, spread, adj, shard) for shard in shards]
+    t_draws = np.concatenate(t_draws)
+
+    # Symmetric p-value
+    p_value = float(np.mean(np.abs(t_draws) >= abs(t_stat) - 1e-12 * abs(t_stat)))
+    return BootstrapResult(param, float(coef[a]), std_error, float(t_stat), p_value, t_draws, n_clusters, weights,
+                           impose_null, null_value, enumerated)
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from code.estimation.bootstrap import BootstrapResult, wild_cluster_bootstrap
+from code.estimation.fixed_effects import FixedEffectsResult, feols_multi
+
+# On-disk memo of estimation results. An entry is keyed by the content hash of the input dataset and the canonical
+# JSON of the model specification (outcomes, regressors, fixed effects, vcov, sample filter, seed, ...), so a refit of
+# an unchanged specification on unchanged data is a file read, and any change to the data or the specification is a
+# new key. Polars expressions enter the key by their JSON serialization (their printed form shortens long literals).
+# Entries hold the coefficients, the vcov and the fit metadata, not the residuals (cached fits have residuals=None), in
+# one .npz file each. The directory is kept under max_bytes by evicting the least recently used entries; a read marks
+# an entry as used by touching its file.
+CACHE_VERSION = 3
+
+
+def frame_hash(data):
+    # Content hash of a data frame: its schema and the hashes of its rows (row hashes depend on the polars version)
+    digest = hashlib.sha256(json.dumps([pl.__version__, CACHE_VERSION, [[name, str(dtype)] for name, dtype
+                                                                        in data.schema.items()]]).encode())
+    digest.update(data.hash_rows(seed=0).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _canonical(value):
+    if isinstance(value, pl.Expr):
+        return value.meta.serialize(format="json")
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class EstimationCache:
+    def __init__(self, directory, max_bytes=1024 ** 3):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data_hash, spec):
+        canonical = json.dumps([CACHE_VERSION, data_hash, _canonical(spec)], sort_keys=True)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _path(self, key):
+        return self.directory / f"{key}.npz"
+
+    def get(self, key):
+        # (arrays, metadata) of an entry, or None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files if name != "metadata"}
+                metadata = json.loads(str(entry["metadata"]))
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays, metadata
+
+    def put(self, key, arrays, metadata):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name and renamed, so that concurrent workers never read a partial entry
+        temporary = self.directory / f".{key}.{uuid.uuid4().hex}.npz"
+        np.savez(temporary, metadata=np.array(json.dumps(metadata, default=_scalar)), **arrays)
+        os.replace(temporary, self._path(key))
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path.stem == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for path in self.directory.glob("*.npz"):
+            path.unlink(missing_ok=True)
+
+    def _memoize(self, data, data_hash, sample, spec, compute, encode, decode):
+        # data_hash is the hash of data before the sample filter; callers that fit several samples of one dataset
+        # pass it to hash the data once
+        key = self.key(data_hash or frame_hash(data), {**spec, "sample": sample})
+        entry = self.get(key)
+        if entry is not None:
+            return decode(*entry)
+        result = compute(data if sample is None else data.filter(sample))
+        self.put(key, *encode(result))
+        return result
+
+    def feols_multi(self, data, ys, x, fe=(), sample=None, data_hash=None, **options):
+        # feols_multi on the rows of data that meet sample, with the same options
+        ys = list(ys)
+        spec = {"model": "feols", "ys": ys, "x": list(x), "fe": list(fe), **options}
+
+        def encode(results):
+            arrays = {f"{kind}_{j}": getattr(results[y], kind) for j, y in enumerate(ys) for kind in ["coef", "vcov"]}
+            metadata = [{name: getattr(results[y], name)
+                         for name in ["terms", "nobs", "df_resid", "df_t", "r2", "within_r2", "vcov_type", "dropped",
+                                      "fe_levels", "iterations", "first_stage_f"]}
+                        for y in ys]
+            return arrays, metadata
+
+        def decode(arrays, metadata):
+            return {y: FixedEffectsResult(fit["terms"], arrays[f"coef_{j}"], arrays[f"vcov_{j}"], None, fit["nobs"],
+                                          fit["df_resid"], fit["df_t"], fit["r2"], fit["within_r2"], fit["vcov_type"],
+                                          fit["dropped"], fit["fe_levels"], fit["iterations"], fit["first_stage_f"])
+                    for j, (y, fit) in enumerate(zip(ys, metadata))}
+
+        return self._memoize(data, data_hash, sample, spec,
+                             lambda frame: feols_multi(frame, ys, x, fe=fe, **options), encode, decode)
+
+    def wild_cluster_bootstrap(self, data, y, x, param, cluster, fe=(), sample=None, data_hash=None, **options):
+        # wild_cluster_bootstrap on the rows of data that meet sample; the seed is part of the key, jobs is not since
+        # the draws do not depend on it
+        spec = {"model": "wild_cluster_bootstrap", "y": y, "x": list(x), "param": param, "cluster": cluster,
+                "fe": list(fe), **{name: value for name, value in options.items() if name != "jobs"}}
+        fields = ["param", "estimate", "std_error", "t_stat", "p_value", "n_clusters", "weights", "impose_null",
+                  "null_value", "enumerated"]
+
+        def encode(result):
+            return {"t_draws": result.t_draws}, {name: getattr(result, name) for name in fields}
+
+        def decode(arrays, metadata):
+            values = {**metadata, "t_draws": arrays["t_draws"]}
+            return BootstrapResult(*[values[name] for name in fields[:5]], values["t_draws"],
+                                   *[values[name] for name in fields[5:]])
+
+        return self._memoize(data, data_hash, sample, spec,
+                             lambda frame: wild_cluster_bootstrap(frame, y, x, param, cluster, fe=fe, **options),
+                             encode, decode)
@@ -0,0 +1,372 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+import polars as pl
+
+
+# OLS with absorbed fixed effects, following the defaults of fixest::feols. Fixed effects are swept out of the
+# outcome and the regressors by alternating projections on integer group codes (one bincount per FE dimension and
+# sweep), so no dummy matrix is ever built. With a single FE dimension one sweep is exact.
+
+def group_codes(data, columns):
+    # Dense integer codes 0..G-1 of the groups formed by one or several columns
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    codes = None
+    for col in columns:
+        # Combine the codes of the columns arithmetically; ranking integers is much faster than ranking structs
+        column_codes = data.select(pl.col(col).rank("dense").cast(pl.Int64) - 1).to_series()
+        if codes is None:
+            codes = column_codes
+        else:
+            codes = (codes * (column_codes.max() + 1) + column_codes).rank("dense").cast(pl.Int64) - 1
+    return codes.to_numpy()
+
+
+def demean(matrix, fe_codes, tol=1e-8, max_iter=10_000):
+    # Method of alternating projections: subtract the group means of every FE dimension in turn until a full sweep
+    # changes no column by more than tol (relative to its scale)
+    matrix = np.array(matrix, dtype=np.float64, copy=True)
+    if matrix.ndim == 1:
+        matrix = matrix[:, None]
+    if not fe_codes:
+        return matrix, 0
+    counts = [np.bincount(codes).astype(np.float64) for codes in fe_codes]
+    scale = np.maximum(np.abs(matrix).max(axis=0), 1.0)
+    for iteration in range(1, max_iter + 1):
+        change = np.zeros(matrix.shape[1])
+        for codes, count in zip(fe_codes, counts):
+            for j in range(matrix.shape[1]):
+                means = np.bincount(codes, weights=matrix[:, j], minlength=len(count)) / count
+                means = means[codes]
+                matrix[:, j] -= means
+                change[j] = max(change[j], np.abs(means).max())
+        if len(fe_codes) == 1 or np.all(change / scale < tol):
+            return matrix, iteration
+    raise RuntimeError(f"Fixed effects did not converge within {max_iter} iterations (tol={tol}).")
+
+
+def factor_dummies(data, column, drop_first=True):
+    # Indicator expressions for the levels of a categorical regressor, named like fixest ("routeside::2")
+    levels = data.get_column(column).drop_nulls().unique().sort().to_list()
+    if drop_first:
+        levels = levels[1:]
+    return [(pl.col(column) == level).cast(pl.Float64).alias(f"{column}::{level}") for level in levels]
+
+
+def _drop_collinear(X, reference, tol=1e-10):
+    # Keep regressors in order unless they are absorbed by the fixed effects (almost nothing left of their sum of
+    # squares in reference after demeaning) or are a linear combination of the regressors kept before them. Sweeping
+    # a kept column out of the Gram matrix leaves the residual sums of squares of the later columns on its diagonal.
+    gram = X.T @ X
+    swept = gram.copy()
+    kept = []
+    for j in range(X.shape[1]):
+        if gram[j, j] <= tol * reference[j] or swept[j, j] <= tol * gram[j, j]:
+            continue
+        kept.append(j)
+        swept -= np.outer(swept[:, j], swept[j, :]) / swept[j, j]
+    return kept
+
+
+def _t_cdf(t, df):
+    # Student t distribution via the regularized incomplete beta function (continued fraction of Numerical Recipes),
+    # vectorized over t
+    t = np.asarray(t, dtype=np.float64)
+    x = df / (df + t * t)
+    a, b = df / 2, 0.5
+    with np.errstate(divide="ignore"):
+        front = np.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * np.log(x) + b * np.log1p(-x))
+    # The continued fraction converges fast for x < (a + 1) / (a + b + 2), otherwise use the symmetry I_x(a, b)
+    # = 1 - I_{1-x}(b, a)
+    direct = x < (a + 1) / (a + b + 2)
+    fraction = _beta_continued_fraction(np.where(direct, x, 1 - x), np.where(direct, a, b), np.where(direct, b, a))
+    tail = np.where(direct, front * fraction / a, 1 - front * fraction / b)
+    return np.where(t == 0, 0.5, np.where(t > 0, 1 - tail / 2, tail / 2))
+
+
+def _beta_continued_fraction(x, a, b, max_iter=300, eps=3e-16):
+    tiny = 1e-300
+    c = np.ones_like(x)
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / np.where(np.abs(d) > tiny, d, tiny)
+    h = d.copy()
+    for m in range(1, max_iter + 1):
+        for numerator in [m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))]:
+            d = 1 + numerator * d
+            d = 1 / np.where(np.abs(d) > tiny, d, tiny)
+            c = 1 + numerator / c
+            c = np.where(np.abs(c) > tiny, c, tiny)
+            h *= d * c
+        if np.all(np.abs(d * c - 1) < eps):
+            break
+    return h
+
+
+@lru_cache(maxsize=None)
+def t_quantile(p, df):
+    # Bisection on the t distribution function, accurate enough for confidence intervals
+    low, high = -1e3, 1e3
+    for _ in range(64):
+        mid = (low + high) / 2
+        if _t_cdf(mid, df) < p:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+class FixedEffectsResult:
+    def __init__(self, terms, coef, vcov, residuals, nobs, df_resid, df_t, r2, within_r2, vcov_type,
+                 dropped, fe_levels, iterations, first_stage_f=None):
+        self.terms = terms
+        self.coef = coef
+        self.vcov = vcov
+        self.residuals = residuals
+        self.nobs = nobs
+        self.df_resid = df_resid
+        self.df_t = df_t
+        self.r2 = r2
+        self.within_r2 = within_r2
+        self.vcov_type = vcov_type
+        self.dropped = dropped
+        self.fe_levels = fe_levels
+        self.iterations = iterations
+        # F statistic of the excluded instruments in the first stage of each endogenous regressor (IV only)
+        self.first_stage_f = first_stage_f
+
+    @property
+    def std_errors(self):
+        return np.sqrt(np.diag(self.vcov))
+
+    def summary(self, level=0.95):
+        std_errors = self.std_errors
+        t_stats = self.coef / std_errors
+        critical = t_quantile(1 - (1 - level) / 2, self.df_t)
+        return pl.DataFrame({
+            "term": self.terms,
+            "estimate": self.coef,
+            "std_error": std_errors,
+            "t_stat": t_stats,
+            "p_value": 2 * (1 - _t_cdf(np.abs(t_stats), self.df_t)),
+            "conf_low": self.coef - critical * std_errors,
+            "conf_high": self.coef + critical * std_errors,
+        })
+
+
+def _lag_pairs(time, lag):
+    # Positions (current, lagged) of the observations that are exactly lag periods apart; gaps in the series simply
+    # have no partner
+    order = np.argsort(time, kind="stable")
+    sorted_time = time[order]
+    position = np.searchsorted(sorted_time, time - lag)
+    position = np.minimum(position, len(time) - 1)
+    matched = sorted_time[position] == time - lag
+    return np.flatnonzero(matched), order[position[matched]]
+
+
+def _meat(scores, vcov, cluster_codes=None, time=None, lag=1):
+    # scores: outcomes x observations x regressors. Returns one meat matrix per outcome.
+    if vcov == "cluster":
+        order = np.argsort(cluster_codes, kind="stable")
+        starts = np.flatnonzero(np.r_[True, np.diff(cluster_codes[order]) != 0])
+        scores = np.add.reduceat(scores[:, order], starts, axis=1)
+    meat = np.matmul(scores.transpose(0, 2, 1), scores)
+    if vcov == "NW":
+        # Bartlett kernel over the lags 1..lag of the time variable
+        for l in range(1, lag + 1):
+            current, lagged = _lag_pairs(time, l)
+            cross = np.matmul(scores[:, current].transpose(0, 2, 1), scores[:, lagged])
+            meat += (1 - l / (lag + 1)) * (cross + cross.transpose(0, 2, 1))
+    return meat
+
+
+def feols(data, y, x, fe=(), vcov="HC1", cluster=None, time=None, lag=1, tol=1e-8, max_iter=10_000):
+    # y: outcome column. x: regressor columns or named polars expressions. fe: columns (or tuples of columns for
+    # interacted effects such as route x date) to absorb. vcov: "iid", "HC1", "cluster" (with cluster=<column>) or
+    # "NW" (Newey-West with time=<column> and lag).
+    # Rows with a missing or non-finite value in any used column are dropped, as feols does.
+    return feols_multi(data, [y], x, fe=fe, vcov=vcov, cluster=cluster, time=time, lag=lag, tol=tol,
+                       max_iter=max_iter)[y]
+
+
+def feols_multi(data, ys, x, fe=(), vcov="HC1", cluster=None, time=None, lag=1, endogenous=(), instruments=(),
+                tol=1e-8, max_iter=10_000):
+    # Same model for several outcomes: the design is demeaned and factorized once and all outcomes are solved as one
+    # matrix right-hand side. Outcomes with the same missing values share a fit. With endogenous regressors (and their
+    # excluded instruments) the model is estimated by 2SLS. Returns {outcome: FixedEffectsResult}.
+    if vcov not in ["iid", "HC1", "cluster", "NW"]:
+        raise ValueError(f"Unknown vcov {vcov!r}. Use 'iid', 'HC1', 'cluster' or 'NW'.")
+    if (vcov == "cluster") != (cluster is not None):
+        raise ValueError("vcov='cluster' requires a cluster column, and a cluster column requires vcov='cluster'.")
+    if (vcov == "NW") != (time is not None):
+        raise ValueError("vcov='NW' requires a time column, and a time column requires vcov='NW'.")
+    if len(instruments) < len(endogenous):
+        raise ValueError("2SLS needs at least as many instruments as endogenous regressors.")
+    ys = list(ys)
+    frame, terms, fe = model_frame(data, ys, x, fe=fe, columns=[col for col in [cluster, time] if col is not None],
+                                   endogenous=endogenous, instruments=instruments)
+
+    # Outcomes with the same missing values are estimated on the same sample
+    masks = frame.select(pl.col(y).is_finite().fill_null(False) for y in ys).to_numpy()
+    samples = {}
+    for j, y in enumerate(ys):
+        samples.setdefault(masks[:, j].tobytes(), (masks[:, j], []))[1].append(y)
+
+    results = {}
+    for mask, outcomes in samples.values():
+        design = demeaned_design(frame.filter(mask), outcomes, terms, fe, tol=tol, max_iter=max_iter)
+        results.update(_fit(design, vcov, cluster, time, lag))
+    return {y: results[y] for y in ys}
+
+
+def model_frame(data, ys, x, fe=(), columns=(), endogenous=(), instruments=()):
+    # Outcomes and regressors as Float64 columns (expressions under their output names) next to the FE and other
+    # grouping columns, without the rows that miss a regressor or a grouping column. Rows with a missing outcome are
+    # left to the caller. Returns the frame, the regressor names by role and the normalized FE specification.
+    x, endogenous, instruments = [[pl.col(term) if isinstance(term, str) else term for term in terms]
+                                  for terms in [x, endogenous, instruments]]
+    fe = [(dims,) if isinstance(dims, str) else tuple(dims) for dims in fe]
+    fe_columns = sorted({col for dims in fe for col in dims} | set(columns))
+
+    frame = data.select(*[pl.col(y).cast(pl.Float64) for y in ys],
+                        *[term.cast(pl.Float64) for term in [*x, *endogenous, *instruments]],
+                        *fe_columns)
+    regressors = frame.columns[len(ys):len(ys) + len(x) + len(endogenous) + len(instruments)]
+    frame = (frame
+             .drop_nulls(subset=[*regressors, *fe_columns])
+             .filter(pl.all_horizontal(True, *[pl.col(col).is_finite() for col in regressors])))
+    terms = {"x": regressors[:len(x)],
+             "endogenous": regressors[len(x):len(x) + len(endogenous)],
+             "instruments": regressors[len(x) + len(endogenous):]}
+    return frame, terms, fe
+
+
+class Design:
+    # Outcomes and regressors of one estimation sample before (Y, X, Z) and after (Y_tilde, X_tilde, Z_tilde)
+    # absorbing the fixed effects. X_tilde only keeps the regressors that are not collinear.
+    def __init__(self, frame, ys, Y, X, Z, Y_tilde, X_tilde, Z_tilde, names, kept, dropped, n_exog, endogenous,
+                 fe_codes, iterations):
+        self.frame = frame
+        self.ys = ys
+        self.Y = Y
+        self.X = X
+        self.Z = Z
+        self.Y_tilde = Y_tilde
+        self.X_tilde = X_tilde
+        self.Z_tilde = Z_tilde
+        self.names = names
+        self.kept = kept
+        self.dropped = dropped
+        self.n_exog = n_exog
+        self.endogenous = endogenous
+        self.fe_codes = fe_codes
+        self.iterations = iterations
+
+    @property
+    def nobs(self):
+        return self.frame.height
+
+    @property
+    def fe_levels(self):
+        return [int(codes.max()) + 1 for codes in self.fe_codes]
+
+    @property
+    def n_fe(self):
+        # fixest counts every FE coefficient, less one per additional FE dimension (exact for connected designs)
+        return sum(self.fe_levels) - max(len(self.fe_codes) - 1, 0)
+
+
+def demeaned_design(frame, ys, terms, fe, tol=1e-8, max_iter=10_000):
+    # frame, terms and fe as returned by model_frame, restricted to rows where all of ys are finite
+    nobs = frame.height
+    Y = frame.select(ys).to_numpy()
+    X = frame.select(*terms["x"], *terms["endogenous"]).to_numpy()
+    Z = frame.select(terms["instruments"]).to_numpy() if terms["instruments"] else np.empty((nobs, 0))
+    names = [*terms["x"], *[f"fit_{term}" for term in terms["endogenous"]]]
+    n_exog = len(terms["x"])
+    fe_codes = [group_codes(frame, dims) for dims in fe]
+    if not fe:
+        X = np.column_stack([np.ones(nobs), X])
+        names = ["(Intercept)", *names]
+        n_exog += 1
+
+    demeaned, iterations = demean(np.column_stack([Y, X, Z]), fe_codes, tol=tol, max_iter=max_iter)
+    Y_tilde, X_tilde, Z_tilde = np.split(demeaned, [len(ys), len(ys) + X.shape[1]], axis=1)
+    kept = _drop_collinear(X_tilde, (X ** 2).sum(axis=0))
+    dropped = [names[j] for j in range(len(names)) if j not in kept]
+    return Design(frame, ys, Y, X, Z, Y_tilde, X_tilde[:, kept], Z_tilde, [names[j] for j in kept], kept, dropped,
+                  n_exog, terms["endogenous"], fe_codes, iterations)
+
+
+def nested_in(codes, cluster_codes):
+    # Whether every group of an FE dimension lies within a single cluster
+    return (pl.DataFrame({"fe": codes, "cluster": cluster_codes})
+            .group_by("fe").agg(pl.col("cluster").n_unique()).get_column("cluster").max()) == 1
+
+
+def cluster_adjustment(fe_codes, cluster_codes, nobs, n_params):
+    # G/(G-1) (n-1)/(n-K), where FE nested in the clusters do not count towards K (fixef.K = "nested")
+    n_clusters = int(cluster_codes.max()) + 1
+    nested = [codes for codes in fe_codes if nested_in(codes, cluster_codes)]
+    n_params_cluster = n_params - sum(int(codes.max()) + 1 for codes in nested)
+    return (nobs - 1) / (nobs - n_params_cluster) * n_clusters / (n_clusters - 1)
+
+
+def _fit(design, vcov, cluster, time, lag):
+    frame, ys, kept = design.frame, design.ys, design.kept
+    X, Z, Y, Y_tilde, X_tilde = design.X, design.Z, design.Y, design.Y_tilde, design.X_tilde
+    nobs, n_fe, n_exog = design.nobs, design.n_fe, design.n_exog
+
+    first_stage_f = None
+    regressors = X_tilde
+    if design.endogenous:
+        exog = X_tilde[:, [i for i, j in enumerate(kept) if j < n_exog]]
+        endog = X_tilde[:, [i for i, j in enumerate(kept) if j >= n_exog]]
+        Z_all = np.column_stack([exog, design.Z_tilde])
+        Z_all = Z_all[:, _drop_collinear(Z_all, np.r_[(X[:, [j for j in kept if j < n_exog]] ** 2).sum(axis=0),
+                                                       (Z ** 2).sum(axis=0)])]
+        # First stage: project the regressors on the exogenous regressors and the excluded instruments
+        projection = np.linalg.lstsq(Z_all, X_tilde, rcond=None)[0]
+        regressors = Z_all @ projection
+        ssr_unrestricted = ((endog - Z_all @ np.linalg.lstsq(Z_all, endog, rcond=None)[0]) ** 2).sum(axis=0)
+        ssr_restricted = ((endog - exog @ np.linalg.lstsq(exog, endog, rcond=None)[0]) ** 2).sum(axis=0)
+        n_excluded = Z_all.shape[1] - exog.shape[1]
+        df_first = nobs - Z_all.shape[1] - n_fe
+        first_stage_f = {term: float((r - u) / n_excluded / (u / df_first))
+                         for term, r, u in zip(design.endogenous, ssr_restricted, ssr_unrestricted)}
+
+    bread = np.linalg.inv(regressors.T @ regressors)
+    coef = bread @ (regressors.T @ Y_tilde)
+    residuals = Y_tilde - X_tilde @ coef
+
+    k = len(kept)
+    n_params = k + n_fe
+    adj = (nobs - 1) / (nobs - n_params)
+
+    ssr = (residuals ** 2).sum(axis=0)
+    tss = ((Y - Y.mean(axis=0)) ** 2).sum(axis=0)
+    r2 = 1 - ssr / tss
+    within_r2 = 1 - ssr / (Y_tilde ** 2).sum(axis=0) if design.fe_codes else [None] * len(ys)
+
+    cluster_codes = time_codes = None
+    df_t = nobs - n_params
+    if vcov == "iid":
+        V = bread[None] * (ssr / (nobs - n_params))[:, None, None]
+    else:
+        if vcov == "cluster":
+            cluster_codes = group_codes(frame, cluster)
+            adj = cluster_adjustment(design.fe_codes, cluster_codes, nobs, n_params)
+            df_t = int(cluster_codes.max())
+        elif vcov == "NW":
+            time_codes = frame.get_column(time).to_physical().to_numpy()
+            if len(np.unique(time_codes)) < nobs:
+                raise ValueError(f"Newey-West standard errors need one observation per {time!r}.")
+        scores = residuals.T[:, :, None] * regressors[None]
+        V = adj * bread @ _meat(scores, vcov, cluster_codes, time_codes, lag) @ bread
+
+    return {y: FixedEffectsResult(design.names, coef[:, j], V[j], residuals[:, j], nobs, nobs - n_params, df_t,
+                                  r2[j], within_r2[j], vcov, design.dropped, design.fe_levels, design.iterations,
+                                  first_stage_f)
+            for j, y in enumerate(ys)}
@@ -0,0 +1,127 @@
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import polars as pl
+
+from code.estimation.bootstrap import wild_cluster_bootstrap
+from code.estimation.cache import EstimationCache, frame_hash
+from code.estimation.fixed_effects import factor_dummies, feols
+from code.estimation.shared import SharedDataset, init_worker, read_dataset, worker_dataset
+
+# Python counterpart of code/03-microregs.R (Table 4): stand_crimes on the downwind treatment for violent and
+# property crimes, without controls, with route x side effects, with route x date fixed effects, and with route x side
+# weather interactions. Column names differ between the original micro dataset and the replicated one written by
+# DataPreprocessor.create_micro_dataset.
+COLUMNS = {
+    "original": {"route_side": "routeside", "route_date": "routedate", "tmax": "tmax",
+                 "prcp": "valuePRCP_MIDWAY"},
+    "replicated": {"route_side": "route_side", "route_date": "route_date", "tmax": "tmax",
+                   "prcp": "PRCP_MIDWAY"},
+}
+
+SPECIFICATIONS = ["(1)", "(2)", "(3)", "(4)"]
+
+
+def _regressors(data, spec, columns):
+    route_side, tmax, prcp = columns["route_side"], columns["tmax"], columns["prcp"]
+    if spec == "(1)":
+        return ["treatment"]
+    # The route x side code is a factor in the R script
+    side_dummies = factor_dummies(data, route_side)
+    if spec in ["(2)", "(3)"]:
+        return ["treatment", *side_dummies]
+    # routeside * tmax + routeside * prcp as expanded by R's model.matrix
+    interactions = [(dummy * pl.col(weather)).alias(f"{dummy.meta.output_name()}:{weather}")
+                    for weather in [tmax, prcp] for dummy in side_dummies]
+    return ["treatment", *side_dummies, tmax, prcp, *interactions]
+
+
+def _fit_spec(task, data=None, jobs=1):
+    outcome, violent, spec, columns, vcov, cluster, bootstrap_draws, bootstrap_weights, cache, data_hash = task
+    data = worker_dataset() if data is None else data
+    sample = pl.col("violent") == violent
+    subset = data.filter(sample)
+    fe = [columns["route_date"]] if spec in ["(3)", "(4)"] else []
+    regressors = _regressors(subset, spec, columns)
+    if cache is None:
+        fit = feols(subset, "stand_crimes", regressors, fe=fe, vcov=vcov, cluster=cluster)
+    else:
+        fit = cache.feols_multi(data, ["stand_crimes"], regressors, fe=fe, sample=sample, data_hash=data_hash,
+                                vcov=vcov, cluster=cluster)["stand_crimes"]
+    wild_p_value = None
+    if bootstrap_draws:
+        options = {"draws": bootstrap_draws, "weights": bootstrap_weights, "seed": 0}
+        if cache is None:
+            bootstrap = wild_cluster_bootstrap(subset, "stand_crimes", regressors, "treatment", cluster, fe=fe,
+                                               jobs=jobs, **options)
+        else:
+            bootstrap = cache.wild_cluster_bootstrap(data, "stand_crimes", regressors, "treatment", cluster, fe=fe,
+                                                     sample=sample, data_hash=data_hash, jobs=jobs, **options)
+        wild_p_value = bootstrap.p_value
+    return (fit.summary()
+            .with_columns(
+        pl.lit(outcome).alias("outcome"),
+        pl.lit(spec).alias("spec"),
+        pl.lit(fit.nobs).alias("nobs"),
+        pl.lit(fit.r2).alias("r2"),
+        pl.when(pl.col("term") == "treatment").then(pl.lit(wild_p_value, dtype=pl.Float64))
+        .alias("wild_p_value")))
+
+
+def run_micro_regressions(data, dataset="replicated", vcov="HC1", cluster=None, bootstrap_draws=0,
+                          bootstrap_weights="rademacher", jobs=1, cache=None):
+    # With bootstrap_draws, the treatment rows also get the wild cluster bootstrap p-value (restricted, by cluster).
+    # With an EstimationCache, fits of unchanged specifications on unchanged data are read from it.
+    data_hash = None if cache is None else frame_hash(data)
+    tasks = [(outcome, violent, spec, COLUMNS[dataset], vcov, cluster, bootstrap_draws, bootstrap_weights, cache,
+              data_hash)
+             for outcome, violent in [("violent", 1), ("property", 0)]
+             for spec in SPECIFICATIONS]
+    if bootstrap_draws and jobs > 1:
+        # One specification per worker, all on one shared copy of the dataset
+        with SharedDataset.publish(data) as shared:
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=init_worker, initargs=(shared,)) as executor:
+                results = list(executor.map(_fit_spec, tasks))
+    else:
+        results = [_fit_spec(task, data) for task in tasks]
+    return (pl.concat(results)
+            .select("outcome", "spec", pl.exclude("outcome", "spec")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate the micro regressions of Table 4 in Python.")
+    parser.add_argument("--data", type=Path, default=Path("data") / "micro_dataset_replicated_dir_thresh_60.csv")
+    parser.add_argument("--dataset", choices=list(COLUMNS), default="replicated",
+                        help="Column naming of the input: the original micro dataset or the replicated one.")
+    parser.add_argument("--cluster", default=None,
+                        help="Cluster-robust standard errors by this column instead of HC1.")
+    parser.add_argument("--bootstrap-draws", type=int, default=0,
+                        help="Wild cluster bootstrap p-values of the treatment effect with this many draws "
+                             "(all 2^G Rademacher draws if fewer). Requires --cluster.")
+    parser.add_argument("--bootstrap-weights", choices=["rademacher", "webb"], default="rademacher")
+    parser.add_argument("--jobs", type=int, default=1, help="Processes for the bootstrapped specifications.")
+    parser.add_argument("--cache", type=Path, default=None,
+                        help="Directory of the estimation cache; unchanged specifications are read from it.")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Size limit of the estimation cache (MB).")
+    parser.add_argument("--output", type=Path, default=Path("output") / "tables" / "table_4_python.csv")
+    args = parser.parse_args(argv)
+    if args.bootstrap_draws and args.cluster is None:
+        parser.error("--bootstrap-draws requires --cluster.")
+
+    results = run_micro_regressions(read_dataset(args.data), dataset=args.dataset,
+                                    vcov="HC1" if args.cluster is None else "cluster", cluster=args.cluster,
+                                    bootstrap_draws=args.bootstrap_draws, bootstrap_weights=args.bootstrap_weights,
+                                    jobs=args.jobs,
+                                    cache=None if args.cache is None else EstimationCache(args.cache,
+                                                                                          args.cache_size * 1024 ** 2))
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results.write_csv(args.output)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(results.filter(pl.col("term") == "treatment"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from code.estimation.fixed_effects import _drop_collinear, demean
+from code.estimation.microregs import COLUMNS, SPECIFICATIONS, _regressors
+from code.estimation.shared import SharedDataset, init_worker, read_dataset, worker_dataset
+
+# Randomization inference for the micro regressions: the daily Midway wind series is permuted (or shifted in time)
+# and treatment, the estimation sample and stand_crimes are re-derived from it exactly as in
+# DataPreprocessor.create_micro_dataset. The replicated micro dataset keeps every route x side x date cell whatever
+# the threshold, so it already is the threshold-independent panel.
+#
+# A draw only changes which (route, date) units are in the sample and which of their two sides is treated. The
+# regression is therefore reduced once to per-unit moments of the controls and the crime counts (demeaned within
+# route x date for the FE specifications), and the estimates of a whole shard of draws follow from a few
+# (units x draws) matrix products and one batched solve.
+SHARD_SIZE = 256
+# Arrays with one row per unit; parallel runs hand them to the workers through a SharedDataset
+UNIT_ARRAYS = ["side0", "side1", "cross", "valid", "empty_cells", "date_index", "angle_index"]
+
+_ENGINE = None
+
+
+def _init_worker(engine, units):
+    global _ENGINE
+    frame = units.load()
+    for name in frame.columns:
+        setattr(engine, name, frame.get_column(name).to_numpy())
+    _ENGINE = engine
+
+
+def _run_shard(shard):
+    return _ENGINE.estimates(*shard)
+
+
+class RandomizationResult:
+    def __init__(self, estimate, draws, p_value, scheme, wind_dir_threshold):
+        self.estimate = estimate
+        self.draws = draws
+        self.p_value = p_value
+        self.scheme = scheme
+        self.wind_dir_threshold = wind_dir_threshold
+
+
+class RandomizationInference:
+    def __init__(self, data, spec="(3)", violent=1, wind_dir_threshold=60):
+        columns = COLUMNS["replicated"]
+        subset = (data
+                  .filter(pl.col("violent") == violent)
+                  .with_columns(pl.col("num_crimes").fill_null(0))
+                  .sort("route_date", "side_dummy"))
+        self.wind_dir_threshold = wind_dir_threshold
+        self.fe = spec in ["(3)", "(4)"]
+
+        units, sides = subset.get_column("route_date").to_numpy(), subset.get_column("side_dummy").to_numpy()
+        if (len(units) % 2 or np.any(units[0::2] != units[1::2]) or np.any(sides[0::2] != 0)
+                or np.any(sides[1::2] != 1)):
+            raise ValueError("Every route x date needs exactly one row per side.")
+
+        controls = [pl.col(term) if isinstance(term, str) else term for term in _regressors(subset, spec, columns)[1:]]
+        frame = subset.select(pl.col("num_crimes").cast(pl.Float64), *[term.cast(pl.Float64) for term in controls])
+        C = frame.select(frame.columns[1:]).to_numpy() if controls else np.empty((subset.height, 0))
+        y = frame.get_column("num_crimes").to_numpy()
+        # Units whose controls are missing never enter the sample, as feols drops their rows
+        valid = np.isfinite(C).all(axis=1)
+        valid = valid[0::2] & valid[1::2]
+        C = np.where(np.isfinite(C), C, 0)
+        reference = (C ** 2).sum(axis=0)
+        if self.fe:
+            unit_codes = np.repeat(np.arange(subset.height // 2), 2)
+            demeaned, _ = demean(np.column_stack([y, C]), [unit_codes])
+            y, C = demeaned[:, 0], demeaned[:, 1:]
+        else:
+            C = np.column_stack([np.ones(subset.height), C])
+            reference = np.r_[subset.height, reference]
+        C = C[:, _drop_collinear(C[np.repeat(valid, 2)], reference)]
+
+        # Per unit: the side 0 and side 1 rows of the design, and the cross products of the controls (upper triangle)
+        self.side0 = np.column_stack([C[0::2], y[0::2]])
+        self.side1 = np.column_stack([C[1::2], y[1::2]])
+        self.upper = np.triu_indices(C.shape[1])
+        self.cross = (C[0::2, self.upper[0]] * C[0::2, self.upper[1]] + C[1::2, self.upper[0]] * C[1::2, self.upper[1]])
+        self.valid = valid
+        # A treated unit adds t't = 1, or 1/2 once treatment is demeaned within the unit
+        self.treatment_square = 0.5 if self.fe else 1.0
+
+        # stand_crimes divides by the mean of num_crimes over the cells with crimes or in the sample
+        counts = subset.get_column("num_crimes").to_numpy()
+        self.total_crimes = counts.sum()
+        self.cells_with_crimes = (counts > 0).sum()
+        self.empty_cells = (counts[0::2] == 0).astype(np.float64) + (counts[1::2] == 0)
+
+        dates = subset.get_column("date").to_physical().to_numpy()[0::2]
+        self.dates, self.date_index = np.unique(dates, return_inverse=True)
+        wind = (subset
+                .group_by("date").agg(pl.col("wind_deg_avg").first())
+                .sort("date").get_column("wind_deg_avg").cast(pl.Float64).fill_null(np.nan).to_numpy())
+        angles, self.angle_index = np.unique(subset.get_column("treatment_angle").cast(pl.Float64).to_numpy()[0::2],
+                                             return_inverse=True)
+
+        # Which side of a route with a given treatment angle is treated with the wind of a given date (neither side:
+        # out of sample). A draw only gives each date the wind of another date, so it is a lookup in these tables.
+        wind_deg_adj = np.mod(wind[None, :] - angles[:, None], 360)
+        self.treated_0 = (wind_deg_adj > 360 - wind_dir_threshold) | (wind_deg_adj < wind_dir_threshold)
+        self.treated_1 = (wind_deg_adj > 180 - wind_dir_threshold) & (wind_deg_adj < 180 + wind_dir_threshold)
+
+    def estimates(self, scheme, draws, seed):
+        # Treatment effects on stand_crimes for draws of the wind series; scheme "observed" is the actual series
+        n_dates = len(self.dates)
+        rng = np.random.default_rng(seed)
+        # source: for every date and draw, the date whose wind it gets
+        if scheme == "observed":
+            source = np.arange(n_dates)[:, None]
+        elif scheme == "permute":
+            source = np.argsort(rng.random((draws, n_dates)), axis=1).T
+        else:
+            shifts = rng.integers(1, n_dates, size=draws)
+            source = (np.arange(n_dates)[:, None] - shifts[None, :]) % n_dates
+        unit_source = source[self.date_index]
+        treated_1 = self.treated_1[self.angle_index[:, None], unit_source].astype(np.float64)
+        treated_0 = self.treated_0[self.angle_index[:, None], unit_source].astype(np.float64)
+        # mean_crimes counts every cell in the sample, the regression only those with all controls
+        mean_crimes = self.total_crimes / (self.cells_with_crimes + self.empty_cells @ (treated_1 + treated_0))
+        treated_1 *= self.valid[:, None]
+        treated_0 *= self.valid[:, None]
+        in_sample = treated_1 + treated_0
+
+        draws = source.shape[1]
+        k = self.side0.shape[1] - 1
+        treatment_cross = self.side1.T @ treated_1 + self.side0.T @ treated_0
+        gram = np.empty((draws, k + 1, k + 1))
+        gram[:, 0, 0] = self.treatment_square * in_sample.sum(axis=0)
+        gram[:, 0, 1:] = gram[:, 1:, 0] = treatment_cross[:k].T
+        packed = (self.cross.T @ in_sample).T
+        controls = np.empty((draws, k, k))
+        controls[:, self.upper[0], self.upper[1]] = packed
+        controls[:, self.upper[1], self.upper[0]] = packed
+        gram[:, 1:, 1:] = controls
+        rhs = np.empty((draws, k + 1))
+        rhs[:, 0] = treatment_cross[k]
+        controls_outcome = self.side0[:, :k] * self.side0[:, k:] + self.side1[:, :k] * self.side1[:, k:]
+        rhs[:, 1:] = (controls_outcome.T @ in_sample).T
+        coef = np.linalg.solve(gram, rhs[:, :, None])[:, 0, 0]
+        return coef / mean_crimes
+
+    def run(self, draws=1000, scheme="permute", seed=0, jobs=1):
+        if scheme not in ["permute", "shift"]:
+            raise ValueError(f"Unknown scheme {scheme!r}. Use 'permute' or 'shift'.")
+        estimate = float(self.estimates("observed", 1, None)[0])
+        seeds = np.random.SeedSequence(seed).spawn(-(-draws // SHARD_SIZE))
+        shards = [(scheme, min(SHARD_SIZE, draws - i * SHARD_SIZE), shard_seed) for i, shard_seed in enumerate(seeds)]
+        if jobs > 1 and len(shards) > 1:
+            # Workers are spawned, as in main, and map the per-unit arrays instead of getting a pickled copy each.
+            # Zero-width arrays (no controls) cannot be memory-mapped and travel with the engine.
+            shared = [name for name in UNIT_ARRAYS if getattr(self, name).ndim == 1 or getattr(self, name).shape[1]]
+            engine = copy.copy(self)
+            for name in shared:
+                delattr(engine, name)
+            with SharedDataset.publish(pl.DataFrame({name: getattr(self, name) for name in shared})) as units:
+                with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(engine, units)) as executor:
+                    estimates = list(executor.map(_run_shard, shards))
+        else:
+            estimates = [self.estimates(*shard) for shard in shards]
+        estimates = np.concatenate(estimates)
+        # The observed assignment counts as one of the draws
+        p_value = (1 + np.sum(np.abs(estimates) >= abs(estimate) - 1e-12 * abs(estimate))) / (1 + draws)
+        return RandomizationResult(estimate, estimates, float(p_value), scheme, self.wind_dir_threshold)
+
+
+def _run_task(task, data=None, jobs=1):
+    outcome, violent, spec, threshold, draws, scheme, seed = task
+    data = worker_dataset() if data is None else data
+    result = (RandomizationInference(data, spec=spec, violent=violent, wind_dir_threshold=threshold)
+              .run(draws=draws, scheme=scheme, seed=seed, jobs=jobs))
+    return {"outcome": outcome, "spec": spec, "threshold": threshold, "estimate": result.estimate,
+            "p_value": result.p_value, "draws": draws, "scheme": scheme}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Randomization inference for the micro regressions by permuting "
+                                                 "the daily wind series.")
+    parser.add_argument("--data", type=Path, default=Path("data") / "micro_dataset_replicated_dir_thresh_60.csv")
+    parser.add_argument("--specs", nargs="+", choices=SPECIFICATIONS, default=["(3)"])
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[60],
+                        help="Wind direction thresholds (degrees) that define treatment and the sample.")
+    parser.add_argument("--draws", type=int, default=1000)
+    parser.add_argument("--scheme", choices=["permute", "shift"], default="permute",
+                        help="Permute the days of the wind series, or shift the whole series in time.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--output", type=Path, default=Path("output") / "tables" / "randomization_inference.csv")
+    args = parser.parse_args(argv)
+
+    data = read_dataset(args.data)
+    tasks = [(outcome, violent, spec, threshold, args.draws, args.scheme, args.seed)
+             for outcome, violent in [("violent", 1), ("property", 0)]
+             for spec in args.specs
+             for threshold in args.thresholds]
+    if args.jobs > 1 and len(tasks) > 1:
+        # Whole runs in the workers, all on one shared copy of the dataset
+        with SharedDataset.publish(data) as dataset:
+            with ProcessPoolExecutor(max_workers=args.jobs, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=init_worker, initargs=(dataset,)) as executor:
+                rows = list(executor.map(_run_task, tasks))
+    else:
+        rows = [_run_task(task, data, args.jobs) for task in tasks]
+    results = pl.DataFrame(rows)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results.write_csv(args.output)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
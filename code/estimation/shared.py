@@ -0,0 +1,66 @@
+import os
+import tempfile
+import uuid
+from pathlib import Path
+
+import polars as pl
+
+# Dataset handoff to parallel analysis workers. The parent publishes a built dataset once as an uncompressed Arrow IPC
+# file in shared memory (/dev/shm, a temporary directory where there is none) and passes the workers the handle, not
+# the data. A worker memory-maps the file, so its columns are read-only views of the same pages in every process: n
+# workers cost one copy of the dataset, and none of them parses the CSV again.
+SHARED_MEMORY = Path("/dev/shm")
+
+_DATASET = None
+
+
+def read_dataset(path):
+    # A built dataset in any of the storage formats of DataPreprocessor
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pl.read_parquet(path)
+    if path.suffix in [".ipc", ".arrow"]:
+        return pl.read_ipc(path, memory_map=True)
+    return pl.read_csv(path, infer_schema_length=None, try_parse_dates=True)
+
+
+class SharedDataset:
+    def __init__(self, path, owner=None):
+        self.path = Path(path)
+        # Only the publishing process removes the file
+        self.owner = owner
+
+    @classmethod
+    def publish(cls, data, directory=None):
+        directory = Path(directory or (SHARED_MEMORY if SHARED_MEMORY.is_dir() else tempfile.gettempdir()))
+        path = directory / f"shared_dataset_{os.getpid()}_{uuid.uuid4().hex}.arrow"
+        # Memory mapping needs the buffers uncompressed
+        data.write_ipc(path, compression="uncompressed")
+        return cls(path, owner=os.getpid())
+
+    def load(self):
+        return pl.read_ipc(self.path, memory_map=True, rechunk=False)
+
+    def close(self):
+        if self.owner == os.getpid():
+            self.path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getstate__(self):
+        # Workers get the handle only and never own the file
+        return {"path": self.path, "owner": None}
+
+
+def init_worker(dataset):
+    # Pool initializer: attach the worker to the published dataset once
+    global _DATASET
+    _DATASET = dataset.load()
+
+
+def worker_dataset():
+    return _DATASET
@@ -0,0 +1,102 @@
+import polars as pl
+
+from code.preprocessing import schemas
+
+# EPA Air Quality Index (40 CFR Part 58, Appendix G) from the daily AQS concentrations of the extract stages, so that
+# the AQI is available for any monitor set or period without the separate AQI download. A concentration is truncated
+# to the precision of its breakpoint table, located in the table with a vectorized search_sorted over the lower
+# breakpoints, and interpolated linearly within its category: I = (I_hi - I_lo) / (C_hi - C_lo) * (C - C_lo) + I_lo,
+# rounded to the nearest integer. Concentrations outside the table have no sub-index. Ozone takes the larger of its
+# 8-hour and 1-hour sub-indices; the 1-hour table starts at the third category. The AQI of a day is its largest
+# sub-index and the dominant pollutant the argmax.
+INDEX_LOW = [0, 51, 101, 151, 201, 301, 401]
+INDEX_HIGH = [50, 100, 150, 200, 300, 400, 500]
+
+# pollutant: [(daily column, scale to the units of the table, decimals, lower breakpoints, upper breakpoints,
+# first category)]
+BREAKPOINTS = {
+    # 8-hour ppm
+    "CO": [("max8hr_co", 1, 1, [0.0, 4.5, 9.5, 12.5, 15.5, 30.5, 40.5],
+            [4.4, 9.4, 12.4, 15.4, 30.4, 40.4, 50.4], 0)],
+    # 1-hour ppb (the daily output is in ppm)
+    "NO2": [("max_no2", 1000, 0, [0, 54, 101, 361, 650, 1250, 1650],
+             [53, 100, 360, 649, 1249, 1649, 2049], 0)],
+    # 8-hour and 1-hour ppm
+    "Ozone": [("max8hr_ozone", 1, 3, [0.0, 0.055, 0.071, 0.086, 0.106],
+               [0.054, 0.070, 0.085, 0.105, 0.200], 0),
+              ("max_ozone", 1, 3, [0.125, 0.165, 0.205, 0.405, 0.505],
+               [0.164, 0.204, 0.404, 0.504, 0.604], 2)],
+    # 24-hour ug/m3
+    "PM10": [("pm10_24hr", 1, 0, [0, 55, 155, 255, 355, 425, 505],
+              [54, 154, 254, 354, 424, 504, 604], 0)],
+}
+
+
+def max_8hr(hourly, value, by, datetime="datetime"):
+    # Lazy daily maximum of the 8-hour running averages that begin at each reading of the day, counting only
+    # averages over at least 6 of their 8 hours
+    return (hourly.lazy()
+            .filter(
+        pl.col(value).is_not_null())
+            .sort(*by, datetime)
+            .rolling(
+        index_column=datetime, period="8h", offset="0h", closed="left", group_by=by)
+            .agg(
+        pl.col(value).mean().alias("mean_8hr"),
+        pl.len().alias("hours"))
+            .filter(
+        pl.col("hours") >= 6)
+            .group_by(*by, pl.col(datetime).dt.date().alias("date"))
+            .agg(
+        pl.col("mean_8hr").max()))
+
+
+def aqs_max_8hr(aqs_data):
+    # Daily maximum 8-hour average of every monitor from the 1-hour samples of an AQS file (lower-cased columns)
+    hourly = (aqs_data.lazy()
+              .filter(
+        pl.col("sample_duration") == "1 HOUR")
+              .select(
+        "monitor_id",
+        (pl.col("date_local").cast(pl.Datetime("us"))
+         + pl.duration(hours=pl.col("24_hour_local").str.slice(0, 2).cast(pl.Int64))).alias("datetime"),
+        "sample_measurement"))
+    return max_8hr(hourly, "sample_measurement", ["monitor_id"])
+
+
+def sub_index(concentration, decimals, lows, highs, first=0):
+    # Truncation and breakpoints in units of the last decimal, so that the comparisons are exact
+    scale = 10 ** decimals
+    truncated = (concentration * scale + 1e-6).floor()
+    lows = pl.Series([round(value * scale) for value in lows], dtype=pl.Float64)
+    highs = pl.Series([round(value * scale) for value in highs], dtype=pl.Float64)
+    index_low = pl.Series(INDEX_LOW[first:first + len(lows)], dtype=pl.Float64)
+    index_high = pl.Series(INDEX_HIGH[first:first + len(lows)], dtype=pl.Float64)
+    category = (pl.lit(lows).search_sorted(truncated, side="right").cast(pl.Int64) - 1).clip(0, len(lows) - 1)
+    c_low, c_high = pl.lit(lows).gather(category), pl.lit(highs).gather(category)
+    i_low, i_high = pl.lit(index_low).gather(category), pl.lit(index_high).gather(category)
+    value = (i_high - i_low) / (c_high - c_low) * (truncated - c_low) + i_low
+    return (pl.when(truncated.is_between(lows[0], highs[-1]))
+            .then((value + 0.5).floor()))
+
+
+def monitor_aqi(co_daily, no2_daily, ozone_daily, pm10_daily):
+    # Long (date, monitor_id, pollutant_name, aqi) table of the daily sub-index of every monitor
+    pm10_daily = (pm10_daily
+                  .group_by("monitor_id", "date")
+                  .agg(
+        pl.coalesce("avg24hr_pm10_derived", "daily_pm10_notderived").max().alias("pm10_24hr")))
+    daily = {"CO": co_daily, "NO2": no2_daily, "Ozone": ozone_daily, "PM10": pm10_daily}
+    return pl.concat([
+        daily[pollutant].lazy()
+        .select(
+            "date", "monitor_id",
+            pl.lit(pollutant, dtype=schemas.POLLUTANT).alias("pollutant_name"),
+            pl.max_horizontal([sub_index(pl.col(col) * scale, decimals, lows, highs, first)
+                               for col, scale, decimals, lows, highs, first in tables]).alias("aqi"))
+        for pollutant, tables in BREAKPOINTS.items()])
+
+
+def dominant(value, pollutant="pollutant_name"):
+    # Pollutant of the largest value of a group (the first one on ties), null if all values are null
+    return pl.col(pollutant).get(pl.col(value).arg_max())
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+from pathlib import Path
+
+import aiofiles
+from aiofiles.os import makedirs
+
+
+class _ByteBudget:
+    # Admits byte reservations first come, first served while they fit into the limit. A reservation larger than the
+    # limit is admitted once nothing else is held, so a single big file cannot block forever.
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+        self._queue = []
+
+    async def acquire(self, size):
+        ticket = object()
+        async with self._condition:
+            self._queue.append(ticket)
+            await self._condition.wait_for(
+                lambda: self._queue[0] is ticket and (self.used == 0 or self.used + size <= self.limit))
+            self._queue.pop(0)
+            self.used += size
+            self._condition.notify_all()
+
+    async def release(self, size):
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class AsyncFileIO:
+    # Reads raw files concurrently into memory on a background event loop and writes outputs behind the stages that
+    # produce them. Prefetched files hold their share of the byte budget until they are taken, so prefetch() should
+    # be called in the order in which the files are consumed. Pending writes have a budget of the same size.
+    def __init__(self, max_inflight_bytes=512 * 1024 ** 2, concurrency=8):
+        self.max_inflight_bytes = max_inflight_bytes
+        self.concurrency = concurrency
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-file-io", daemon=True)
+        self._thread.start()
+        self._reads = {}
+        self._writes = {}
+        self._lock = threading.Lock()
+        self._call(self._setup())
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _setup(self):
+        self._read_budget = _ByteBudget(self.max_inflight_bytes)
+        self._write_budget = _ByteBudget(self.max_inflight_bytes)
+        self._files = asyncio.Semaphore(self.concurrency)
+
+    # Reads ------------------------------------------------------------------------------------------------------------
+    def prefetch(self, paths):
+        for path in paths:
+            path = Path(path)
+            with self._lock:
+                if path in self._reads or not path.is_file():
+                    continue
+                self._reads[path] = asyncio.run_coroutine_threadsafe(self._read(path), self._loop)
+
+    async def _read(self, path):
+        size = path.stat().st_size
+        await self._read_budget.acquire(size)
+        try:
+            async with self._files:
+                async with aiofiles.open(path, "rb") as file:
+                    return size, await file.read()
+        except BaseException:
+            await self._read_budget.release(size)
+            raise
+
+    def take(self, path):
+        # Returns the prefetched content of path and frees its budget, or None if path was not prefetched
+        with self._lock:
+            future = self._reads.pop(Path(path), None)
+        if future is None:
+            return None
+        size, content = future.result()
+        asyncio.run_coroutine_threadsafe(self._read_budget.release(size), self._loop)
+        return content
+
+    # Writes -----------------------------------------------------------------------------------------------------------
+    def write(self, path, content):
+        # Blocks only while the pending writes exceed the budget
+        path = Path(path)
+        self.wait_written(path)
+        self._call(self._write_budget.acquire(len(content)))
+        with self._lock:
+            self._writes[path] = asyncio.run_coroutine_threadsafe(self._write(path, content), self._loop)
+
+    async def _write(self, path, content):
+        try:
+            async with self._files:
+                await makedirs(path.parent, exist_ok=True)
+                async with aiofiles.open(path, "wb") as file:
+                    await file.write(content)
+        finally:
+            await self._write_budget.release(len(content))
+
+    def wait_written(self, path):
+        with self._lock:
+            future = self._writes.get(Path(path))
+        if future is not None:
+            future.result()
+
+    def flush(self):
+        with self._lock:
+            futures = list(self._writes.values())
+        for future in futures:
+            future.result()
+
+    async def _cancel_pending(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        # Waits for the pending writes and drops prefetched files that were never taken
+        try:
+            self.flush()
+        finally:
+            self._call(self._cancel_pending())
+            self._reads.clear()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
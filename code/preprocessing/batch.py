@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# Batch runs of DataPreprocessor over the city specs of a panel (see city.py). The raw files of every city are read
+# from input_root/<name> and its datasets written to output_root/<name>. Cities run in a pool of worker processes, each
+# with its own share of the Polars threads; a worker imports the preprocessing modules (I/O helpers, schema registry)
+# once and reuses them for every city scheduled on it. A failing city does not stop the others.
+
+
+def _init_worker(threads):
+    # Polars reads the size of its thread pool once, at import time
+    os.environ["POLARS_MAX_THREADS"] = str(threads)
+
+
+def run_city(city, input_path, output_path, stages, preprocessor_options=None, run_options=None):
+    from code.preprocessing.preprocess import DataPreprocessor
+
+    preprocessor = DataPreprocessor(input_path, output_path, city=city, **(preprocessor_options or {}))
+    preprocessor.run(stages, **(run_options or {}))
+    if preprocessor.profiler is not None:
+        preprocessor.write_profile_report()
+    return city.name
+
+
+def run_cities(cities, input_root, output_root, stages, jobs=1, threads=None, preprocessor_options=None,
+               run_options=None):
+    names = [city.name for city in cities]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"City names must be unique, got {duplicates} more than once.")
+    input_root, output_root = Path(input_root), Path(output_root)
+    tasks = {city.name: (city, input_root / city.name, output_root / city.name, stages, preprocessor_options,
+                         run_options) for city in cities}
+
+    failed = {}
+    if jobs <= 1:
+        for name, task in tasks.items():
+            try:
+                run_city(*task)
+                print(f"{name}: done")
+            except Exception as error:
+                failed[name] = error
+                print(f"{name}: failed ({error!r})")
+    else:
+        threads = threads or max(1, (os.cpu_count() or 1) // jobs)
+        # Spawned workers, since forking a process that runs Polars threads can deadlock
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(threads,)) as executor:
+            futures = {executor.submit(run_city, *task): name for name, task in tasks.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                    print(f"{name}: done")
+                except Exception as error:
+                    failed[name] = error
+                    print(f"{name}: failed ({error!r})")
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(tasks)} cities failed: {', '.join(sorted(failed))}.")
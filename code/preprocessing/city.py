@@ -0,0 +1,122 @@
+import json
+from pathlib import Path
+
+from code.preprocessing.stages import RAW_INPUTS
+
+# City specification of DataPreprocessor: the raw files, years, pollution monitors, weather stations and interstate
+# routes of one city. CHICAGO holds the choices of the replication package; other cities are read from JSON files with
+# the same keys (see CitySpec.from_file), and stages missing from their raw_inputs read the replication file names.
+# Kept free of heavy imports, like stages.py, so that the batch runner can read the specs before polars is imported.
+#
+# Boxes select crimes by the interstate distance file: "routes" and "segments" list values of route_num_1 and
+# route_num_1_mod, and "latitude", "longitude" and "lat_minus_lon" (latitude - longitude, bounds along the diagonal)
+# are open intervals [lower, upper], null for unbounded. A crime is in a box if it meets all of the box's conditions.
+# route_segments split routes into segments (first matching box wins) and crimes in any of the trim_boxes are dropped
+# from the sample to keep clean treatment and control groups.
+CHICAGO_ROUTE_SEGMENTS = [
+    {"name": "I90_A", "routes": ["I90"], "latitude": [41.84, None], "longitude": [-87.75, None]},
+    {"name": "I90_B", "routes": ["I90"], "latitude": [41.775, 41.84]},
+    {"name": "I90_C", "routes": ["I90"], "latitude": [None, 41.775]},
+]
+CHICAGO_TRIM_BOXES = [
+    # Fringe of city limits
+    {"longitude": [None, -87.8]},
+    # Far out I-290 or I-55
+    {"routes": ["I290", "I55"], "longitude": [None, -87.74]},
+    # I-90A
+    {"lat_minus_lon": [129.69, None]},
+    {"segments": ["I90_A"], "lat_minus_lon": [None, 129.575]},
+    # I-90B
+    {"segments": ["I90_B"], "latitude": [None, 41.79]},
+    # I-90C
+    {"segments": ["I90_C"], "lat_minus_lon": [129.36, None]},
+    {"segments": ["I90_C"], "lat_minus_lon": [None, 129.26]},
+    # I-55
+    {"routes": ["I55"], "longitude": [-87.65, None]},
+    # I-94
+    {"segments": ["I94"], "lat_minus_lon": [None, 129.34]},
+    {"segments": ["I94"], "latitude": [41.75, None]},
+]
+
+
+class CitySpec:
+    def __init__(self,
+                 name="chicago",
+                 raw_inputs=None,
+                 years=(2001, 2012),
+                 pollution_years=(2000, 2012),
+                 aqi_city="Chicago",
+                 aqi_source="file",
+                 monitors=None,
+                 monitor_panels=None,
+                 co_drop_monitors=("31_6004_1",),
+                 ghcn_stations=None,
+                 weather_usaf=725340,
+                 routes=("I57", "I290", "I90_B", "I90_A", "I94", "I55", "I90_C"),
+                 route_segments=CHICAGO_ROUTE_SEGMENTS,
+                 trim_boxes=CHICAGO_TRIM_BOXES):
+        self.name = name
+        # Raw files of every stage (see stages.RAW_INPUTS)
+        self.raw_inputs = {**RAW_INPUTS, **(raw_inputs or {})}
+        # First and last year of the crimes and of the pollution series (inclusive)
+        self.years = tuple(years)
+        self.pollution_years = tuple(pollution_years)
+        # City name of the AQI file whose monitors make the citywide AQI. With aqi_source "computed", the AQI is
+        # computed from the daily concentrations instead (see aqi.py) and no AQI file is read.
+        if aqi_source not in ["file", "computed"]:
+            raise ValueError(f"Unknown AQI source {aqi_source!r}. Use 'file' or 'computed'.")
+        self.aqi_city = aqi_city
+        self.aqi_source = aqi_source
+        if aqi_source == "computed":
+            self.raw_inputs["extract_aqi"] = []
+        # Monitors ("county_site_poc") averaged into the city-level series of every pollutant, and the monitors whose
+        # days make a pollutant's daily panel, if more than the averaged ones. The co_drop_monitors are left out of
+        # the *_drop_290 CO series.
+        self.monitors = {pollutant: list(ids) for pollutant, ids in (monitors or {
+            "CO": ["31_3103_1", "31_4002_1", "31_6004_1", "31_63_1"],
+            "NO2": ["31_3103_1", "31_4002_1", "31_63_1"],
+            "Ozone": ["31_64_1", "31_7002_1"],
+            "PM10": ["31_1016_3", "31_22_3"],
+        }).items()}
+        self.monitor_panels = {pollutant: list(ids) for pollutant, ids in (monitor_panels or {
+            "Ozone": ["31_1003_2", "31_1601_1", "31_1_1", "31_32_1", "31_4002_1", "31_4007_1", "31_4201_1", "31_64_1",
+                      "31_7002_1", "31_72_1", "31_76_1"],
+        }).items()}
+        self.co_drop_monitors = list(co_drop_monitors)
+        # GHCN daily stations by the label of their columns (TMAX_MIDWAY, ...). The datasets use the MIDWAY columns,
+        # so the city's primary station is labelled MIDWAY.
+        self.ghcn_stations = dict(ghcn_stations or {"OHARE": "USW00094846", "MIDWAY": "USW00014819"})
+        # USAF id of the primary hourly weather station (wind of the city-level and micro datasets)
+        self.weather_usaf = weather_usaf
+        # Segments (route_num_1_mod) of the micro panel
+        self.routes = list(routes)
+        self.route_segments = [dict(box) for box in route_segments]
+        self.trim_boxes = [dict(box) for box in trim_boxes]
+
+    def panel_monitors(self, pollutant):
+        return self.monitor_panels.get(pollutant, self.monitors[pollutant])
+
+    def all_monitors(self):
+        # Every monitor that the city-level pollution series name
+        return sorted({monitor for ids in [*self.monitors.values(), *self.monitor_panels.values()] for monitor in ids})
+
+    def raw_stage(self, file_name):
+        # Stage that reads the raw file file_name, or None
+        return next((stage for stage, files in self.raw_inputs.items() if file_name in files), None)
+
+    def to_dict(self):
+        return {key: list(value) if isinstance(value, tuple) else value for key, value in vars(self).items()}
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(**spec)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls.from_dict(json.loads(Path(path).read_text()))
+
+    def to_file(self, path):
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+
+
+CHICAGO = CitySpec()
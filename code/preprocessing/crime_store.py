@@ -0,0 +1,108 @@
+import io
+import json
+
+import numpy as np
+import polars as pl
+
+# Crime stores sorted by id. The crime intermediates are written in id order in blocks of BLOCK_ROWS rows (row groups
+# of the parquet files), next to a sparse index <file>.index.json with the first and last id, the row offset and, for
+# .csv files, the byte range of every block. Joins on id then merge the two sorted sides instead of building a hash
+# table, and a point or range lookup of crimes reads only the blocks whose id range can hold them.
+SORTED_STORES = {
+    "chicago_part1_crimes": "id",
+    "chicago_all_crimes": "id",
+    "crime_road_distances": "id",
+}
+BLOCK_ROWS = 65_536
+
+
+def index_path(path):
+    return path.with_name(f"{path.name}.index.json")
+
+
+def sorted_by(data, key):
+    # data sorted by key and flagged as sorted, so that joins on key merge. The key must be unique, which is what
+    # validate="1:1" would check with a hash table.
+    if not data.get_column(key).is_sorted():
+        data = data.sort(key)
+    keys = data.get_column(key)
+    if keys.null_count() or not (keys.diff().drop_nulls() > 0).all():
+        raise ValueError(f"{key!r} must be unique and not null.")
+    return data.with_columns(pl.col(key).set_sorted())
+
+
+def encode(data, key, file_format, block_rows=BLOCK_ROWS):
+    # Content of data sorted by key in file_format, and its index
+    data = sorted_by(data, key)
+    keys = data.get_column(key).to_numpy()
+    buffer = io.BytesIO()
+    blocks = [{"first": int(keys[start]), "last": int(keys[min(start + block_rows, data.height) - 1]),
+               "row_offset": start, "rows": min(block_rows, data.height - start)}
+              for start in range(0, data.height, block_rows)]
+    index = {"key": key, "format": file_format, "rows": data.height, "blocks": blocks}
+    if file_format == "csv":
+        data.head(0).write_csv(buffer)
+        index["header_bytes"] = buffer.tell()
+        for block in blocks:
+            block["byte_offset"] = buffer.tell()
+            data.slice(block["row_offset"], block["rows"]).write_csv(buffer, include_header=False)
+            block["byte_length"] = buffer.tell() - block["byte_offset"]
+    elif file_format == "parquet":
+        data.write_parquet(buffer, row_group_size=block_rows)
+    else:
+        data.write_ipc(buffer)
+    return buffer.getvalue(), json.dumps(index).encode()
+
+
+def read_index(path):
+    return json.loads(index_path(path).read_text())
+
+
+def _block_runs(blocks):
+    # Runs of consecutive block numbers, as (first, last) pairs
+    runs = []
+    for block in blocks:
+        if runs and block == runs[-1][1] + 1:
+            runs[-1][1] = block
+        else:
+            runs.append([block, block])
+    return runs
+
+
+def read_blocks(path, index, blocks, schema=None):
+    # Rows of the given blocks (sorted block numbers); schema gives the dtypes of .csv files
+    parts = []
+    for first, last in _block_runs(blocks):
+        first, last = index["blocks"][first], index["blocks"][last]
+        if index["format"] == "csv":
+            with open(path, "rb") as file:
+                header = file.read(index["header_bytes"])
+                file.seek(first["byte_offset"])
+                content = file.read(last["byte_offset"] + last["byte_length"] - first["byte_offset"])
+            parts.append(pl.read_csv(header + content, schema=schema))
+        else:
+            scan = pl.scan_parquet(path) if index["format"] == "parquet" else pl.scan_ipc(path)
+            parts.append(scan.slice(first["row_offset"], last["row_offset"] + last["rows"] - first["row_offset"])
+                         .collect())
+    if not parts:
+        return None
+    return pl.concat(parts).with_columns(pl.col(index["key"]).set_sorted())
+
+
+def range_blocks(index, low=None, high=None):
+    # Blocks whose ids can lie in [low, high] (inclusive, None for unbounded)
+    firsts = np.array([block["first"] for block in index["blocks"]], dtype=np.int64)
+    lasts = np.array([block["last"] for block in index["blocks"]], dtype=np.int64)
+    start = 0 if low is None else int(np.searchsorted(lasts, low, side="left"))
+    stop = len(firsts) if high is None else int(np.searchsorted(firsts, high, side="right"))
+    return list(range(start, stop))
+
+
+def point_blocks(index, ids):
+    # Blocks that can hold any of ids
+    firsts = np.array([block["first"] for block in index["blocks"]], dtype=np.int64)
+    lasts = np.array([block["last"] for block in index["blocks"]], dtype=np.int64)
+    ids = np.asarray(ids, dtype=np.int64)
+    blocks = np.searchsorted(firsts, ids, side="right") - 1
+    found = (blocks >= 0) & (lasts[np.maximum(blocks, 0)] >= ids)
+    return sorted(set(blocks[found].tolist()))
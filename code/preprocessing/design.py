@@ -0,0 +1,86 @@
+import io
+
+import numpy as np
+import polars as pl
+
+# Model-ready design matrices of the causal forest extension (code/04-microreg_extension.R). They are built directly in
+# compressed sparse row form from the factor codes, so the mostly-zero dummy and interaction columns are never
+# expanded. The .npz layout is the one of scipy.sparse.save_npz (data, indices, indptr, format, shape), so
+# scipy.sparse.load_npz reads the matrix as is; Y, W, the cluster ids and the column names are stored next to it.
+FOREST_WEATHER = ["valueTMAX_MIDWAY", "valuePRCP_MIDWAY", "avg_wind_speed"]
+FOREST_OUTCOMES = ["treatment", "violent", "stand_crimes"]
+ROUTE_LEVELS = ["I290", "I55", "I57", "I90_A", "I90_B", "I90_C", "I94"]
+
+
+def forest_sample(micro_data, violent=1):
+    # Rows and variables of the forest fits: in-sample rows without missing values, wind speed in m/s, route ids in
+    # the factor order of the R script, sorted by date
+    return (micro_data
+            .sort("date", maintain_order=True)
+            .with_columns(pl.col("avg_wind_speed") / 10)
+            .filter(pl.col("insample") == 1)
+            .drop_nulls(["routeside", *FOREST_WEATHER, *FOREST_OUTCOMES])
+            .with_columns(
+        (pl.col("route_num1_mod").cast(pl.String).replace_strict(ROUTE_LEVELS, range(1, len(ROUTE_LEVELS) + 1),
+                                                                 default=None)).alias("route_id"))
+            .filter(pl.col("violent") == violent))
+
+
+def forest_design(sample, cluster=False):
+    # X of make_X: the weather covariates, route x side dummies (and route dummies with cluster=True), and the
+    # route x side dummies interacted with maximum temperature and precipitation. Returns the column names and the
+    # CSR arrays (data, indices, indptr, shape).
+    n_rows = sample.height
+    weather = sample.select(FOREST_WEATHER).to_numpy().astype(np.float64)
+    # Codes of the sorted levels; level 0 is the dropped first dummy (dummy_cols(remove_first_dummy = TRUE))
+    side_levels, side_codes = np.unique(sample.get_column("routeside").to_numpy(), return_inverse=True)
+    factors = [("routeside", side_levels, side_codes)]
+    if cluster:
+        factors.append(("route_id", *np.unique(sample.get_column("route_id").to_numpy(), return_inverse=True)))
+
+    columns = list(FOREST_WEATHER)
+    blocks = [(np.repeat(np.arange(n_rows), len(FOREST_WEATHER)),
+               np.tile(np.arange(len(FOREST_WEATHER)), n_rows),
+               weather.ravel())]
+
+    def add_dummies(name, levels, codes, weights=None, suffix=""):
+        rows = np.flatnonzero(codes > 0)
+        values = np.ones(len(rows)) if weights is None else weights[rows]
+        blocks.append((rows, len(columns) + codes[rows] - 1, values))
+        columns.extend(f"{name}_{level}{suffix}" for level in levels[1:])
+
+    for name, levels, codes in factors:
+        add_dummies(name, levels, codes)
+    add_dummies("routeside", side_levels, side_codes, weather[:, 0], "_x_max_temp")
+    add_dummies("routeside", side_levels, side_codes, weather[:, 1], "_x_prcp")
+
+    rows, cols, values = [np.concatenate(part) for part in zip(*blocks)]
+    nonzero = values != 0
+    rows, cols, values = rows[nonzero], cols[nonzero], values[nonzero]
+    order = np.lexsort((cols, rows))
+    indptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=n_rows))].astype(np.int32)
+    return columns, (values[order], cols[order].astype(np.int32), indptr, (n_rows, len(columns)))
+
+
+def design_npz(columns, matrix, sample):
+    # Serialized .npz (uncompressed, so the arrays can be read without inflating them)
+    data, indices, indptr, shape = matrix
+    buffer = io.BytesIO()
+    np.savez(buffer,
+             data=data, indices=indices, indptr=indptr, format=b"csr", shape=np.array(shape),
+             columns=np.array(columns),
+             Y=sample.get_column("stand_crimes").to_numpy().astype(np.float64),
+             W=sample.get_column("treatment").to_numpy().astype(np.float64),
+             clusters=sample.get_column("route_id").to_numpy())
+    return buffer.getvalue()
+
+
+def load_design(path):
+    # Returns the design as a dict with X as (data, indices, indptr, shape) and the column names as a list.
+    # scipy.sparse.csr_matrix(design["X"][:3], shape=design["X"][3]) gives the matrix.
+    with np.load(path, allow_pickle=False) as loaded:
+        return {"X": (loaded["data"], loaded["indices"], loaded["indptr"], tuple(int(n) for n in loaded["shape"])),
+                "columns": loaded["columns"].tolist(),
+                "Y": loaded["Y"],
+                "W": loaded["W"],
+                "clusters": loaded["clusters"]}
@@ -0,0 +1,339 @@
+import polars as pl
+
+from code.preprocessing import schemas
+
+# Out-of-core engine of DataPreprocessor (engine="duckdb"). The heavy stages - the crime extraction, the daily
+# aggregation of the CO, NO2 and ozone hourly files, the daily weather variables from the hourly weather and the crime
+# counts of the micro panel - run as SQL on an embedded DuckDB database with a memory limit, which spills its
+# aggregations, joins and sorts to temp_directory instead of holding every row in memory. The queries mirror the Polars
+# code of these stages line by line and return frames with the dtypes declared in schemas.py, so everything downstream
+# is shared. Two differences remain: means may differ from the Polars ones in the last bits, since the engines sum in a
+# different order, and where the Polars stages keep an arbitrary reading of a monitor day (unique without
+# maintain_order), DuckDB keeps its first reading. code/benchmark/parity.py compares the outputs of both engines.
+#
+# duckdb (and pyarrow, which it uses to hand results to Polars) is optional and imported by DuckDBBackend only.
+ENGINE_STAGES = ["extract_crime", "extract_co", "extract_no2", "extract_ozone", "generate_weather_variables",
+                 "micro", "micro_bands"]
+
+SQL_TYPES = {
+    pl.Boolean: "BOOLEAN",
+    pl.Int8: "TINYINT",
+    pl.Int16: "SMALLINT",
+    pl.Int32: "INTEGER",
+    pl.Int64: "BIGINT",
+    pl.UInt32: "UINTEGER",
+    pl.Float64: "DOUBLE",
+    pl.String: "VARCHAR",
+    pl.Categorical: "VARCHAR",
+    pl.Enum: "VARCHAR",
+    pl.Date: "DATE",
+    pl.Datetime: "TIMESTAMP",
+}
+
+# AQS columns of the daily files: (column of the measurement statistics, divisor of the statistics, 1-hour samples
+# only, with the daily maximum 8-hour average)
+AQS_DAILY = {
+    "co": ("co", 1, True, True),
+    "no2": ("no2", 1000, False, False),
+    "ozone": ("ozone", 1, False, True),
+}
+
+_VIOLENT_CODES = ["01A", "02", "04A", "04B", "08A", "08B"]
+_PART1_CODES = ["01A", "02", "03", "04A", "04B", "05", "06", "07", "09"]
+_BAD_QUALITY = ["6", "7", "3", "2"]
+_GOOD_WIND = ["1", "5", "9"]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _list(values):
+    return "[" + ", ".join(_literal(value) for value in values) + "]"
+
+
+def _in(values):
+    return "(" + ", ".join(_literal(value) for value in values) + ")"
+
+
+def _snake(col):
+    return col.lower().replace(" ", "_")
+
+
+def sql_type(dtype):
+    return SQL_TYPES[dtype.base_type()]
+
+
+def _floor_mod(value, divisor):
+    # Modulo with the sign of the divisor, like Polars' mod (DuckDB's % keeps the sign of the dividend)
+    return f"CASE WHEN ({value}) % {divisor} < 0 THEN ({value}) % {divisor} + {divisor} ELSE ({value}) % {divisor} END"
+
+
+class DuckDBBackend:
+    def __init__(self, memory_limit=None, temp_directory=None, threads=None):
+        try:
+            import duckdb
+            # Results reach Polars as Arrow record batches
+            import pyarrow  # noqa: F401
+        except ImportError as error:
+            raise ImportError("The duckdb engine needs the optional duckdb and pyarrow packages "
+                              "(pip install duckdb pyarrow).") from error
+        config = {"preserve_insertion_order": False}
+        if memory_limit is not None:
+            config["memory_limit"] = f"{max(memory_limit // 1024 ** 2, 1)}MiB"
+        if temp_directory is not None:
+            config["temp_directory"] = str(temp_directory)
+        if threads is not None:
+            config["threads"] = threads
+        self.connection = duckdb.connect(config=config)
+
+    def _attach(self, cursor, view, paths, schema, null_values=()):
+        # The files at paths (same format and columns) as the view of the cursor. schema holds the dtypes of the
+        # .csv columns in the order of the files.
+        suffix = paths[0].suffix
+        if suffix in [".ipc", ".arrow"]:
+            # DuckDB reads no Arrow IPC files; the memory-mapped frame is scanned in place
+            cursor.register(view, pl.concat([pl.read_ipc(path, memory_map=True) for path in paths]))
+            return
+        files = _list(path.as_posix() for path in paths)
+        if suffix == ".parquet":
+            relation = f"read_parquet({files})"
+        else:
+            columns = "{" + ", ".join(f"{_literal(col)}: {_literal(sql_type(dtype))}"
+                                      for col, dtype in schema.items()) + "}"
+            # As with the Polars reader: empty fields are null, quoted empty strings are not, short lines (the END OF
+            # FILE line of the AQS files) are padded with nulls
+            relation = (f"read_csv({files}, header = true, delim = ',', quote = '\"', escape = '\"', "
+                        f"columns = {columns}, nullstr = {_list(['', *null_values])}, allow_quoted_nulls = false, "
+                        f"null_padding = true, auto_detect = false)")
+        cursor.execute(f"CREATE TEMP VIEW {_quote(view)} AS SELECT * FROM {relation}")
+
+    def query(self, sources, *statements):
+        # Results of the statements over the sources ({view: (paths, schema, null_values)}), on one cursor so that
+        # later statements see the temp tables of earlier ones. Results are streamed to Polars in record batches
+        # rather than materialized inside the memory limit of the database.
+        with self.connection.cursor() as cursor:
+            for view, (paths, file_schema, null_values) in sources.items():
+                self._attach(cursor, view, paths, file_schema, null_values)
+            return [pl.from_arrow(cursor.execute(statement).fetch_record_batch().read_all())
+                    for statement in statements]
+
+    @staticmethod
+    def _typed(data, name, schema):
+        return data.cast(schemas.file_schema(name, data.columns, schema))
+
+    def crime_data(self, paths, schema, years):
+        # Crimes of the raw crime file in years, as _extract_crime_data (before it splits them into the two stores)
+        columns = [(f"CASE WHEN {_quote(col)} = '09' THEN '08' ELSE {_quote(col)} END" if col == "FBI Code" else
+                    _quote(col)) + f" AS {_quote(_snake(col))}" for col in schema if col != "Date"]
+        sql = f"""
+            SELECT {", ".join(columns)},
+                   CAST(occurred AS DATE) AS date,
+                   hour(occurred) AS hour,
+                   minute(occurred) AS minute,
+                   second(occurred) AS second,
+                   CASE WHEN "FBI Code" IN {_in(_PART1_CODES)} THEN 1 ELSE 0 END AS part1,
+                   CASE WHEN "FBI Code" IN {_in(_VIOLENT_CODES)} THEN 1 ELSE 0 END AS violent
+            FROM (SELECT *, strptime("Date", '%m/%d/%Y %I:%M:%S %p') AS occurred
+                  FROM crimes
+                  WHERE "Year" BETWEEN {int(years[0])} AND {int(years[1])})
+        """
+        data, = self.query({"crimes": (paths, schema, ())}, sql)
+        return self._typed(data, "chicago_part1_crimes", schemas.INTERMEDIATE["chicago_part1_crimes"])
+
+    def aqs_daily(self, paths, schema, pollutant, name):
+        # Daily statistics of the monitors of AQS hourly files, as _extract_chicago_co, _no2 and _ozone: the hourly
+        # readings of days with at least 18 of them, the count, maximum and mean of the readings of the sample duration
+        # of the kept reading, and the daily maximum 8-hour average of the 1-hour samples
+        suffix, divisor, hourly_only, with_max_8hr = AQS_DAILY[pollutant]
+        renamed = {_snake(col): col for col in schema}
+        kept = [col for col in renamed if "gmt" not in col]
+        if hourly_only:
+            rows = "sample_duration = '1 HOUR'"
+        else:
+            rows = (f"NOT ({' AND '.join(f'{_quote(col)} IS NULL' for col in renamed)}) "
+                    f"OR sample_duration = '8-HR RUN AVG BEGIN HOUR'")
+        keys = ["monitor_id", "date_local", "sample_duration"]
+        max_8hr = f"""
+            , hourly AS (
+                SELECT monitor_id,
+                       CAST(date_local AS TIMESTAMP) + to_hours(CAST(substr("24_hour_local", 1, 2) AS BIGINT))
+                           AS datetime,
+                       sample_measurement
+                FROM aqs
+                WHERE sample_duration = '1 HOUR' AND sample_measurement IS NOT NULL)
+            , rolling AS (
+                -- Running averages over [t, t + 8h), the readings being whole hours
+                SELECT monitor_id, datetime,
+                       avg(sample_measurement) OVER eight_hours AS mean_8hr,
+                       count(*) OVER eight_hours AS hours
+                FROM hourly
+                WINDOW eight_hours AS (
+                    PARTITION BY monitor_id ORDER BY datetime
+                    RANGE BETWEEN CURRENT ROW
+                          AND INTERVAL '7 hours 59 minutes 59 seconds 999999 microseconds' FOLLOWING))
+            , max_8hr AS (
+                SELECT monitor_id, CAST(datetime AS DATE) AS date, max(mean_8hr) AS max8hr_{suffix}
+                FROM rolling
+                WHERE hours >= 6
+                GROUP BY ALL)
+        """ if with_max_8hr else ""
+        sql = f"""
+            WITH aqs AS (
+                SELECT {", ".join(f"{_quote(raw)} AS {_quote(col)}" for col, raw in renamed.items())},
+                       CAST("County Code" AS BIGINT) * 1000000 + CAST("Site Num" AS BIGINT) * 100
+                           + CAST("POC" AS BIGINT) AS monitor_id
+                FROM raw)
+            , durations AS (
+                SELECT {", ".join(keys)},
+                       count(sample_measurement) AS num_hrly_obs_{suffix},
+                       max(sample_measurement) / {divisor} AS max_{suffix},
+                       avg(sample_measurement) / {divisor} AS avg_{suffix}
+                FROM aqs
+                WHERE {rows}
+                GROUP BY ALL)
+            , days AS (
+                SELECT monitor_id, date_local,
+                       arg_min({{{", ".join(f"{_literal(col)}: {_quote(col)}" for col in kept)}}},
+                               ("24_hour_local", sample_duration)) AS reading
+                FROM aqs
+                WHERE {rows}
+                GROUP BY ALL
+                HAVING count(sample_measurement) >= 18)
+            {max_8hr}
+            SELECT {", ".join(f"reading.{_quote(col)}" for col in kept if col != "date_local")},
+                   CAST(days.date_local AS TIMESTAMP) AS date_local,
+                   days.monitor_id,
+                   num_hrly_obs_{suffix}, max_{suffix}, avg_{suffix},
+                   days.date_local AS date
+                   {f", max8hr_{suffix}" if with_max_8hr else ""}
+            FROM days
+            JOIN durations
+              ON days.monitor_id IS NOT DISTINCT FROM durations.monitor_id
+             AND days.date_local IS NOT DISTINCT FROM durations.date_local
+             AND reading.sample_duration IS NOT DISTINCT FROM durations.sample_duration
+            {"LEFT JOIN max_8hr ON days.monitor_id = max_8hr.monitor_id AND days.date_local = max_8hr.date"
+             if with_max_8hr else ""}
+            ORDER BY days.monitor_id, date
+        """
+        data, = self.query({"raw": (paths, schema, ["END OF FILE"])}, sql)
+        data = self._typed(data, name, schemas.INTERMEDIATE[name])
+        # In the column order of the Polars stage, where date_local keeps its place among the raw columns
+        return data.select(*kept, *[col for col in data.columns if col not in kept])
+
+    def weather_daily(self, paths, schema):
+        # Daily wind, temperature, dew point and pressure variables of every hourly station, as
+        # _generate_weather_variables
+        wind_stats = {"": "1", "_speed": "wind_speed", "_power": "power(wind_speed, 3)"}
+
+        def direction(average):
+            return (f"CASE WHEN y{average} < 0 THEN atan2(y{average}, x{average}) + 2 * pi() "
+                    f"WHEN y{average} >= 0 THEN atan2(y{average}, x{average}) END")
+
+        def cleaned(col, missing):
+            return (f"CASE WHEN {col}_qual IN {_in(_BAD_QUALITY)} OR {col} = {missing} THEN NULL ELSE {col} END "
+                    f"AS {col}_new")
+
+        sql = f"""
+            WITH speeds AS (
+                SELECT usaf, wban, make_date(year, month, day) AS date, wind_angle, wind_angle_qual, wind_speed_qual,
+                       temp, temp_qual, dewpoint, dewpoint_qual, sealevel_pressure, sealevel_pressure_qual,
+                       CASE WHEN wind_speed = 9999 OR (wind_angle = 999 AND wind_speed <> 0) THEN NULL
+                            ELSE wind_speed END AS wind_speed
+                FROM weather)
+            , readings AS (
+                SELECT usaf, wban, date, wind_speed,
+                       CASE WHEN wind_speed IS NULL THEN NULL WHEN wind_speed = 0 THEN 0 ELSE wind_angle END
+                           AS wind_angle,
+                       {cleaned("temp", 9999)},
+                       {cleaned("dewpoint", 9999)},
+                       {cleaned("sealevel_pressure", 99999)}
+                FROM speeds
+                WHERE wind_speed_qual IN {_in(_GOOD_WIND)} AND wind_angle_qual IN {_in(_GOOD_WIND)})
+            , vectors AS (
+                SELECT *,
+                       cos(wind_angle * (pi() / 180)) AS xwind,
+                       sin(wind_angle * (pi() / 180)) AS ywind
+                FROM readings)
+            , daily AS (
+                SELECT usaf, wban, date,
+                       {", ".join(f"avg({weight} * xwind) AS xwind{name}_avg, avg({weight} * ywind) AS ywind{name}_avg"
+                                  for name, weight in wind_stats.items())},
+                       avg(wind_speed) AS avg_wind_speed,
+                       count_if(wind_speed IS NOT NULL AND wind_angle IS NOT NULL) AS windobs,
+                       max(temp_new) AS tmax,
+                       avg(temp_new) AS tavg,
+                       min(temp_new) AS tmin,
+                       count(temp_new) AS totobs,
+                       avg(dewpoint_new) AS dew_point_avg,
+                       avg(sealevel_pressure_new) AS sealevel_pressure_avg
+                FROM vectors
+                GROUP BY ALL)
+            SELECT usaf, wban, date,
+                   {direction("wind_avg")} AS wind_dir_avg,
+                   {direction("wind_speed_avg")} AS wind_speed_dir_avg,
+                   {direction("wind_power_avg")} AS wind_power_dir_avg,
+                   avg_wind_speed, windobs,
+                   sqrt(power(xwind_speed_avg, 2) + power(ywind_speed_avg, 2)) AS speed_norm,
+                   power(sqrt(power(xwind_power_avg, 2) + power(ywind_power_avg, 2)), 1 / 3) / 1000 AS power_norm,
+                   sqrt(power(xwind_speed_avg, 2) + power(ywind_speed_avg, 2)) = 0 AS calmday,
+                   totobs < 18 AS tempdataflag,
+                   tmax, tavg, tmin, dew_point_avg, sealevel_pressure_avg
+            FROM daily
+            ORDER BY usaf, wban, date
+        """
+        name = "chicago_weather_daily_from_hourly"
+        data, = self.query({"weather": (paths, schema, ())}, sql)
+        return self._typed(data, name, schemas.INTERMEDIATE[name])
+
+    def micro_crimes(self, distances, crimes, inner_edges=None, distance_threshold=5280):
+        # Treatment angle of every route and crime counts by date, route, side and violent (and distance band with
+        # inner_edges), as create_micro_dataset. distances and crimes are (paths, schema) of the two crime stores.
+        band = ""
+        if inner_edges is not None:
+            # Bands as search_sorted(inner_edges, near_dist_1, side="left"): the number of edges below the distance
+            band = (f", len(list_filter([{', '.join(repr(float(edge)) for edge in inner_edges)}]::DOUBLE[], "
+                    f"edge -> edge < near_dist_1)) AS distance_band")
+        keys = ["date", "route_num_1_mod", "side_dummy", "violent", *(["distance_band"] if band else [])]
+        merged = f"""
+            CREATE TEMP TABLE merged AS
+            SELECT distances.id, distances.route_num_1_mod, distances.near_angle_1, distances.near_dist_1,
+                   crimes.date, crimes.violent,
+                   {_floor_mod("distances.near_angle_1", 180)} AS ortho_dir
+            FROM distances
+            LEFT JOIN crimes ON distances.id = crimes.id
+            WHERE distances.sample_set = 1
+        """
+        treatment = """
+            CREATE TEMP TABLE treatment AS
+            -- Most common orthogonal direction of the route, the smallest one on ties
+            SELECT route_num_1_mod, min(ortho_dir) AS treatment_angle
+            FROM (SELECT route_num_1_mod, ortho_dir, count(*) AS crimes
+                  FROM merged
+                  GROUP BY route_num_1_mod, ortho_dir
+                  QUALIFY crimes = max(crimes) OVER (PARTITION BY route_num_1_mod))
+            GROUP BY ALL
+        """
+        adjusted = _floor_mod("near_angle_1 - treatment_angle", 360)
+        counts = f"""
+            SELECT {", ".join(keys)}, count(id) AS num_crimes
+            FROM (SELECT merged.*,
+                         CASE WHEN {adjusted} > 90 AND {adjusted} < 270 THEN 1 ELSE 0 END AS side_dummy
+                         {band}
+                  FROM merged
+                  LEFT JOIN treatment ON merged.route_num_1_mod = treatment.route_num_1_mod
+                  {f"WHERE near_dist_1 <= {distance_threshold}" if band else ""})
+            GROUP BY ALL
+        """
+        *_, angles, counts = self.query({"distances": (*distances, ()), "crimes": (*crimes, ())},
+                                        merged, treatment, "SELECT * FROM treatment", counts)
+        schema = {"date": pl.Date, "route_num_1_mod": pl.Categorical, "side_dummy": pl.Int32, "violent": pl.Int32,
+                  "distance_band": pl.UInt32, "num_crimes": pl.UInt32}
+        return (self._typed(angles, "treatment angles", {"route_num_1_mod": pl.Categorical,
+                                                         "treatment_angle": pl.Float64}),
+                self._typed(counts, "micro crime counts",
+                            {col: dtype for col, dtype in schema.items() if col in [*keys, "num_crimes"]}))
@@ -0,0 +1,74 @@
+import polars as pl
+
+# High-pollution episodes of the city-level pollution series and the crimes around them. An episode is a run of at
+# least min_days consecutive days whose value is above the threshold of its column; a missing value or a missing day
+# ends a run. Runs are found by run-length encoding the above-threshold flag: a new run starts wherever the flag
+# changes or the calendar skips a day, and the cumulative sum of the starts numbers the runs. Crimes are counted in
+# [start, end] and in the pre and post windows of window_days before the start and after the end, all in one pass:
+# the crime dates are sorted once and every window bound is located among them with a single search_sorted, so that a
+# count is the difference of two positions. Windows of neighbouring episodes may overlap.
+EPISODE_THRESHOLDS = {
+    # ug/m3, WHO 2005 24-hour guideline
+    "avg_pm10_mean": 50.0,
+    # ppm, daily mean of the hourly readings
+    "avg_ozone_mean": 0.04,
+}
+WINDOWS = ["pre", "episode", "post"]
+
+
+def find_episodes(pollution, column, threshold, min_days=2):
+    # Episodes of one column: start, end, length, and the peak value and the first day it is reached
+    return (pollution.lazy()
+            .select("date", pl.col(column).alias("value"))
+            .sort("date")
+            .with_columns(
+        (pl.col("value") > threshold).fill_null(False).alias("above"))
+            .with_columns(
+        ((pl.col("above") != pl.col("above").shift(1))
+         | (pl.col("date").diff() != pl.duration(days=1))).fill_null(True).cum_sum().alias("run"))
+            .filter(
+        pl.col("above"))
+            .group_by("run")
+            .agg(
+        pl.col("date").min().alias("start"),
+        pl.col("date").max().alias("end"),
+        pl.len().alias("days"),
+        pl.col("value").max().alias("peak"),
+        pl.col("date").get(pl.col("value").arg_max()).alias("peak_date"))
+            .filter(
+        pl.col("days") >= min_days)
+            .sort("start")
+            .select(
+        pl.lit(column).alias("pollutant"),
+        pl.int_range(pl.len(), dtype=pl.UInt32).alias("episode"),
+        "start", "end", "days", "peak", "peak_date"))
+
+
+def window_bounds(episodes, window_days):
+    # First and last day of the pre, episode and post windows of every episode
+    return episodes.with_columns(
+        (pl.col("start") - pl.duration(days=window_days)).alias("pre_first"),
+        (pl.col("start") - pl.duration(days=1)).alias("pre_last"),
+        pl.col("start").alias("episode_first"),
+        pl.col("end").alias("episode_last"),
+        (pl.col("end") + pl.duration(days=1)).alias("post_first"),
+        (pl.col("end") + pl.duration(days=window_days)).alias("post_last"))
+
+
+def count_crimes(episodes, crimes, window_days=7, groups=("violent",)):
+    # Crimes (and crimes with each 0/1 flag of groups) in the windows of every episode, crimes sorted by date
+    episodes = window_bounds(episodes.lazy(), window_days).collect()
+    counts = []
+    for name in [None, *groups]:
+        dates = crimes.get_column("date") if name is None else crimes.filter(pl.col(name) == 1).get_column("date")
+        suffix = "crimes" if name is None else name
+        for window in WINDOWS:
+            first = dates.search_sorted(episodes.get_column(f"{window}_first"), side="left").cast(pl.Int64)
+            last = dates.search_sorted(episodes.get_column(f"{window}_last"), side="right").cast(pl.Int64)
+            counts.append((last - first).alias(f"{window}_{suffix}"))
+    days = [((pl.col(f"{window}_last") - pl.col(f"{window}_first")).dt.total_days() + 1).alias(f"{window}_days")
+            for window in WINDOWS]
+    return (episodes
+            .with_columns(counts)
+            .with_columns(days)
+            .drop(*[f"{window}_{bound}" for window in WINDOWS for bound in ["first", "last"]]))
@@ -0,0 +1,51 @@
+import polars as pl
+
+# Lagged, lead and rolling-window versions of daily columns for distributed-lag and placebo-lead specifications.
+# The frame is first aligned to a complete daily calendar, so that a lag of k is always the value of k days earlier
+# (null if that day is missing) rather than of k rows earlier, and a rolling window only has a value if all of its
+# days are present. All features are expressions of a single lazy query.
+CITY_FEATURE_COLUMNS = ["avg_pm10_mean", "standardized_pm", "avg_co_mean", "avg_no2_mean", "avg_ozone_mean", "tmax",
+                        "PRCP_MIDWAY", "avg_wind_speed"]
+ROLLING_STATS = ["mean", "max", "sum"]
+
+
+class FeatureSpec:
+    # lags and leads in days; windows in days, trailing and including the current day
+    def __init__(self, columns=CITY_FEATURE_COLUMNS, lags=(), leads=(), windows=(), stats=("mean",)):
+        unknown = [name for name in stats if name not in ROLLING_STATS]
+        if unknown:
+            raise ValueError(f"Unknown rolling statistics {unknown}. Use {ROLLING_STATS}.")
+        self.columns = list(columns)
+        self.lags = sorted(set(lags))
+        self.leads = sorted(set(leads))
+        self.windows = sorted(set(windows))
+        self.stats = list(stats)
+
+    @property
+    def empty(self):
+        return not (self.lags or self.leads or self.windows)
+
+    def expressions(self):
+        expressions = []
+        for col in self.columns:
+            value = pl.col(col).cast(pl.Float64)
+            expressions.extend(value.shift(k).alias(f"{col}_lag{k}") for k in self.lags)
+            expressions.extend(value.shift(-k).alias(f"{col}_lead{k}") for k in self.leads)
+            expressions.extend(getattr(value, f"rolling_{name}")(window, min_samples=window)
+                               .alias(f"{col}_roll{window}_{name}")
+                               for window in self.windows for name in self.stats)
+        return expressions
+
+
+def time_features(data, spec, date="date"):
+    # Lazy frame of data with the features of spec appended
+    calendar = (data.lazy()
+                .select(pl.date_range(pl.col(date).min(), pl.col(date).max(), interval="1d").alias(date)))
+    features = (calendar
+                .join(
+        data.lazy().select(date, *spec.columns), on=date, how="left", validate="1:1")
+                .sort(date)
+                .select(date, *spec.expressions()))
+    return (data.lazy()
+            .join(
+        features, on=date, how="left", validate="1:1", maintain_order="left"))
@@ -0,0 +1,77 @@
+import io
+
+import numpy as np
+import polars as pl
+
+# Crime counts on a regular grid over the Illinois State Plane coordinates of the crime records (feet). Cells are
+# squares of side cell_size or pointy-top hexagons of circumradius cell_size, identified by integer (cell_i, cell_j)
+# indices: column and row for squares, axial coordinates (q, r) for hexagons. Only non-empty cell x day x category
+# combinations are kept, so the cube is stored sparsely.
+SHAPES = ["square", "hex"]
+
+
+def square_cells(x, y, cell_size):
+    return (x / cell_size).floor(), (y / cell_size).floor()
+
+
+def hex_cells(x, y, cell_size):
+    # Fractional cube coordinates of the point, rounded to the nearest hexagon: the component with the largest
+    # rounding error is recomputed from the other two
+    q = (np.sqrt(3) / 3 * x - y / 3) / cell_size
+    r = 2 / 3 * y / cell_size
+    s = -q - r
+    q_round, r_round, s_round = q.round(), r.round(), s.round()
+    q_error, r_error, s_error = (q_round - q).abs(), (r_round - r).abs(), (s_round - s).abs()
+    q_largest = (q_error > r_error) & (q_error > s_error)
+    i = pl.when(q_largest).then(-r_round - s_round).otherwise(q_round)
+    j = pl.when(~q_largest & (r_error > s_error)).then(-q_round - s_round).otherwise(r_round)
+    return i, j
+
+
+def cell_centers(i, j, cell_size, shape):
+    if shape == "square":
+        return (i + 0.5) * cell_size, (j + 0.5) * cell_size
+    return cell_size * np.sqrt(3) * (i + j / 2), cell_size * 1.5 * j
+
+
+def grid_counts(crimes, cell_size, shape="square", category="fbi_code"):
+    # Lazy cell x day x category counts of the crimes with coordinates
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown cell shape {shape!r}. Use {SHAPES}.")
+    cells = square_cells if shape == "square" else hex_cells
+    i, j = cells(pl.col("x_coordinate").cast(pl.Float64), pl.col("y_coordinate").cast(pl.Float64), cell_size)
+    center_x, center_y = cell_centers(pl.col("cell_i"), pl.col("cell_j"), cell_size, shape)
+    return (crimes.lazy()
+            .filter(
+        pl.col("x_coordinate").is_not_null() & pl.col("y_coordinate").is_not_null())
+            .group_by(
+        i.cast(pl.Int32).alias("cell_i"), j.cast(pl.Int32).alias("cell_j"), "date", category)
+            .agg(
+        pl.len().cast(pl.Int32).alias("num_crimes"))
+            .with_columns(
+        center_x.alias("center_x"), center_y.alias("center_y"))
+            .sort("cell_i", "cell_j", "date", category))
+
+
+def grid_npz(counts, category="fbi_code"):
+    # COO layout of the cube: one entry per non-empty (cell, day, category) with its count, the cells as
+    # (cell_i, cell_j, center_x, center_y) rows, the days as days since 1970-01-01 and the category labels
+    cells = counts.select("cell_i", "cell_j", "center_x", "center_y").unique(maintain_order=True)
+    categories = counts.get_column(category).cast(pl.String).unique().sort()
+    entries = (counts
+               .join(
+        cells.select("cell_i", "cell_j").with_row_index("cell"), on=["cell_i", "cell_j"], how="left",
+        validate="m:1", maintain_order="left")
+               .with_columns(
+        pl.col(category).cast(pl.String).replace_strict(categories, range(len(categories)),
+                                                        return_dtype=pl.Int32).alias("category")))
+    buffer = io.BytesIO()
+    np.savez(buffer,
+             cell=entries.get_column("cell").to_numpy().astype(np.int32),
+             day=entries.get_column("date").to_physical().to_numpy().astype(np.int32),
+             category=entries.get_column("category").to_numpy(),
+             count=entries.get_column("num_crimes").to_numpy(),
+             cells=cells.select("cell_i", "cell_j").to_numpy(),
+             centers=cells.select("center_x", "center_y").to_numpy(),
+             categories=np.array(categories.to_list()))
+    return buffer.getvalue()
@@ -1,29 +1,265 @@
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
 import pandas as pd
 import numpy as np
 import polars as pl
 import polars.selectors as cs
-from aiofiles.os import makedirs
 
+from code.preprocessing import (aqi, crime_store, design, duckdb_backend, episodes, features, grid, sampling, schemas,
+                                spatial, summary)
+from code.preprocessing.async_io import AsyncFileIO
+from code.preprocessing.city import CHICAGO, CitySpec
+from code.preprocessing.profiling import StageProfiler, stage
+from code.preprocessing.stages import STAGES, execution_waves
 
 class DataPreprocessor:
     def __init__(self,
                  input_data_path: Path,
-                 output_data_path: Path,):
+                 output_data_path: Path,
+                 profile: bool = False,
+                 storage_format: str = "csv",
+                 streaming: bool = False,
+                 jobs: int = 1,
+                 memory_limit: int = None,
+                 engine: str = "polars",
+                 async_io: bool = False,
+                 max_inflight_bytes: int = 512 * 1024 ** 2,
+                 summary_statistics: bool = False,
+                 sample: sampling.SampleSpec = None,
+                 city: CitySpec = CHICAGO,):
+        if storage_format not in ["csv", "parquet", "ipc"]:
+            raise ValueError(f"Unknown storage format {storage_format!r}. Use 'csv', 'parquet' or 'ipc'.")
+        if engine not in ["polars", "duckdb"]:
+            raise ValueError(f"Unknown engine {engine!r}. Use 'polars' or 'duckdb'.")
+        if engine == "duckdb" and sample is not None:
+            raise ValueError("The duckdb engine reads the raw files itself and cannot sample them.")
         self.input_data_path = input_data_path
         self.output_data_path = output_data_path
+        self.profiler = StageProfiler() if profile else None
+        # Format of the intermediate files. The final datasets read by the R scripts are always written as .csv.
+        self.storage_format = storage_format
+        # Polars has no hard memory cap, so a memory budget (in bytes) switches lazy queries to the streaming engine
+        self.memory_limit = memory_limit
+        self.streaming = streaming or memory_limit is not None
+        # With engine "duckdb", the stages of duckdb_backend.ENGINE_STAGES run as SQL on an embedded DuckDB database,
+        # which holds to memory_limit and spills to output_data_path/duckdb_tmp (see duckdb_backend.py)
+        self.engine = engine
+        self.backend = (None if engine == "polars" else
+                        duckdb_backend.DuckDBBackend(memory_limit, output_data_path / "duckdb_tmp"))
+        self.jobs = jobs
+        # With async_io, run() prefetches the raw files of its stages and writes outputs in the background. At most
+        # max_inflight_bytes are held in prefetched files, and as much again in pending writes.
+        self.async_io = async_io
+        self.max_inflight_bytes = max_inflight_bytes
+        self.io = None
+        # With summary_statistics, the final datasets are reduced to the moments of summary.TABLE_SUMMARIES as they are written
+        # and run() writes summary_statistics.csv
+        self.summary = summary.SummaryStatistics() if summary_statistics else None
+        # Development mode: every raw file is filtered by the sample spec as it is read (see sampling.py)
+        self.sample = sample
+        # Raw files, years, monitors, stations and routes of the city (see city.py)
+        self.city = city
 
         os.makedirs(output_data_path, exist_ok=True)
 
-    def _extract_crime_data(self):
-        crime_data = (pl.read_csv(self.input_data_path / "chicago_crime.csv")
+    # I/O helpers ------------------------------------------------------------------------------------------------------
+    def _source(self, path):
+        # Prefetched content of path if run() prefetched it, otherwise the path itself
+        content = self.io.take(path) if self.io is not None else None
+        return path if content is None else content
+
+    def _raw_paths(self, stage):
+        return [self.input_data_path / file for file in self.city.raw_inputs[stage]]
+
+    def _raw_filter(self, path):
+        return None if self.sample is None else self.sample.raw_filter(path.name, self.input_data_path, self.city)
+
+    def _csv_schema(self, path, schema, extra_columns=None, source=None, **kwargs):
+        header = pl.read_csv(path if source is None else source, n_rows=0, **kwargs).columns
+        return schemas.file_schema(path.name, header, schema, extra_columns)
+
+    def _read_csv(self, path, schema, extra_columns=None, **kwargs):
+        source = self._source(path)
+        schema = self._csv_schema(path, schema, extra_columns, source, **kwargs)
+        row_filter = self._raw_filter(path)
+        if row_filter is None:
+            data = pl.read_csv(source, schema=schema, **kwargs)
+        else:
+            data = pl.scan_csv(source, schema=schema, **kwargs).filter(row_filter).collect()
+        if self.profiler is not None:
+            self.profiler.record_input(path, data)
+        return data
+
+    def _scan_csv(self, path, schema, extra_columns=None, **kwargs):
+        if self.profiler is not None:
+            self.profiler.record_input(path)
+        data = pl.scan_csv(path, schema=self._csv_schema(path, schema, extra_columns, **kwargs), **kwargs)
+        row_filter = self._raw_filter(path)
+        return data if row_filter is None else data.filter(row_filter)
+
+    def _engine_raw(self, stage, schema, **kwargs):
+        # Raw files of a stage and their dtypes in file order, for the duckdb engine. The header of every file is
+        # checked against the declaration, as the Polars reader does.
+        paths = self._raw_paths(stage)
+        file_schemas = [self._csv_schema(path, schema, **kwargs) for path in paths]
+        if self.profiler is not None:
+            for path in paths:
+                self.profiler.record_input(path)
+        return paths, file_schemas[0]
+
+    def _read_stata(self, path, schema):
+        source = self._source(path)
+        data = pl.from_pandas(pd.read_stata(path if source is path else io.BytesIO(source)))
+        schema = schemas.file_schema(path.name, data.columns, schema)
+        # Stata stores some flags as numbers, which only cast to Categorical by way of String
+        data = (data
+                .cast({col: pl.String for col, dtype in schema.items() if dtype == pl.Categorical})
+                .cast(schema))
+        row_filter = self._raw_filter(path)
+        if row_filter is not None:
+            data = data.filter(row_filter)
+        if self.profiler is not None:
+            self.profiler.record_input(path, data)
+        return data
+
+    def _collect(self, lazy_data):
+        if self.profiler is not None:
+            self.profiler.record_plan(lazy_data)
+        return lazy_data.collect(engine="streaming" if self.streaming else "auto")
+
+    def _write(self, data, path, file_format):
+        if self.io is None:
+            getattr(data, f"write_{file_format}")(path)
+            return
+        # Serialize now and leave the disk write to the background loop
+        buffer = io.BytesIO()
+        getattr(data, f"write_{file_format}")(buffer)
+        self.io.write(path, buffer.getvalue())
+
+    def _write_bytes(self, content, path):
+        if self.io is None:
+            path.write_bytes(content)
+        else:
+            self.io.write(path, content)
+        if self.profiler is not None:
+            self.profiler.record_output(path, None)
+
+    def _write_csv(self, data, path):
+        if self.summary is not None:
+            self.summary.observe(path.name, data)
+        self._write(data, path, "csv")
+        if self.profiler is not None:
+            self.profiler.record_output(path, data)
+
+    def _intermediate_path(self, name):
+        return self.output_data_path / f"{name}.{self.storage_format}"
+
+    def _read_intermediate(self, name):
+        # Every storage format hands out the dtypes declared in schemas.INTERMEDIATE
+        path = self._intermediate_path(name)
+        schema = schemas.INTERMEDIATE[name]
+        extra_columns = schemas.INTERMEDIATE_EXTRA_COLUMNS.get(name)
+        if self.io is not None:
+            self.io.wait_written(path)
+        if self.storage_format == "csv":
+            return self._read_csv(path, schema, extra_columns)
+        data = pl.read_parquet(path) if self.storage_format == "parquet" else pl.read_ipc(path)
+        schemas.check_schema(path.name, data.schema, schema, extra_columns)
+        if self.profiler is not None:
+            self.profiler.record_input(path, data)
+        return data
+
+    def _scan_intermediate(self, name):
+        path = self._intermediate_path(name)
+        schema = schemas.INTERMEDIATE[name]
+        extra_columns = schemas.INTERMEDIATE_EXTRA_COLUMNS.get(name)
+        if self.io is not None:
+            self.io.wait_written(path)
+        if self.storage_format == "csv":
+            return self._scan_csv(path, schema, extra_columns)
+        if self.profiler is not None:
+            self.profiler.record_input(path)
+        data = pl.scan_parquet(path) if self.storage_format == "parquet" else pl.scan_ipc(path)
+        schemas.check_schema(path.name, data.collect_schema(), schema, extra_columns)
+        return data
+
+    def _engine_source(self, name):
+        # Intermediate file and its dtypes, for the duckdb engine
+        path = self._intermediate_path(name)
+        schema = schemas.INTERMEDIATE[name]
+        if self.io is not None:
+            self.io.wait_written(path)
+        if self.profiler is not None:
+            self.profiler.record_input(path)
+        if self.storage_format == "csv":
+            schema = self._csv_schema(path, schema, schemas.INTERMEDIATE_EXTRA_COLUMNS.get(name))
+        return [path], schema
+
+    def _write_intermediate(self, data, name):
+        schemas.check_schema(name, data.schema, schemas.INTERMEDIATE[name], schemas.INTERMEDIATE_EXTRA_COLUMNS.get(name))
+        path = self._intermediate_path(name)
+        if name in crime_store.SORTED_STORES:
+            # Crime stores are kept in id order, with the sparse index of their blocks (see crime_store.py)
+            content, index = crime_store.encode(data, crime_store.SORTED_STORES[name], self.storage_format)
+            for file_path, file_content in [(path, content), (crime_store.index_path(path), index)]:
+                if self.io is None:
+                    file_path.write_bytes(file_content)
+                else:
+                    self.io.write(file_path, file_content)
+        else:
+            self._write(data, path, self.storage_format)
+        if self.profiler is not None:
+            self.profiler.record_output(path, data)
+
+    def lookup_crimes(self, ids=None, low=None, high=None, name="chicago_part1_crimes"):
+        # Crimes of a crime store with the given ids, or with ids in [low, high], read from the blocks of the store's
+        # index that can hold them. Stores written without an index are scanned whole.
+        path = self._intermediate_path(name)
+        index = crime_store.index_path(path)
+        if self.io is not None:
+            self.io.wait_written(path)
+            self.io.wait_written(index)
+        key = crime_store.SORTED_STORES[name]
+        if ids is not None:
+            selected = pl.col(key).is_in(list(ids))
+        else:
+            selected = pl.all_horizontal(pl.lit(True), *([] if low is None else [pl.col(key) >= low]),
+                                         *([] if high is None else [pl.col(key) <= high]))
+        if not index.exists():
+            return self._scan_intermediate(name).filter(selected).collect()
+        index = crime_store.read_index(path)
+        blocks = (crime_store.point_blocks(index, ids) if ids is not None else
+                  crime_store.range_blocks(index, low, high))
+        schema = schemas.INTERMEDIATE[name]
+        extra_columns = schemas.INTERMEDIATE_EXTRA_COLUMNS.get(name)
+        data = crime_store.read_blocks(path, index, blocks,
+                                       self._csv_schema(path, schema, extra_columns)
+                                       if self.storage_format == "csv" else None)
+        if data is None:
+            return self._scan_intermediate(name).head(0).collect()
+        schemas.check_schema(path.name, data.schema, schema, extra_columns)
+        if self.profiler is not None:
+            self.profiler.record_input(path, data)
+        return data.filter(selected)
+
+    def write_profile_report(self, report_path=None):
+        if self.profiler is None:
+            raise RuntimeError("Profiling is not enabled. Create the DataPreprocessor with profile=True.")
+        if report_path is None:
+            report_path = self.output_data_path / "profiling" / f"profile_{datetime.now():%Y%m%d_%H%M%S}"
+        self.profiler.write_report(report_path)
+
+    def _polars_crime_data(self):
+        crime_data = (self._read_csv(self._raw_paths("extract_crime")[0], schemas.CRIME)
                       .rename(lambda col: col.lower().replace(" ", "_"))
                       .rename({"date": "string_date"}))
 
         crime_data = (crime_data
-                      .filter(pl.col("year").is_between(2001, 2012, closed="both"))
+                      .filter(pl.col("year").is_between(*self.city.years, closed="both"))
                       .with_columns(
             pl.col("string_date").str.to_datetime(format="%m/%d/%Y %I:%M:%S %p"))
                       .with_columns(
@@ -50,20 +286,30 @@ class DataPreprocessor:
             .alias("fbi_code"))
                       .drop("string_date")
                       )
+        return crime_data
+
+    @stage
+    def _extract_crime_data(self):
+        if self.backend is not None:
+            crime_data = self.backend.crime_data(*self._engine_raw("extract_crime", schemas.CRIME), self.city.years)
+        else:
+            crime_data = self._polars_crime_data()
 
         # Save part1 crime data
-        crime_data.filter(
+        self._write_intermediate(crime_data.filter(
             pl.col("part1") == 1
-        ).write_csv(self.output_data_path/"chicago_part1_crimes.csv")
+        ), "chicago_part1_crimes")
 
         # Save all crimes
-        crime_data.drop(
+        self._write_intermediate(crime_data.drop(
             ["block", "description", "location_description", "beat", "district",
              "ward", "community_area", "x_coordinate", "y_coordinate", "location"]
-        ).write_csv(self.output_data_path/"chicago_all_crimes.csv")
+        ), "chicago_all_crimes")
 
+    @stage
     def _extract_crime_interstate_distance(self):
-        crime_interstate_data = (pl.read_csv(self.input_data_path/"Chicago_Crime_Interstate_Distance_0606.csv")
+        crime_interstate_data = (self._read_csv(self._raw_paths("extract_crime_interstate_distance")[0],
+                                                                schemas.CRIME_INTERSTATE_DISTANCE)
                                  .rename(lambda col: col.lower().replace(" ", "_")))
 
         crime_interstate_data = (crime_interstate_data
@@ -90,18 +336,14 @@ class DataPreprocessor:
             [pl.col(f"near_angle_{i}").radians().alias(f"near_dir_{i}") for i in [1, 2]])
                                  )
 
+        # Segments of the routes (first matching box of the city spec), e.g. I90 into I90_A, I90_B and I90_C
+        route_num_1_mod = pl.col("route_num_1")
+        for segment in reversed(self.city.route_segments):
+            route_num_1_mod = pl.when(self._in_box(segment)).then(pl.lit(segment["name"])).otherwise(route_num_1_mod)
         crime_interstate_wide = (crime_interstate_wide
                                  .with_columns(
-            pl.when(
-                (pl.col("route_num_1") == "I90") & (pl.col("latitude") > 41.84) & (pl.col("longitude") > -87.75))
-            .then(pl.lit("I90_A"))
-            .when(
-                (pl.col("route_num_1") == "I90") & (pl.col("latitude") < 41.84) & (pl.col("latitude") > 41.775))
-            .then(pl.lit("I90_B"))
-            .when(
-                (pl.col("route_num_1") == "I90") & (pl.col("latitude") < 41.775))
-            .then(pl.lit("I90_C"))
-            .otherwise(pl.col("route_num_1"))
+            route_num_1_mod
+            .cast(pl.Categorical)
             .alias("route_num_1_mod"))
                                  )
 
@@ -109,15 +351,9 @@ class DataPreprocessor:
                                  .with_columns(
             pl.lit(1).alias("sample_set"))
                                  .with_columns(
-            # Drop observations on fringe of city limits
-            pl.when(pl.col("longitude") < -87.8)
-            .then(pl.lit(0))
-            .otherwise(pl.col("sample_set"))
-            .alias("sample_set"))
-                                 .with_columns(
-            # Drop observations far out I-290 or I-55
+            # Drop observations in the trimming boxes of the city spec: fringe of city limits, far out routes
             pl.when(
-                (pl.col("route_num_1").is_in(["I290", "I55"])) & (pl.col("longitude") < -87.74))
+                pl.any_horizontal(pl.lit(False), *[self._in_box(box) for box in self.city.trim_boxes]))
             .then(pl.lit(0))
             .otherwise(pl.col("sample_set"))
             .alias("sample_set"))
@@ -132,78 +368,49 @@ class DataPreprocessor:
             pl.when(pl.col("near_dist_2") < 5280)
             .then(pl.lit(0))
             .otherwise(pl.col("sample_set"))
-            .alias("sample_set"))
-                                 .with_columns(
-            # Trim observations to clean treatment/control groups
-            # I-90A
-            pl.when(
-                ((pl.col("latitude") - pl.col("longitude")) > 129.69) | (
-                    ((pl.col("latitude") - pl.col("longitude")) < 129.575) & (pl.col("route_num_1_mod") == "I90_A")))
-            .then(pl.lit(0))
-            .otherwise(pl.col("sample_set"))
-            .alias("sample_set"))
-                                 .with_columns(
-            # I-90B
-            pl.when(
-                (pl.col("latitude") < 41.79) & (pl.col("route_num_1_mod") == "I90_B"))
-            .then(pl.lit(0))
-            .otherwise(pl.col("sample_set"))
-            .alias("sample_set"))
-                                 .with_columns(
-            # I-90C
-            pl.when(
-                ((pl.col("latitude") - pl.col("longitude") > 129.36) & (pl.col("route_num_1_mod") == "I90_C")) | (
-                    (pl.col("latitude") - pl.col("longitude") < 129.26) & (pl.col("route_num_1_mod") == "I90_C")))
-            .then(pl.lit(0))
-            .otherwise(pl.col("sample_set"))
-            .alias("sample_set"))
-                                 .with_columns(
-            # I-55
-            pl.when(
-                (pl.col("longitude") > -87.65) & (pl.col("route_num_1") == "I55"))
-            .then(pl.lit(0))
-            .otherwise(pl.col("sample_set"))
-            .alias("sample_set"))
-                                 .with_columns(
-            # I-94
-            pl.when(
-                ((pl.col("latitude") - pl.col("longitude")) < 129.34) & (pl.col("route_num_1_mod") == "I94"))
-            .then(pl.lit(0))
-            .otherwise(pl.col("sample_set"))
-            .alias("sample_set"))
-                                 .with_columns(
-            pl.when(
-                (pl.col("latitude") > 41.75) & (pl.col("route_num_1_mod") == "I94"))
-            .then(pl.lit(0))
-            .otherwise(pl.col("sample_set"))
             .alias("sample_set"))
                                  )
 
-
-        crime_interstate_wide.write_csv(self.output_data_path/"crime_road_distances.csv")
+        self._write_intermediate(crime_interstate_wide, "crime_road_distances")
+
+    @staticmethod
+    def _in_box(box):
+        # Whether a crime of the interstate distance file is in a box of the city spec (see city.py)
+        bounded = {"latitude": pl.col("latitude"), "longitude": pl.col("longitude"),
+                   "lat_minus_lon": pl.col("latitude") - pl.col("longitude")}
+        conditions = [pl.lit(True)]
+        if "routes" in box:
+            conditions.append(pl.col("route_num_1").cast(pl.String).is_in(box["routes"]))
+        if "segments" in box:
+            conditions.append(pl.col("route_num_1_mod").cast(pl.String).is_in(box["segments"]))
+        for name, value in bounded.items():
+            lower, upper = box.get(name, (None, None))
+            if lower is not None:
+                conditions.append(value > lower)
+            if upper is not None:
+                conditions.append(value < upper)
+        return pl.all_horizontal(conditions)
 
     def process_all_crime_data(self):
         self._extract_crime_data()
         self._extract_crime_interstate_distance()
 
+    @stage
     def _extract_chicago_aqi(self):
-        aqi_data = pd.read_stata(self.input_data_path/"chicago_aqi_2000_2015.dta")
-        aqi_data = pl.from_pandas(aqi_data)
-        aqi_data.write_csv(self.output_data_path/"chicago_aqi_2000_2015.csv")
+        # Cities without an AQI file compute the AQI in _merge_pollution
+        if not self.city.raw_inputs["extract_aqi"]:
+            return
+        aqi_data = (self._read_stata(self._raw_paths("extract_aqi")[0], schemas.AQI)
+                    .with_columns(
+            pl.col("datelocal").str.to_date(format="%Y-%m-%d")))
+        self._write_intermediate(aqi_data, "chicago_aqi_2000_2015")
 
-    def _extract_chicago_co(self):
-        temp_1 = pl.read_csv(self.input_data_path/"co_chicago_20000101_20041231.txt",
-                             separator=",", null_values=["END OF FILE"])
-        temp_2 = pl.read_csv(self.input_data_path/"co_chicago_20050101_20091231.txt",
-                             separator=",", null_values=["END OF FILE"])
-        temp_3 = pl.read_csv(self.input_data_path/"co_chicago_20100101_20121231.txt",
-                             separator=",", null_values=["END OF FILE"])
-
-        co_data = (pl.concat([temp_1, temp_2, temp_3])
+    def _polars_daily_co(self):
+        co_data = (pl.concat([self._read_csv(path, schemas.AQS, separator=",", null_values=["END OF FILE"])
+                             for path in self._raw_paths("extract_co")])
                    .rename(lambda col: col.lower().replace(" ", "_"))
                    .with_columns(
-            (pl.col("county_code").cast(pl.String) + "_" + pl.col("site_num").cast(pl.String)
-             + "_" + pl.col("poc").cast(pl.String)).alias("monitor_id")
+            schemas.monitor_id_expr("county_code", "site_num", "poc").alias("monitor_id")
         )
                    )
 
@@ -227,32 +434,39 @@ class DataPreprocessor:
             .over(["monitor_id", "date_local", "sample_duration"])
             .alias("avg_co"))
                          .with_columns(
-            pl.col("date_local").str.to_datetime(format="%Y-%m-%d"))
-                         .with_columns(
-            pl.col("date_local").dt.date().alias("date"))
+            pl.col("date_local").alias("date"),
+            pl.col("date_local").cast(pl.Datetime))
                          .sort("monitor_id", "date")
                          .unique(["monitor_id", "date"])
                          .filter(
             pl.col("num_hrly_obs_co") >= 18)  # original code uses num_hrly_obs, but they are equivalent
                          .sort("monitor_id", "date")
                          .drop(cs.contains("gmt"))
+                         .join(
+            # Daily maximum 8-hour average, the CO statistic of the AQI
+            self._collect(aqi.aqs_max_8hr(co_data)).rename({"mean_8hr": "max8hr_co"}),
+            on=["monitor_id", "date"], how="left", validate="1:1")
                          )
 
-        daily_co_data.write_csv(self.output_data_path/"chicago_co_2000_2012_daily.csv")
+        return daily_co_data
 
+    @stage
+    def _extract_chicago_co(self):
+        if self.backend is not None:
+            daily_co_data = self.backend.aqs_daily(
+                *self._engine_raw("extract_co", schemas.AQS, null_values=["END OF FILE"]), "co",
+                "chicago_co_2000_2012_daily")
+        else:
+            daily_co_data = self._polars_daily_co()
+        self._write_intermediate(daily_co_data, "chicago_co_2000_2012_daily")
+
+    @stage
     def _extract_chicago_pm10(self):
-        temp_1 = pl.read_csv(self.input_data_path/"pm10_chicago_20000101_20041231.txt",
-                             separator=",", null_values=["END OF FILE"], infer_schema_length=10000)
-        temp_2 = pl.read_csv(self.input_data_path/"pm10_chicago_20050101_20091231.txt",
-                             separator=",", null_values=["END OF FILE"], infer_schema_length=10000)
-        temp_3 = pl.read_csv(self.input_data_path/"pm10_chicago_20100101_20121231.txt",
-                             separator=",", null_values=["END OF FILE"], infer_schema_length=10000)
-
-        pm_data = (pl.concat([temp_1, temp_2, temp_3])
+        pm_data = (pl.concat([self._read_csv(path, schemas.AQS, separator=",", null_values=["END OF FILE"])
+                             for path in self._raw_paths("extract_pm10")])
         .rename(lambda col: col.lower().replace(" ", "_"))
         .with_columns(
-            (pl.col("county_code").cast(pl.String) + "_" + pl.col("site_num").cast(pl.String)
-             + "_" + pl.col("poc").cast(pl.String)).alias("monitor_id")
+            schemas.monitor_id_expr("county_code", "site_num", "poc").alias("monitor_id")
         )
         )
 
@@ -261,11 +475,12 @@ class DataPreprocessor:
                          .filter(
             ~pl.all_horizontal(pl.all().is_null()))
                          .with_columns(
-            pl.col("sample_frequency").str.strip_chars())
+            pl.col("sample_frequency").cast(pl.String).str.strip_chars())
                          .with_columns(
             pl.when(pl.col("sample_frequency") == "")
             .then(None)
             .otherwise(pl.col("sample_frequency"))
+            .cast(pl.Categorical)
             .alias("sample_frequency"))
                          .with_columns(
             pl.col("sample_measurement")
@@ -315,9 +530,8 @@ class DataPreprocessor:
 
         daily_pm_data = (daily_pm_data
                          .with_columns(
-            pl.col("date_local").str.to_datetime(format="%Y-%m-%d"))
-                         .with_columns(
-            pl.col("date_local").dt.date().alias("date"))
+            pl.col("date_local").alias("date"),
+            pl.col("date_local").cast(pl.Datetime))
                          .drop(cs.contains("gmt"))
                          .rename({"sample_measurement": "daily_pm10_notderived"})
                          .with_columns(
@@ -327,31 +541,14 @@ class DataPreprocessor:
             .alias("max24hr_pm10_derived"))
         )
 
-        daily_pm_data.write_csv(self.output_data_path/"chicago_pm10_2000_2012_daily.csv")
+        self._write_intermediate(daily_pm_data, "chicago_pm10_2000_2012_daily")
 
-    def _extract_chicago_no2(self):
-        temp_1 = pl.read_csv(self.input_data_path/"no2_chicago_20000101_20041231.txt",
-                             separator=",", null_values=["END OF FILE"],
-                             schema_overrides={col: pl.String for col in ["Sample Measurement", "Horizontal Accuracy"]},
-                             infer_schema_length=10000)
-        temp_2 = pl.read_csv(self.input_data_path/"no2_chicago_20050101_20091231.txt",
-                             separator=",", null_values=["END OF FILE"],
-                             schema_overrides={col: pl.String for col in ["Sample Measurement", "Horizontal Accuracy"]},
-                             infer_schema_length=10000)
-        temp_3 = pl.read_csv(self.input_data_path/"no2_chicago_20100101_20121231.txt",
-                             separator=",", null_values=["END OF FILE"],
-                             schema_overrides={col: pl.String for col in ["Sample Measurement", "Horizontal Accuracy"]},
-                             infer_schema_length=10000)
-
-        no_data = (pl.concat([temp_1, temp_2, temp_3])
+    def _polars_daily_no2(self):
+        no_data = (pl.concat([self._read_csv(path, schemas.AQS, separator=",", null_values=["END OF FILE"])
+                             for path in self._raw_paths("extract_no2")])
         .rename(lambda col: col.lower().replace(" ", "_"))
         .with_columns(
-            (pl.col("county_code").cast(pl.String) + "_" + pl.col("site_num").cast(pl.String)
-             + "_" + pl.col("poc").cast(pl.String)).alias("monitor_id"),)
-        .with_columns(
-            pl.col("sample_measurement").cast(pl.Float64),
-            pl.col("horizontal_accuracy").cast(pl.Float64)
-        )
+            schemas.monitor_id_expr("county_code", "site_num", "poc").alias("monitor_id"),)
         )
 
         # Save daily data
@@ -385,9 +582,8 @@ class DataPreprocessor:
             (pl.col("max_no2") / 1000).alias("max_no2"),
             (pl.col("avg_no2") / 1000).alias("avg_no2"),)
                          .with_columns(
-            pl.col("date_local").str.to_datetime(format="%Y-%m-%d"))
-                         .with_columns(
-            pl.col("date_local").dt.date().alias("date"))
+            pl.col("date_local").alias("date"),
+            pl.col("date_local").cast(pl.Datetime))
                          .sort("monitor_id", "date")
                          .unique(["monitor_id", "date"])
                          .filter(
@@ -396,30 +592,24 @@ class DataPreprocessor:
                          .drop(cs.contains("gmt"), pl.col("num_hrly_obs"))
                          )
 
-        daily_no_data.write_csv(self.output_data_path / "chicago_no2_2000_2012_daily.csv")
+        return daily_no_data
 
-    def _extract_chicago_ozone(self):
-        temp_1 = pl.read_csv(self.input_data_path/"ozone_chicago_20000101_20050101.txt",
-                             separator=",", null_values=["END OF FILE"],
-                             schema_overrides={col: pl.String for col in ["Horizontal Accuracy"]},
-                             infer_schema_length=10000)
-        temp_2 = pl.read_csv(self.input_data_path/"ozone_chicago_20050102_20091231.txt",
-                             separator=",", null_values=["END OF FILE"],
-                             schema_overrides={col: pl.String for col in ["Horizontal Accuracy"]},
-                             infer_schema_length=10000)
-        temp_3 = pl.read_csv(self.input_data_path/"ozone_chicago_20100101_20121231.txt",
-                             separator=",", null_values=["END OF FILE"],
-                             schema_overrides={col: pl.String for col in ["Horizontal Accuracy"]},
-                             infer_schema_length=10000)
-
-        ozone_data = (pl.concat([temp_1, temp_2, temp_3])
+    @stage
+    def _extract_chicago_no2(self):
+        if self.backend is not None:
+            daily_no_data = self.backend.aqs_daily(
+                *self._engine_raw("extract_no2", schemas.AQS, null_values=["END OF FILE"]), "no2",
+                "chicago_no2_2000_2012_daily")
+        else:
+            daily_no_data = self._polars_daily_no2()
+        self._write_intermediate(daily_no_data, "chicago_no2_2000_2012_daily")
+
+    def _polars_daily_ozone(self):
+        ozone_data = (pl.concat([self._read_csv(path, schemas.AQS, separator=",", null_values=["END OF FILE"])
+                             for path in self._raw_paths("extract_ozone")])
         .rename(lambda col: col.lower().replace(" ", "_"))
         .with_columns(
-            (pl.col("county_code").cast(pl.String) + "_" + pl.col("site_num").cast(pl.String)
-             + "_" + pl.col("poc").cast(pl.String)).alias("monitor_id"),)
-        .with_columns(
-            pl.col("horizontal_accuracy").cast(pl.Float64)
-        )
+            schemas.monitor_id_expr("county_code", "site_num", "poc").alias("monitor_id"),)
         )
 
         # Save daily data
@@ -450,55 +640,96 @@ class DataPreprocessor:
             .over(["monitor_id", "date_local", "sample_duration"])
             .alias("avg_ozone"))
                             .with_columns(
-            pl.col("date_local").str.to_datetime(format="%Y-%m-%d"))
-                            .with_columns(
-            pl.col("date_local").dt.date().alias("date"))
+            pl.col("date_local").alias("date"),
+            pl.col("date_local").cast(pl.Datetime))
                             .sort("monitor_id", "date")
                             .unique(["monitor_id", "date"])
                             .filter(
             pl.col("num_hrly_obs") >= 18)  # original code uses num_hrly_obs, but they are equivalent
                             .sort("monitor_id", "date")
                             .drop(cs.contains("gmt"), pl.col("num_hrly_obs"))
+                            .join(
+            # Daily maximum 8-hour average, the ozone statistic of the AQI
+            self._collect(aqi.aqs_max_8hr(ozone_data)).rename({"mean_8hr": "max8hr_ozone"}),
+            on=["monitor_id", "date"], how="left", validate="1:1")
                             )
 
-        daily_ozone_data.write_csv(self.output_data_path/"chicago_ozone_2000_2012_daily.csv")
+        return daily_ozone_data
 
-    def _merge_pollution(self):
-        # AQI ---------------------------------------------------------------------------------------------------------
-        aqi_data = (pl.read_csv(self.output_data_path/"chicago_aqi_2000_2015.csv")
+    @stage
+    def _extract_chicago_ozone(self):
+        if self.backend is not None:
+            daily_ozone_data = self.backend.aqs_daily(
+                *self._engine_raw("extract_ozone", schemas.AQS, null_values=["END OF FILE"]), "ozone",
+                "chicago_ozone_2000_2012_daily")
+        else:
+            daily_ozone_data = self._polars_daily_ozone()
+        self._write_intermediate(daily_ozone_data, "chicago_ozone_2000_2012_daily")
+
+    def _read_file_aqi(self):
+        # Daily AQI of every monitor from the AQI file
+        aqi_data = (self._read_intermediate("chicago_aqi_2000_2015")
                     .with_columns(
-            pl.col("aqi").cast(pl.Float64))
-                    )
-        aqi_data  = (aqi_data
-                     .with_columns(
-            pl.col("datelocal").str.to_datetime(format="%Y-%m-%d"))
-                     .with_columns(
-            pl.col("datelocal").dt.date().alias("date"))
-                     .filter(
-            pl.col("date").dt.year().is_between(2000, 2012, closed="both"))
-                     .with_columns(
-            (pl.col("countycode").cast(pl.String) + "_" + pl.col("sitenum").cast(pl.String)
-             + "_" + pl.col("poc").cast(pl.String)).alias("monitor_id"))
-                     .filter(
+            pl.col("datelocal").alias("date"))
+                    .filter(
+            pl.col("date").dt.year().is_between(*self.city.pollution_years, closed="both"))
+                    .with_columns(
+            schemas.monitor_id_expr("countycode", "sitenum", "poc").alias("monitor_id"))
+                    .filter(
             pl.col("aqi").is_not_null())
-                     .with_columns(
-            pl.when(pl.col("parametername").str.contains("PM10"))
+                    )
+        # Match the parameter names once per distinct name instead of once per row
+        pollutant_names = (aqi_data
+                           .select(
+            pl.col("parametername").unique())
+                           .with_columns(
+            pl.col("parametername").cast(pl.String).alias("name"))
+                           .with_columns(
+            pl.when(pl.col("name").str.contains("PM10"))
             .then(pl.lit("PM10"))
-            .when(pl.col("parametername").str.contains("Carbon monoxide"))
+            .when(pl.col("name").str.contains("Carbon monoxide"))
             .then(pl.lit("CO"))
-            .when(pl.col("parametername").str.contains("Ozone"))
+            .when(pl.col("name").str.contains("Ozone"))
             .then(pl.lit("Ozone"))
-            .when(pl.col("parametername").str.contains("Nitrogen dioxide"))
+            .when(pl.col("name").str.contains("Nitrogen dioxide"))
             .then(pl.lit("NO2"))
             .otherwise(None)
+            .cast(schemas.POLLUTANT)
             .alias("pollutant_name"))
-                      .filter(
+                           .drop("name")
+                           )
+        aqi_data = (aqi_data
+                    .join(
+            pollutant_names, on="parametername", how="left", validate="m:1")
+                    .filter(
             pl.col("pollutant_name").is_not_null())
-                     )
+                    )
+        return aqi_data
+
+    @stage
+    def _merge_pollution(self):
+        co_daily = self._read_intermediate("chicago_co_2000_2012_daily")
+        no2_daily = self._read_intermediate("chicago_no2_2000_2012_daily")
+        ozone_daily = self._read_intermediate("chicago_ozone_2000_2012_daily")
+        pm_daily = self._read_intermediate("chicago_pm10_2000_2012_daily")
+
+        # AQI ---------------------------------------------------------------------------------------------------------
+        if self.city.aqi_source == "computed":
+            # EPA AQI of every monitor from the daily concentrations (see aqi.py). All of them make the citywide AQI.
+            aqi_data = (self._collect(aqi.monitor_aqi(co_daily, no2_daily, ozone_daily, pm_daily))
+                        .filter(
+                pl.col("date").dt.year().is_between(*self.city.pollution_years, closed="both"))
+                        .filter(
+                pl.col("aqi").is_not_null())
+                        .with_columns(
+                pl.lit(self.city.aqi_city).alias("cityname"))
+                        )
+        else:
+            aqi_data = self._read_file_aqi()
 
         temp_aqi = (aqi_data
                     .filter(
-            pl.col("cityname").is_in(["Chicago"]))
+            pl.col("cityname").is_in([self.city.aqi_city]))
                     .group_by("date", "pollutant_name")
                     .agg(
             pl.col("aqi").mean().alias("aqi_mean_chicago"))
@@ -507,25 +738,10 @@ class DataPreprocessor:
                     )
 
         aqi_data_by_date_pollutant = (aqi_data
-                                      .with_columns(
-            pl.when(
-                (pl.col("pollutant_name") == "Ozone") & (pl.col("monitor_id").is_in(["31_64_1", "31_7002_1"])))
-            .then(pl.lit(1))
-            .when(
-                (pl.col("pollutant_name") == "CO") & (
-                    pl.col("monitor_id").is_in(["31_3103_1", "31_4002_1", "31_6004_1", "31_63_1"])))
-            .then(pl.lit(1))
-            .when(
-                (pl.col("pollutant_name") == "NO2") & (
-                    pl.col("monitor_id").is_in(["31_3103_1", "31_4002_1", "31_63_1"])))
-            .then(pl.lit(1))
-            .when(
-                (pl.col("pollutant_name") == "PM10") & (
-                    pl.col("monitor_id").is_in(["31_1016_3", "31_22_3"])))
-            .then(pl.lit(1))
-            .otherwise(0)
-            .alias("keeplist"))
-                                      .filter(pl.col("keeplist") == 1)
+                                      .filter(
+            pl.any_horizontal(
+                [(pl.col("pollutant_name") == pollutant) & pl.col("monitor_id").is_in(schemas.monitor_ids(*monitors))
+                 for pollutant, monitors in self.city.monitors.items()]))
                                       .group_by("date", "pollutant_name")
                                       .agg(
             pl.col("aqi").mean().alias("aqi_mean_sample"))
@@ -539,20 +755,14 @@ class DataPreprocessor:
                    .group_by("date")
                    .agg(
             pl.col("aqi_mean_sample").max().alias("max_aqi_sample"),
-            pl.col("pollutant_name").filter(
-                pl.col("aqi_mean_sample") == pl.col("aqi_mean_sample").max()
-            ).first().alias("max_aqi_sample_poll"),
+            aqi.dominant("aqi_mean_sample").alias("max_aqi_sample_poll"),
             pl.col("aqi_mean_chicago").max().alias("max_aqi_chicago"),
-            pl.col("pollutant_name").filter(
-                pl.col("aqi_mean_chicago") == pl.col("aqi_mean_chicago").max()
-            ).first().alias("max_aqi_chicago_poll"))
+            aqi.dominant("aqi_mean_chicago").alias("max_aqi_chicago_poll"))
                    .sort("date")
                    )
 
         # OZONE ---------------------------------------------------------------------------------------------------------
-        ozone_data = (pl.read_csv(self.output_data_path / "chicago_ozone_2000_2012_daily.csv")
-                      .with_columns(
-            pl.col("date").str.to_datetime(format="%Y-%m-%d").dt.date())
+        ozone_data = (ozone_daily
                       .with_columns(
             pl.col("date").dt.year().alias("year")
         )
@@ -560,32 +770,29 @@ class DataPreprocessor:
 
         ozone_data = (ozone_data
                       .filter(
-            pl.col("monitor_id").is_in(["31_1003_2", "31_1601_1", "31_1_1", "31_32_1", "31_4002_1",
-                                        "31_4007_1", "31_4201_1", "31_64_1", "31_7002_1", "31_72_1", "31_76_1"]))
+            pl.col("monitor_id").is_in(schemas.monitor_ids(*self.city.panel_monitors("Ozone"))))
                       .select("avg_ozone", "max_ozone", "monitor_id", "date")
                       .sort("monitor_id", "date")
                       )
 
+        ozone_sample = schemas.monitor_ids(*self.city.monitors["Ozone"])
         ozone_out = (ozone_data
                      .pivot(
             on="monitor_id", values=cs.contains("ozone"))
                      .with_columns(
-            pl.mean_horizontal(pl.col("^avg.*31_(64_1|7002_1)$")).alias("avg_ozone_mean"),
-            pl.mean_horizontal(pl.col("^max.*31_(64_1|7002_1)$")).alias("max_ozone_mean"))
+            pl.mean_horizontal([f"avg_ozone_{key}" for key in ozone_sample]).alias("avg_ozone_mean"),
+            pl.mean_horizontal([f"max_ozone_{key}" for key in ozone_sample]).alias("max_ozone_mean"))
                      .with_columns(
-            ((pl.col("avg_ozone_31_64_1").is_not_null().cast(pl.Int64) +
-              pl.col("avg_ozone_31_7002_1").is_not_null().cast(pl.Int64)) / 2
-             ).alias("monitor_pct_ozone"))
+            (pl.sum_horizontal([pl.col(f"avg_ozone_{key}").is_not_null().cast(pl.Int64) for key in ozone_sample])
+             / len(ozone_sample)).alias("monitor_pct_ozone"))
                      .sort("date")
                      .select("avg_ozone_mean", "max_ozone_mean", "date", "monitor_pct_ozone")
                      )
 
         # CO ---------------------------------------------------------------------------------------------------------
-        co_data = (pl.read_csv(self.output_data_path / "chicago_co_2000_2012_daily.csv")
-                   .with_columns(
-            pl.col("date").str.to_datetime(format="%Y-%m-%d").dt.date())
+        co_data = (co_daily
                    .filter(
-            pl.col("monitor_id").is_in(["31_3103_1","31_4002_1","31_6004_1","31_63_1"]))
+            pl.col("monitor_id").is_in(schemas.monitor_ids(*self.city.panel_monitors("CO"))))
                    )
 
         co_wide = (co_data
@@ -601,7 +808,7 @@ class DataPreprocessor:
                    .with_columns(
             pl.mean_horizontal(pl.col("^avg.*$")).alias("avg_co_mean"),
             pl.mean_horizontal(pl.col("^max.*$")).alias("max_co_mean"))
-                   .drop("avg_co_31_6004_1")
+                   .drop([f"avg_co_{key}" for key in schemas.monitor_ids(*self.city.co_drop_monitors)])
                    )
 
         avg_cols_drop_290 = co_temp.select(pl.col("^avg.*$").exclude("avg_co_mean")).columns
@@ -617,11 +824,9 @@ class DataPreprocessor:
                   )
 
         # NO2 --------------------------------------------------------------------------------------------------------
-        no_data = (pl.read_csv(self.output_data_path / "chicago_no2_2000_2012_daily.csv")
-                   .with_columns(
-            pl.col("date").str.to_datetime(format="%Y-%m-%d").dt.date())
+        no_data = (no2_daily
                    .filter(
-            pl.col("monitor_id").is_in(["31_3103_1","31_4002_1","31_63_1"]))
+            pl.col("monitor_id").is_in(schemas.monitor_ids(*self.city.panel_monitors("NO2"))))
                    )
 
         no_wide = (no_data
@@ -643,11 +848,9 @@ class DataPreprocessor:
                    )
 
         # PM10 --------------------------------------------------------------------------------------------------------
-        pm_data = (pl.read_csv(self.output_data_path / "chicago_pm10_2000_2012_daily.csv")
-                   .with_columns(
-            pl.col("date").str.to_datetime(format="%Y-%m-%d").dt.date())
+        pm_data = (pm_daily
                    .filter(
-            pl.col("monitor_id").is_in(["31_1016_3","31_22_3"]))
+            pl.col("monitor_id").is_in(schemas.monitor_ids(*self.city.panel_monitors("PM10"))))
                    )
 
         pm_wide = (pm_data
@@ -683,7 +886,35 @@ class DataPreprocessor:
             aqi_out, on=["date"], how="left", validate="1:1")
                      )
 
-        poll_data.write_csv(self.output_data_path / "chicago_pollution_2000_2012.csv")
+        self._write_intermediate(poll_data, "chicago_pollution_2000_2012")
+
+    @stage
+    def _extract_hourly_pollution(self):
+        # Hourly panel of the 1-hour AQS samples of every monitor, for the hourly crime linkage. Several parameters of
+        # a pollutant at the same monitor and hour are averaged.
+        stages = {"CO": "extract_co", "NO2": "extract_no2", "Ozone": "extract_ozone", "PM10": "extract_pm10"}
+        hourly_data = self._collect(pl.concat([
+            self._scan_csv(path, schemas.AQS, separator=",", null_values=["END OF FILE"])
+            .filter(
+                (pl.col("Sample Duration") == "1 HOUR") & pl.col("Sample Measurement").is_not_null())
+            .select(
+                pl.lit(pollutant, dtype=schemas.POLLUTANT).alias("pollutant"),
+                schemas.monitor_id_expr("County Code", "Site Num", "POC").alias("monitor_id"),
+                pl.col("Latitude").alias("latitude"),
+                pl.col("Longitude").alias("longitude"),
+                (pl.col("Date Local").cast(pl.Datetime("us"))
+                 + pl.duration(hours=pl.col("24 Hour Local").str.slice(0, 2).cast(pl.Int64))).alias("datetime"),
+                pl.col("Sample Measurement").alias("value"))
+            for pollutant, stage_name in stages.items() for path in self._raw_paths(stage_name)])
+                                   .group_by("pollutant", "monitor_id", "datetime")
+                                   .agg(
+            pl.col("latitude").first(),
+            pl.col("longitude").first(),
+            pl.col("value").mean())
+                                   .select(list(schemas.INTERMEDIATE["chicago_pollution_hourly"]))
+                                   .sort("pollutant", "monitor_id", "datetime"))
+
+        self._write_intermediate(hourly_data, "chicago_pollution_hourly")
 
     def process_all_pollution_data(self):
         self._extract_chicago_aqi()
@@ -693,12 +924,13 @@ class DataPreprocessor:
         self._extract_chicago_ozone()
         self._merge_pollution()
 
+    @stage
     def _extract_midwayohare_daily_weather(self):
-        ghcn_data = pl.read_csv(self.input_data_path / "chicago_midwayohare_ghcn_daily_1991_2012.csv")
+        ghcn_data = self._read_csv(self._raw_paths("extract_ghcn_weather")[0], schemas.GHCN_DAILY)
 
         ghcn_data = (ghcn_data
                      .with_columns(
-            pl.col("strdate").cast(pl.String).str.to_datetime(format="%Y%m%d").dt.date().alias("date"))
+            pl.date(pl.col("strdate") // 10000, pl.col("strdate") // 100 % 100, pl.col("strdate") % 100).alias("date"))
                      .with_columns(
             pl.when(pl.col("qflag").is_not_null())  # != "" (empty string) in the original dataset
             .then(None)
@@ -716,11 +948,8 @@ class DataPreprocessor:
                      .with_columns(
             cs.numeric().exclude("station_id", "strdate").round(1))
                      .with_columns(
-            pl.when(pl.col("station_id") == "USW00094846")
-            .then(pl.lit("OHARE"))
-            .when(pl.col("station_id") == "USW00014819")
-            .then(pl.lit("MIDWAY"))
-            .otherwise(pl.lit(""))
+            pl.col("station_id").replace_strict({station_id: label for label, station_id in self.city.ghcn_stations.items()},
+                                                default="", return_dtype=pl.String)
             .alias("weather_airport"))
                      .drop("station_id")
                      )
@@ -736,7 +965,8 @@ class DataPreprocessor:
 
         ghcn_doy_mean = (ghcn_temp
                          .filter(
-            pl.col("date").dt.year() < 2001)
+            # Normals of the years before the crimes (named after 1991-2000 of the replication package)
+            pl.col("date").dt.year() < self.city.years[0])
                          .group_by("month", "day")
                          .agg(
             [pl.col(f"{col}_MIDWAY").mean().alias(f"mean_{col}_1991_2000") for col in ["TMAX", "TMIN", "PRCP"]])
@@ -746,26 +976,23 @@ class DataPreprocessor:
                     .join(
             ghcn_doy_mean, on=["month", "day"], how="left", validate="m:1")
                     .drop("day", "month",)
-                    .filter(pl.col("date").dt.year() >= 2001))
+                    .filter(pl.col("date").dt.year() >= self.city.years[0]))
 
-        ghcn_out.write_csv(self.output_data_path / "chicago_midwayohare_daily_weather.csv")
+        self._write_intermediate(ghcn_out, "chicago_midwayohare_daily_weather")
 
+    @stage
     def _extract_chicago_hourly_weather(self):
-        hourly_weather_data = pd.read_stata(self.input_data_path/"chicago_hourly_weather_stations.dta")
-        hourly_weather_data = pl.from_pandas(hourly_weather_data)
-        hourly_weather_data.write_csv(self.output_data_path/"chicago_hourly_weather_stations.csv")
+        hourly_weather_data = self._read_stata(self._raw_paths("extract_hourly_weather")[0], schemas.HOURLY_WEATHER)
+        self._write_intermediate(hourly_weather_data, "chicago_hourly_weather_stations")
 
-    def _generate_weather_variables(self):
-        weather_data = (pl.scan_csv(self.output_data_path / "chicago_hourly_weather_stations.csv",
-                                    schema_overrides={col: pl.String for col in ["wind_speed_qual", "wind_angle_qual"]})
+    def _polars_weather_variables(self):
+        weather_data = self._collect(self._scan_intermediate("chicago_hourly_weather_stations")
                         .select("usaf", "wban", "month", "day", "year",  "hour", "min", "latitude", "longitude",
                                 "wind_angle", "wind_angle_qual", "wind_obs_type", "wind_speed", "wind_speed_qual",
                                 "temp", "temp_qual", "dewpoint", "dewpoint_qual", "sealevel_pressure",
                                 "sealevel_pressure_qual", "stationname")
                         .with_columns(
-            (pl.col("year").cast(pl.String) + "-" + pl.col("month").cast(pl.String)
-             + "-" + pl.col("day").cast(pl.String)).str.to_date(format="%Y-%m-%d").alias("date"))
-                        .collect())
+            pl.date("year", "month", "day").alias("date")))
 
         # Wind --------------------------------------------------------------------------------------------------------
         weather_data = (weather_data
@@ -889,7 +1116,7 @@ class DataPreprocessor:
         # Sea-level pressure ------------------------------------------------------------------------------------------
         weather_data = (weather_data
                         .with_columns(
-            pl.when(pl.col("sealevel_pressure_qual").cast(pl.String).is_in(["6", "7", "3", "2"]) |
+            pl.when(pl.col("sealevel_pressure_qual").is_in(["6", "7", "3", "2"]) |
                     (pl.col("sealevel_pressure") == 99999))
             .then(None)
             .otherwise(pl.col("sealevel_pressure"))
@@ -922,15 +1149,25 @@ class DataPreprocessor:
         # weather_daily_data.filter(pl.all_horizontal(pl.col("usaf", "date").is_duplicated())
         #                           ).sort("usaf", "date")
 
-        weather_daily_data.write_csv(self.output_data_path / "chicago_weather_daily_from_hourly.csv")
+        return weather_daily_data
 
+    @stage
+    def _generate_weather_variables(self):
+        if self.backend is not None:
+            weather_daily_data = self.backend.weather_daily(*self._engine_source("chicago_hourly_weather_stations"))
+        else:
+            weather_daily_data = self._polars_weather_variables()
+        self._write_intermediate(weather_daily_data, "chicago_weather_daily_from_hourly")
+
+    @stage
     def _read_midway_skycover(self):
-        sky_data = (pl.read_csv(self.input_data_path / "sky_cover_MDW.txt",
+        sky_data = (self._read_csv(self._raw_paths("read_sky_cover")[0],
+                                schemas.SKY_COVER,
                                 separator="\t",
-                                skip_rows=17)
+                                skip_rows=17,
+                                null_values=["M"])
                     .rename({"mm/dd/yyyy": "date",
-                             "Sky Cov": "value"})
-                    .with_columns(pl.col("value").cast(pl.Float64, strict=False)))
+                             "Sky Cov": "value"}))
 
         sky_data = (sky_data
                     .with_columns(
@@ -947,7 +1184,7 @@ class DataPreprocessor:
                           .sort("date")
                           )
 
-        sky_daily_data.write_csv(self.output_data_path / "midway_daily_sky_cover.csv")
+        self._write_intermediate(sky_daily_data, "midway_daily_sky_cover")
 
     def process_all_weather_data(self):
         self._extract_midwayohare_daily_weather()
@@ -955,36 +1192,30 @@ class DataPreprocessor:
         self._generate_weather_variables()
         self._read_midway_skycover()
 
-    def create_citylevel_dataset(self, process_raw_data=True):
+    @stage
+    def create_citylevel_dataset(self, process_raw_data=True, feature_spec=None):
         if process_raw_data:
             self.process_all_crime_data()
             self.process_all_pollution_data()
             self.process_all_weather_data()
 
-        weather_daily_data = (pl.scan_csv(self.output_data_path / "chicago_weather_daily_from_hourly.csv")
-                              .with_columns(
-            pl.col("date").str.to_date(),
-            pl.col("sealevel_pressure_avg").cast(pl.Float64))
+        weather_daily_data = self._collect(self._scan_intermediate("chicago_weather_daily_from_hourly")
                               .filter(
             # Keep only midway wind data
-            pl.col("usaf") == 725340)
+            pl.col("usaf") == self.city.weather_usaf)
                               .join(
-            (pl.scan_csv(self.output_data_path / "midway_daily_sky_cover.csv")
-             .select("date", "avg_sky_cover")
-             .with_columns(pl.col("date").str.to_date())),
+            (self._scan_intermediate("midway_daily_sky_cover")
+             .select("date", "avg_sky_cover")),
             on="date", how="inner", validate="1:1",)
                               .join(
-            (pl.scan_csv(self.output_data_path / "chicago_midwayohare_daily_weather.csv")
-             .select("date", cs.contains("MIDWAY"), cs.contains("mean"))
-             .with_columns(pl.col("date").str.to_date())),
+            (self._scan_intermediate("chicago_midwayohare_daily_weather")
+             .select("date", cs.contains("MIDWAY"), cs.contains("mean"))),
             on="date", how="inner", validate="1:m")
                               .filter(
-            pl.col("date").dt.year().is_between(2001, 2012, closed="both"))
-                              .collect()
+            pl.col("date").dt.year().is_between(*self.city.years, closed="both"))
                               )
 
-        crime_data = (pl.read_csv(self.output_data_path / "chicago_part1_crimes.csv")
-                      .with_columns(pl.col("date").str.to_date())
+        crime_data = (self._read_intermediate("chicago_part1_crimes")
                       .group_by("date", "fbi_code")
                       .agg(pl.len().alias("crimesNarrow"))
                       .select("date", "fbi_code", "crimesNarrow")
@@ -1019,13 +1250,12 @@ class DataPreprocessor:
                     .join(
             weather_daily_data, on=["date"], how="inner", validate="1:1")
                     .filter(
-            pl.col("date").dt.year().is_between(2001, 2012, closed="both"))
+            pl.col("date").dt.year().is_between(*self.city.years, closed="both"))
                     .join(
-            (pl.read_csv(self.output_data_path / "chicago_pollution_2000_2012.csv")
-                    .with_columns(pl.col("date").str.to_date())),
+            self._read_intermediate("chicago_pollution_2000_2012"),
             on="date", how="inner", validate="1:1",)
                    .filter(
-            pl.col("date").dt.year().is_between(2001, 2012, closed="both"))
+            pl.col("date").dt.year().is_between(*self.city.years, closed="both"))
                    .with_columns(
             (pl.col("tmax") / 10 - pl.col("TMAX_MIDWAY")).abs().alias("diff"))
                    )
@@ -1048,7 +1278,8 @@ class DataPreprocessor:
                 ).to_pandas()
         city_data["precip_bins"] = pd.cut(city_data["PRCP_MIDWAY"], [0, 1, 5, 10, 20, 150],
                                           labels=["1", "2", "3", "4", "5",], right=False, include_lowest=True)
-        city_data = pl.from_pandas(city_data).with_columns(pl.col("precip_bins").cast(pl.Int64))
+        # Cast the labels, not the categorical's physical codes, which depend on the categories polars has seen before
+        city_data = pl.from_pandas(city_data).with_columns(pl.col("precip_bins").cast(pl.String).cast(pl.Int64))
 
         city_data = (city_data
                      .with_columns(
@@ -1094,9 +1325,8 @@ class DataPreprocessor:
             pl.col("total_property").log().alias("ln_property"),)
                    )
 
-        all_crime_data = (pl.read_csv(self.output_data_path / "chicago_all_crimes.csv")
+        all_crime_data = (self._read_intermediate("chicago_all_crimes")
                           .with_columns(
-            pl.col("date").str.to_date(),
             ((pl.col("violent") == 1) & (pl.col("part1") == 1)).cast(pl.Int64).alias("violent_p1"),
             ((pl.col("violent") == 0) & (pl.col("part1") == 1)).cast(pl.Int64).alias("nonviolent_p1"),
             ((pl.col("violent") == 1) & (pl.col("part1") == 0)).cast(pl.Int64).alias("violent_np1"),
@@ -1121,22 +1351,166 @@ class DataPreprocessor:
             pl.col("all_nonviolent").log().alias("ln_all_nonviolent"),)
                 .sort("date")
                 )
+        if feature_spec is not None and not feature_spec.empty:
+            data = self._collect(features.time_features(data, feature_spec))
 
-        data.write_csv(self.output_data_path / "chicago_citylevel_dataset.csv")
+        self._write_csv(data, self.output_data_path / "chicago_citylevel_dataset.csv")
 
+    @stage
     def save_original_micro_dataset(self):
-        micro_data = pd.read_stata(self.input_data_path / "micro_dataset.dta")
-        micro_data = pl.from_pandas(micro_data)
-        micro_data.write_csv(self.output_data_path / "micro_dataset_original.csv")
+        micro_data = self._read_stata(self._raw_paths("micro_original")[0], schemas.MICRO_DATASET)
+        self._write_csv(micro_data, self.output_data_path / "micro_dataset_original.csv")
+
+    @stage
+    def create_forest_designs(self):
+        # Sparse design matrices of the causal forests in 04-microreg_extension.R (see design.py), without and with
+        # the route dummies of the clustered forest
+        path = self.output_data_path / "micro_dataset_original.csv"
+        if self.io is not None:
+            self.io.wait_written(path)
+        sample = design.forest_sample(self._read_csv(path, schemas.MICRO_DATASET))
+        for name, cluster in [("no_cluster", False), ("cluster", True)]:
+            columns, matrix = design.forest_design(sample, cluster=cluster)
+            self._write_bytes(design.design_npz(columns, matrix, sample),
+                              self.output_data_path / f"forest_design_{name}.npz")
+
+    @stage
+    def create_hourly_crime_pollution(self, windows=(3, 6), tolerance="3h"):
+        # Every part 1 crime gets, for each pollutant, its nearest hourly monitor and that monitor's latest reading
+        # at or before the time of the crime (no older than tolerance), together with the trailing means over the
+        # readings of the windows (hours) ending at that reading. The readings are matched with one as-of join by
+        # monitor per pollutant, so the work grows with crimes + readings rather than with their product.
+        crime_data = (self._read_intermediate("chicago_part1_crimes")
+                      .select("id", "date", "hour", "minute", "second", "fbi_code", "violent", "latitude", "longitude")
+                      .with_columns(
+            (pl.col("date").cast(pl.Datetime("us"))
+             + pl.duration(hours=pl.col("hour"), minutes=pl.col("minute"), seconds=pl.col("second")))
+            .alias("datetime"))
+                      .sort("datetime"))
+        hourly_data = self._read_intermediate("chicago_pollution_hourly")
+
+        for pollutant in schemas.POLLUTANT.categories:
+            prefix = pollutant.lower()
+            readings = (hourly_data
+                        .filter(pl.col("pollutant") == pollutant)
+                        .sort("monitor_id", "datetime")
+                        .with_columns(
+                [pl.col("value").rolling_mean_by("datetime", window_size=f"{window}h").over("monitor_id")
+                 .alias(f"{prefix}_mean_{window}h") for window in windows])
+                        .rename({"value": f"{prefix}_hourly"}))
+            monitors = readings.group_by("monitor_id").agg(pl.col("latitude", "longitude").first()).sort("monitor_id")
+            if monitors.height == 0:
+                continue
+            index, distance = spatial.nearest_sites(crime_data.get_column("latitude").to_numpy(),
+                                                    crime_data.get_column("longitude").to_numpy(),
+                                                    monitors.get_column("latitude").to_numpy(),
+                                                    monitors.get_column("longitude").to_numpy())
+            monitor_ids = monitors.get_column("monitor_id").to_numpy()
+            crime_data = (crime_data
+                          .with_columns(
+                pl.Series(f"{prefix}_monitor_id", monitor_ids[index[:, 0]]).scatter(np.flatnonzero(index[:, 0] < 0),
+                                                                                    None),
+                pl.Series(f"{prefix}_monitor_km", distance[:, 0]).fill_nan(None))
+                          .join_asof(
+                readings
+                .select(pl.col("monitor_id").alias(f"{prefix}_monitor_id"), pl.col("datetime").alias("reading_time"),
+                        f"{prefix}_hourly", *[f"{prefix}_mean_{window}h" for window in windows])
+                .sort("reading_time"),
+                left_on="datetime", right_on="reading_time", by=f"{prefix}_monitor_id", strategy="backward",
+                tolerance=tolerance, check_sortedness=False)
+                          .drop("reading_time"))
+
+        self._write_csv(crime_data.sort("id"), self.output_data_path / "crime_pollution_hourly.csv")
+
+    @stage
+    def create_crime_weather(self, k=3, power=2):
+        # Location-specific daily weather of every part 1 crime: the inverse distance weighted average (distance^-power)
+        # of the k nearest hourly weather stations, renormalized over the stations that report a variable on the day.
+        # Wind direction is averaged as a weighted unit vector.
+        linear = ["avg_wind_speed", "tmax", "tavg", "tmin", "dew_point_avg", "sealevel_pressure_avg"]
+        stations = self._collect(self._scan_intermediate("chicago_hourly_weather_stations")
+                                 .group_by("usaf", "wban")
+                                 .agg(
+            pl.col("latitude", "longitude").median())
+                                 .sort("usaf", "wban"))
+        crime_data = self._read_intermediate("chicago_part1_crimes").select("id", "date", "latitude", "longitude")
+
+        index, distance = spatial.nearest_sites(crime_data.get_column("latitude").to_numpy(),
+                                                crime_data.get_column("longitude").to_numpy(),
+                                                stations.get_column("latitude").to_numpy(),
+                                                stations.get_column("longitude").to_numpy(), k=k)
+        weights = spatial.inverse_distance_weights(distance, power)
+        neighbours = (pl.DataFrame({"id": np.repeat(crime_data.get_column("id").to_numpy(), index.shape[1]),
+                                    "station": index.ravel(),
+                                    "distance_km": distance.ravel(),
+                                    "weight": weights.ravel()})
+                      .filter(
+            pl.col("station") >= 0)
+                      .join(
+            stations.select("usaf", "wban").with_row_index("station").with_columns(pl.col("station").cast(pl.Int64)),
+            on="station", how="left", validate="m:1")
+                      .join(
+            crime_data.select("id", "date"), on="id", how="left", validate="m:1"))
+
+        weather_data = (neighbours
+                        .join(
+            self._read_intermediate("chicago_weather_daily_from_hourly").select("usaf", "wban", "date", "wind_dir_avg",
+                                                                                *linear),
+            on=["usaf", "wban", "date"], how="left", validate="m:1")
+                        .sort("id", "distance_km")
+                        .group_by("id")
+                        .agg(
+            pl.col("usaf").first().alias("station_usaf"),
+            pl.col("wban").first().alias("station_wban"),
+            pl.col("distance_km").first().alias("station_km"),
+            *[((pl.col(col) * pl.col("weight")).sum() / pl.col("weight").filter(pl.col(col).is_not_null()).sum())
+              .fill_nan(None).alias(col) for col in linear],
+            pl.when(pl.col("wind_dir_avg").is_not_null().any())
+            .then(pl.arctan2((pl.col("wind_dir_avg").sin() * pl.col("weight")).sum(),
+                             (pl.col("wind_dir_avg").cos() * pl.col("weight")).sum()).mod(2 * np.pi))
+            .alias("wind_dir_avg"))
+                        .with_columns(
+            pl.col("wind_dir_avg").degrees().alias("wind_deg_avg")))
 
-    def create_micro_dataset(self, wind_dir_threshold):
-        wind_var = "wind_deg_avg"
-        distance_threshold = 5280
-        crime_interstate_data = pl.read_csv(self.output_data_path / "crime_road_distances.csv")
+        data = (crime_data
+                .join(
+            weather_data, on="id", how="left", validate="1:1")
+                .sort("id"))
+        self._write_csv(data, self.output_data_path / "crime_weather_idw.csv")
+
+    @stage
+    def create_crime_grid(self, cell_size=1000, shape="square", file_format="parquet"):
+        # Sparse cell x day x fbi code counts of all crimes (see grid.py), as a parquet table or as COO arrays
+        counts = self._collect(grid.grid_counts(self._scan_intermediate("chicago_part1_crimes"), cell_size, shape))
+        path = self.output_data_path / f"crime_grid_{shape}_{cell_size}ft.{file_format}"
+        if file_format == "npz":
+            self._write_bytes(grid.grid_npz(counts), path)
+            return
+        self._write(counts, path, "parquet")
+        if self.profiler is not None:
+            self.profiler.record_output(path, counts)
+
+    @stage
+    def create_pollution_episodes(self, thresholds=None, min_days=2, window_days=7):
+        # Runs of days above the thresholds of the city-level pollution columns, with the part 1 crimes in and around
+        # them (see episodes.py)
+        pollution = self._read_intermediate("chicago_pollution_2000_2012")
+        found = pl.concat([episodes.find_episodes(pollution, column, threshold, min_days)
+                           for column, threshold in (thresholds or episodes.EPISODE_THRESHOLDS).items()])
+        crimes = self._collect(self._scan_intermediate("chicago_part1_crimes")
+                               .select("date", "violent")
+                               .sort("date"))
+        self._write_csv(episodes.count_crimes(self._collect(found), crimes, window_days),
+                        self.output_data_path / "pollution_episodes.csv")
+
+    def _polars_micro_crimes(self, keys, inner_edges=None, distance_threshold=5280):
+        # Both crime stores are in id order, so the join merges them. sorted_by checks that the ids are unique, as
+        # validate="1:1" did with a hash table.
+        crime_interstate_data = crime_store.sorted_by(self._read_intermediate("crime_road_distances"), "id")
         crime_merged = (crime_interstate_data
                         .join(
-            pl.read_csv(self.output_data_path / "chicago_part1_crimes.csv"),
-            on="id", how="left", validate="1:1")
+            crime_store.sorted_by(self._read_intermediate("chicago_part1_crimes"), "id"),
+            on="id", how="left")
                         .filter(pl.col("sample_set") == 1)
                         .with_columns(
             pl.col("near_angle_1").mod(180).alias("ortho_dir"))
@@ -1165,18 +1539,51 @@ class DataPreprocessor:
             ((pl.col("near_angle_1") / 20).round() * 20).alias("round_angle"))
                         )
 
+        if inner_edges is not None:
+            crime_merged = (crime_merged
+                            .filter(pl.col("near_dist_1") <= distance_threshold)
+                            .with_columns(
+                pl.lit(pl.Series(inner_edges)).search_sorted(pl.col("near_dist_1"), side="left")
+                .alias("distance_band")))
+
         crime_data = (crime_merged
-                      .group_by(["date", "route_num_1_mod", "side_dummy", "violent"])
+                      .group_by(["date", *keys])
                       .agg(
             pl.count("id").alias("num_crimes"))
                       )
+        return treatment_angle_by_route, crime_data
 
-        weather_data = pl.read_csv(self.output_data_path / "chicago_weather_daily_from_hourly.csv"
-                                   ).filter(pl.col("usaf") == 725340)
+    @stage
+    def create_micro_dataset(self, wind_dir_threshold, band_width=None):
+        # With band_width (feet), crimes are also binned by their distance to the interstate into rings of that width
+        # up to distance_threshold, and the panel is route x side x distance band x day
+        wind_var = "wind_deg_avg"
+        distance_threshold = 5280
+        keys = ["route_num_1_mod", "side_dummy", "violent"]
+        inner_edges = None
+        if band_width is not None:
+            keys.append("distance_band")
+            # Right-closed bands (lower, upper], the first one starting at 0 ft
+            inner_edges = np.arange(band_width, distance_threshold, band_width, dtype=np.float64)
+            bands = (pl.DataFrame({"distance_band": np.arange(len(inner_edges) + 1, dtype=np.uint32)})
+                     .with_columns(
+                (pl.col("distance_band") * band_width).cast(pl.Float64).alias("band_lower_ft"),
+                pl.min_horizontal((pl.col("distance_band") + 1) * band_width, distance_threshold)
+                .cast(pl.Float64).alias("band_upper_ft")))
+        if self.backend is not None:
+            treatment_angle_by_route, crime_data = self.backend.micro_crimes(
+                self._engine_source("crime_road_distances"), self._engine_source("chicago_part1_crimes"),
+                inner_edges, distance_threshold)
+        else:
+            treatment_angle_by_route, crime_data = self._polars_micro_crimes(
+                keys, inner_edges, distance_threshold)
+
+        weather_data = self._read_intermediate("chicago_weather_daily_from_hourly"
+                                               ).filter(pl.col("usaf") == self.city.weather_usaf)
         midway_weather_data = (weather_data
                                .join(
-            pl.read_csv(self.output_data_path / "chicago_midwayohare_daily_weather.csv"
-                        ).select("date", cs.contains("MIDWAY")),
+            self._read_intermediate("chicago_midwayohare_daily_weather"
+                                    ).select("date", cs.contains("MIDWAY")),
             on="date", how="full", validate="1:1",)
                                .with_columns(
             [pl.col(f"{col}_dir_avg").degrees().alias(f"{col}_deg_avg")
@@ -1184,12 +1591,15 @@ class DataPreprocessor:
                                .drop("date_right")
                                )
 
-        comb = (pl.DataFrame({"route_num_1_mod": ["I57", "I290", "I90_B", "I90_A", "I94", "I55", "I90_C"]})
+        comb = (pl.DataFrame({"route_num_1_mod": self.city.routes},
+                             schema={"route_num_1_mod": pl.Categorical})
                 .join(
             pl.DataFrame({"side_dummy": [0, 1]}), how="cross")
                 .join(
             pl.DataFrame({"violent": [0, 1]},), how="cross")
                 )
+        if band_width is not None:
+            comb = comb.join(bands, how="cross")
         midway_weather_panel_data = (midway_weather_data
                                      .join(comb, how="cross")
                                      .join(
@@ -1227,14 +1637,12 @@ class DataPreprocessor:
         data = (midway_weather_panel_data
                 .join(
             crime_data.with_columns(pl.col("side_dummy").cast(pl.Int64)),
-            on=["route_num_1_mod", "date", "side_dummy", "violent"], how="full", validate="1:1",)
-                .with_columns(
-            pl.col("date").str.to_date())
+            on=["date", *keys], how="full", validate="1:1",)
                 .with_columns(
             pl.col("date").dt.year().alias("year"),
             pl.col("date").dt.month().alias("month"),
             pl.col("date").dt.day().alias("day"),)
-                .filter(~pl.col("year").is_in([2000, 2013]))
+                .filter(~pl.col("year").is_in([self.city.years[0] - 1, self.city.years[1] + 1]))
                 )
 
         fe_pairs = {
@@ -1254,7 +1662,7 @@ class DataPreprocessor:
             .then(pl.lit(0))
             .otherwise(pl.col("num_crimes"))
             .alias("num_crimes"))
-                .sort("route_num_1_mod", "date", "side_dummy", "violent")
+                .sort("route_num_1_mod", "date", *keys[3:], "side_dummy", "violent")
                 .with_columns(
             pl.when(pl.col("side_dummy") == 1)
             .then((pl.col("num_crimes") - pl.col("num_crimes").shift(1)))
@@ -1263,7 +1671,7 @@ class DataPreprocessor:
             .then(pl.col("treatment") - pl.col("treatment").shift(1))
             .alias("treatment_diff"))
                 .with_columns(
-            pl.col("num_crimes").mean().over("violent").alias("mean_crimes"))
+            pl.col("num_crimes").mean().over("violent", *keys[3:]).alias("mean_crimes"))
                 .with_columns(
             (pl.col("num_crimes") / pl.col("mean_crimes")).alias("stand_crimes")
         )
@@ -1275,11 +1683,76 @@ class DataPreprocessor:
                         "tmax", "tavg", "tmin", "dew_point_avg", "sealevel_pressure_avg", "AWND_MIDWAY",
                         "PRCP_MIDWAY", "SNOW_MIDWAY", "SNWD_MIDWAY", "TMAX_MIDWAY", "TMIN_MIDWAY", "wind_deg_avg",
                         "wind_speed_deg_avg", "wind_power_deg_avg", "round", "route_num_1_mod", "treatment_angle",
-                        "side_dummy", "wind_deg_adj", "in_sample", "treatment", "violent", "num_crimes", "route_side",
+                        "side_dummy", *(["distance_band", "band_lower_ft", "band_upper_ft"] if band_width is not None else []),
+                        "wind_deg_adj", "in_sample", "treatment", "violent", "num_crimes", "route_side",
                         "month_year", "route_date", "crime_diff", "treatment_diff", "mean_crimes", "stand_crimes")
                 .sort("date"))
 
-        data.write_csv(self.output_data_path / f"micro_dataset_replicated_dir_thresh_{wind_dir_threshold}.csv")
+        name = f"micro_dataset_replicated_dir_thresh_{wind_dir_threshold}"
+        if band_width is not None:
+            name = f"micro_distance_bands_{band_width}ft_dir_thresh_{wind_dir_threshold}"
+        self._write_csv(data, self.output_data_path / f"{name}.csv")
+
+    def _build_citylevel_dataset(self, feature_spec=None):
+        self.create_citylevel_dataset(process_raw_data=False, feature_spec=feature_spec)
+
+    def _build_micro_datasets(self, wind_dir_thresholds=(60,)):
+        for wind_dir_threshold in wind_dir_thresholds:
+            self.create_micro_dataset(wind_dir_threshold)
+
+    def _build_distance_band_datasets(self, wind_dir_thresholds=(60,), band_width=1320):
+        for wind_dir_threshold in wind_dir_thresholds:
+            self.create_micro_dataset(wind_dir_threshold, band_width=band_width)
+
+    def run(self, stages, wind_dir_thresholds=(60,), band_width=1320, feature_spec=None, hourly_windows=(3, 6),
+            weather_stations=3, idw_power=2, grid_options=None, episode_options=None):
+        # Run the named stages (see stages.STAGES) in dependency order. Independent stages of the same wave run
+        # concurrently when jobs > 1.
+        if not self.async_io:
+            self._run_waves(execution_waves(stages), wind_dir_thresholds, band_width, feature_spec, hourly_windows,
+                            weather_stations, idw_power, grid_options, episode_options)
+            self._write_summary()
+            return
+        waves = execution_waves(stages)
+        self.io = AsyncFileIO(self.max_inflight_bytes)
+        try:
+            # Prefetch in the order in which the stages are submitted, so that the byte budget is always held by
+            # files that a running or an earlier stage is about to read
+            # Stages of the duckdb engine read their raw files themselves
+            self.io.prefetch(self.input_data_path / file for wave in waves for name in wave
+                             if self.backend is None or name not in duckdb_backend.ENGINE_STAGES
+                             for file in self.city.raw_inputs.get(name, []))
+            self._run_waves(waves, wind_dir_thresholds, band_width, feature_spec, hourly_windows, weather_stations,
+                            idw_power, grid_options, episode_options)
+            self._write_summary()
+        finally:
+            self.io.close()
+            self.io = None
+
+    def _write_summary(self):
+        table = None if self.summary is None else self.summary.table()
+        if table is not None:
+            self._write_csv(table, self.output_data_path / "summary_statistics.csv")
+
+    def _run_waves(self, waves, wind_dir_thresholds, band_width, feature_spec, hourly_windows, weather_stations,
+                   idw_power, grid_options, episode_options):
+        stage_kwargs = {"citylevel": {"feature_spec": feature_spec},
+                        "micro": {"wind_dir_thresholds": wind_dir_thresholds},
+                        "micro_bands": {"wind_dir_thresholds": wind_dir_thresholds, "band_width": band_width},
+                        "hourly": {"windows": hourly_windows},
+                        "crime_weather": {"k": weather_stations, "power": idw_power},
+                        "crime_grid": grid_options or {},
+                        "episodes": episode_options or {}}
+        for wave in waves:
+            if self.jobs <= 1 or len(wave) == 1:
+                for name in wave:
+                    getattr(self, STAGES[name])(**stage_kwargs.get(name, {}))
+                continue
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(getattr(self, STAGES[name]), **stage_kwargs.get(name, {}))
+                           for name in wave]
+                for future in futures:
+                    future.result()
 
 
 
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from html import escape
+from pathlib import Path
+
+import polars as pl
+
+
+def stage(method):
+    # Wrap an extractor/builder so that it is timed when the preprocessor has a profiler attached
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+        with self.profiler.stage(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+STATM = Path("/proc/self/statm")
+
+
+def _rss_mb():
+    # Current resident set size
+    return int(STATM.read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+class StageProfiler:
+    # Stages may run concurrently in threads; each thread keeps its own stack of open stages. While any stage is
+    # open, a sampler thread polls the current RSS every interval seconds, so peak_rss_mb is the highest RSS seen
+    # during the stage and peak_rss_delta_mb its growth over the RSS at the start of the stage. CPU time and RSS are
+    # process-wide: concurrent stages share them, and allocations shorter than the interval can be missed. Without
+    # /proc/self/statm (not Linux) there is no current RSS to sample, and the RSS columns are None.
+    def __init__(self, interval=0.01):
+        self.records = []
+        self.interval = interval
+        self.track_rss = STATM.exists()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = {}
+        self._sampler = None
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name):
+        record = {
+            "stage": name,
+            "parent": self._stack[-1]["stage"] if self._stack else None,
+            "inputs": [],
+            "outputs": [],
+            "plans": [],
+        }
+        self._stack.append(record)
+        record["rss_start_mb"] = record["peak_rss_mb"] = _rss_mb() if self.track_rss else None
+        if self.track_rss:
+            with self._lock:
+                self._open[id(record)] = record
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample, daemon=True)
+                    self._sampler.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - wall_start
+            record["cpu_s"] = time.process_time() - cpu_start
+            record["peak_rss_delta_mb"] = None
+            if self.track_rss:
+                with self._lock:
+                    del self._open[id(record)]
+                    record["peak_rss_mb"] = max(record["peak_rss_mb"], _rss_mb())
+                record["peak_rss_delta_mb"] = record["peak_rss_mb"] - record["rss_start_mb"]
+            for direction in ["inputs", "outputs"]:
+                record[f"rows_{direction[:-1]}"] = sum(item["rows"] or 0 for item in record[direction])
+                record[f"bytes_{direction[:-1]}"] = sum(item["bytes"] or 0 for item in record[direction])
+            self._stack.pop()
+            with self._lock:
+                self.records.append(record)
+
+    def _sample(self):
+        # Runs until no stage is open; the next stage starts a new sampler
+        while True:
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                rss = _rss_mb()
+                for record in self._open.values():
+                    record["peak_rss_mb"] = max(record["peak_rss_mb"], rss)
+            time.sleep(self.interval)
+
+    def _current(self):
+        return self._stack[-1] if self._stack else None
+
+    def record_input(self, source, frame=None):
+        record = self._current()
+        if record is None:
+            return
+        record["inputs"].append(self._describe(source, frame))
+
+    def record_output(self, target, frame):
+        record = self._current()
+        if record is None:
+            return
+        record["outputs"].append(self._describe(target, frame))
+
+    def record_plan(self, lazy_frame):
+        record = self._current()
+        if record is None:
+            return
+        record["plans"].append(lazy_frame.explain(optimized=True))
+
+    @staticmethod
+    def _describe(path, frame):
+        path = Path(path)
+        file_bytes = path.stat().st_size if path.is_file() else None
+        if isinstance(frame, pl.DataFrame):
+            return {"file": path.name, "file_bytes": file_bytes,
+                    "rows": frame.height, "bytes": frame.estimated_size()}
+        # Lazy scans are only known by their size on disk until they are collected
+        return {"file": path.name, "file_bytes": file_bytes, "rows": None, "bytes": file_bytes}
+
+    def summary(self):
+        return (pl.DataFrame(
+            [{key: value for key, value in record.items() if key not in ["inputs", "outputs", "plans"]}
+             for record in self.records])
+                .sort("wall_s", descending=True))
+
+    def write_report(self, report_path):
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+
+        report = {"created": datetime.now().isoformat(timespec="seconds"),
+                  "stages": self.records}
+        report_path.with_suffix(".json").write_text(json.dumps(report, indent=2, default=str))
+        report_path.with_suffix(".html").write_text(self._render_html(report))
+
+    @staticmethod
+    def _render_html(report):
+        columns = ["stage", "parent", "wall_s", "cpu_s", "peak_rss_delta_mb", "peak_rss_mb", "rss_start_mb",
+                   "rows_input", "bytes_input", "rows_output", "bytes_output"]
+        header = "".join(f"<th>{col}</th>" for col in columns)
+        rows = []
+        for record in report["stages"]:
+            cells = []
+            for col in columns:
+                value = record[col]
+                cells.append(f"<td>{value:.3f}</td>" if isinstance(value, float) else f"<td>{escape(str(value))}</td>")
+            rows.append(f"<tr>{''.join(cells)}</tr>")
+        plans = "".join(
+            f"<details><summary>{escape(record['stage'])} ({i + 1})</summary><pre>{escape(plan)}</pre></details>"
+            for record in report["stages"] for i, plan in enumerate(record["plans"]))
+        return (f"<html><head><meta charset='utf-8'><title>DataPreprocessor profile</title></head><body>"
+                f"<h1>DataPreprocessor profile ({report['created']})</h1>"
+                f"<table border='1' cellspacing='0' cellpadding='4'><tr>{header}</tr>{''.join(rows)}</table>"
+                f"<h2>Optimized query plans</h2>{plans}</body></html>")
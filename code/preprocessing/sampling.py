@@ -0,0 +1,90 @@
+import polars as pl
+
+from code.preprocessing import schemas
+from code.preprocessing.city import CHICAGO
+
+# Development mode: a SampleSpec restricts every raw file to a consistent slice before anything else happens, so the
+# whole pipeline runs on it. The same years are kept in the crime, pollution and weather files (GHCN days before the
+# first crime year stay, they make the normals), crimes are kept by a hash of their id in both the crime file and the
+# interstate distance file (which has no dates, so with a year subset it keeps the ids of the sampled crime file), and
+# pollution monitors and weather stations can be restricted by id. The monitors that
+# _merge_pollution averages into the city-level series are always kept, since its wide tables name them, and so is the
+# city's weather station, which the wind and weather variables come from. Raw files are recognized by the stage of the
+# city spec that reads them (see city.py).
+#
+# The id hash is Knuth's multiplicative hash, computed in integer arithmetic so that the slice only depends on the
+# seed, not on the polars version.
+HASH_MULTIPLIER = 2654435761
+HASH_MODULUS = 2 ** 32
+
+AQS_STAGES = ["extract_co", "extract_no2", "extract_ozone", "extract_pm10"]
+
+
+class SampleSpec:
+    def __init__(self, years=None, id_fraction=None, monitors=None, stations=None, seed=0):
+        if id_fraction is not None and not 0 < id_fraction <= 1:
+            raise ValueError(f"id_fraction must be in (0, 1], got {id_fraction}.")
+        self.years = None if years is None else sorted(set(years))
+        self.id_fraction = id_fraction
+        # Monitors as integer keys or "county_site_poc" labels, stations as USAF ids
+        self.monitors = None if monitors is None else sorted(
+            {schemas.monitor_id(monitor) if isinstance(monitor, str) else monitor for monitor in monitors})
+        self.stations = None if stations is None else sorted(set(stations))
+        self.seed = seed
+        self._crime_ids = {}
+
+    def _year(self, year):
+        return True if self.years is None else year.is_in(self.years)
+
+    def _crime_id(self, crime_id):
+        if self.id_fraction is None:
+            return True
+        hashed = ((crime_id.cast(pl.Int64) + self.seed) * HASH_MULTIPLIER) % HASH_MODULUS
+        return hashed < int(self.id_fraction * HASH_MODULUS)
+
+    def _monitor(self, county_code, site_num, poc, city):
+        return True if self.monitors is None else schemas.monitor_id_expr(county_code, site_num, poc).is_in(
+            sorted(set(self.monitors) | set(schemas.monitor_ids(*city.all_monitors()))))
+
+    def _station(self, usaf, city):
+        return True if self.stations is None else usaf.is_in(sorted(set(self.stations) | {city.weather_usaf}))
+
+    def crime_ids(self, crime_file, city=CHICAGO):
+        # Ids of the sampled crimes of the raw crime file
+        if crime_file not in self._crime_ids:
+            self._crime_ids[crime_file] = (pl.scan_csv(crime_file, infer_schema=False)
+                                           .select(pl.col("ID", "Year").cast(pl.Int64))
+                                           .filter(self.raw_filter(crime_file.name, city=city))
+                                           .collect()
+                                           .get_column("ID"))
+        return self._crime_ids[crime_file]
+
+    def raw_filter(self, file_name, input_path=None, city=CHICAGO):
+        # Row predicate on the raw columns of file_name (in input_path), or None if the file is read whole
+        stage = city.raw_stage(file_name)
+        if stage == "extract_crime":
+            conditions = [self._year(pl.col("Year")), self._crime_id(pl.col("ID"))]
+        elif stage == "extract_crime_interstate_distance":
+            conditions = [self._crime_id(pl.col("ID"))]
+            if self.years is not None:
+                crime_file = input_path / city.raw_inputs["extract_crime"][0]
+                conditions.append(pl.col("ID").is_in(self.crime_ids(crime_file, city).implode()))
+        elif stage in AQS_STAGES:
+            conditions = [self._year(pl.col("Date Local").dt.year()),
+                          self._monitor("County Code", "Site Num", "POC", city)]
+        elif stage == "extract_aqi":
+            conditions = [self._year(pl.col("datelocal").str.slice(0, 4).cast(pl.Int32)),
+                          self._monitor("countycode", "sitenum", "poc", city)]
+        elif stage == "extract_ghcn_weather":
+            year = pl.col("strdate") // 10_000
+            conditions = [] if self.years is None else [(year < city.years[0]) | self._year(year)]
+        elif stage == "extract_hourly_weather":
+            conditions = [self._year(pl.col("year")), self._station(pl.col("usaf"), city)]
+        elif stage == "read_sky_cover":
+            conditions = [self._year(pl.col("mm/dd/yyyy").str.strip_chars().str.slice(-4).cast(pl.Int32, strict=False))]
+        elif stage == "micro_original":
+            conditions = [self._year(pl.col("date").dt.year())]
+        else:
+            return None
+        conditions = [condition for condition in conditions if condition is not True]
+        return pl.all_horizontal(conditions) if conditions else None
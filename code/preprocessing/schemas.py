@@ -0,0 +1,348 @@
+import re
+
+import polars as pl
+
+
+# Declared dtypes of every raw and intermediate file. Readers pass these to polars instead of inferring the schema,
+# so dates are parsed at read time and a file whose columns drift from the declaration is rejected before any
+# processing starts.
+
+class SchemaDriftError(ValueError):
+    pass
+
+
+# Low-cardinality string columns (route names, AQS sample durations and frequencies, fbi codes, quality flags) are read
+# as Categorical. Columns whose values are fixed by the pipeline itself are Enums. Monitors are identified by integer
+# keys, see monitor_id.
+POLLUTANT = pl.Enum(["CO", "NO2", "Ozone", "PM10"])  # lexical order, so that sorting is unchanged
+
+
+def monitor_id(label):
+    # "county_site_poc" label such as "31_3103_1" -> integer key 31310301
+    county_code, site_num, poc = map(int, label.split("_"))
+    return county_code * 1_000_000 + site_num * 100 + poc
+
+
+def monitor_ids(*labels):
+    return [monitor_id(label) for label in labels]
+
+
+def monitor_id_expr(county_code, site_num, poc):
+    return (pl.col(county_code).cast(pl.Int64) * 1_000_000 + pl.col(site_num).cast(pl.Int64) * 100
+            + pl.col(poc).cast(pl.Int64))
+
+
+# Raw data -------------------------------------------------------------------------------------------------------------
+CRIME = {
+    "ID": pl.Int64,
+    "Case Number": pl.String,
+    "Date": pl.String,  # "%m/%d/%Y %I:%M:%S %p" is not understood by the csv reader
+    "Block": pl.String,
+    "IUCR": pl.String,  # codes such as 0486 and 041A
+    "Primary Type": pl.Categorical,
+    "Description": pl.String,
+    "Location Description": pl.String,
+    "Arrest": pl.Boolean,
+    "Domestic": pl.Boolean,
+    "Beat": pl.Int64,
+    "District": pl.Int64,
+    "Ward": pl.Int64,
+    "Community Area": pl.Int64,
+    "FBI Code": pl.Categorical,
+    "X Coordinate": pl.Int64,
+    "Y Coordinate": pl.Int64,
+    "Year": pl.Int64,
+    "Updated On": pl.String,
+    "Latitude": pl.Float64,
+    "Longitude": pl.Float64,
+    "Location": pl.String,
+}
+
+CRIME_INTERSTATE_DISTANCE = {
+    "OBJECTID": pl.Int64,
+    "ID": pl.Int64,
+    "Latitude": pl.Float64,
+    "Longitude": pl.Float64,
+    "FEAT_SEQ": pl.Int64,
+    "FREQUENCY": pl.Int64,
+    "NEAR_RANK": pl.Int64,
+    "NEAR_DIST": pl.Float64,
+    "NEAR_ANGLE": pl.Float64,
+    "ROUTE_NUM": pl.Categorical,
+    "Shape_Length": pl.Float64,
+}
+
+# Shared by the co, pm10, no2 and ozone hourly files of the EPA AQS
+AQS = {
+    "State Code": pl.Int64,
+    "County Code": pl.Int64,
+    "Site Num": pl.Int64,
+    "Parameter Code": pl.Int64,
+    "POC": pl.Int64,
+    "Latitude": pl.Float64,
+    "Longitude": pl.Float64,
+    "Datum": pl.Categorical,
+    "Parameter Name": pl.Categorical,
+    "Sample Duration": pl.Categorical,
+    "Pollutant Standard": pl.Categorical,
+    "Date Local": pl.Date,
+    "24 Hour Local": pl.String,
+    "Date GMT": pl.Date,
+    "24 Hour GMT": pl.String,
+    "Year GMT": pl.Int64,
+    "Day In Year GMT": pl.Int64,
+    "Sample Measurement": pl.Float64,
+    "Units of Measure": pl.Categorical,
+    "Sample Frequency": pl.Categorical,
+    "Detection Limit": pl.Float64,
+    "Measurement Uncertainty": pl.String,
+    "Qualifier Description": pl.String,
+    "Method Type": pl.Categorical,
+    "Method Description": pl.Categorical,
+    "Horizontal Accuracy": pl.Float64,
+}
+
+AQI = {
+    "statecode": pl.Int32,
+    "countycode": pl.Int32,
+    "sitenum": pl.Int32,
+    "poc": pl.Int32,
+    "parametername": pl.Categorical,
+    "datelocal": pl.String,
+    "aqi": pl.Float64,
+    "cityname": pl.Categorical,
+}
+
+GHCN_DAILY = {
+    "station_id": pl.String,
+    "strdate": pl.Int64,
+    "element": pl.String,
+    "value": pl.Int64,
+    "mflag": pl.String,
+    "qflag": pl.String,
+    "sflag": pl.String,
+    "obstime": pl.Int64,
+}
+
+HOURLY_WEATHER = {
+    "usaf": pl.Int32,
+    "wban": pl.Int32,
+    "year": pl.Int32,
+    "month": pl.Int8,
+    "day": pl.Int8,
+    "hour": pl.Int32,
+    "min": pl.Int32,
+    "latitude": pl.Float64,
+    "longitude": pl.Float64,
+    "elevation": pl.Int32,
+    "wind_angle": pl.Int32,
+    "wind_angle_qual": pl.Categorical,
+    "wind_obs_type": pl.Categorical,
+    "wind_speed": pl.Int32,
+    "wind_speed_qual": pl.Categorical,
+    "temp": pl.Int32,
+    "temp_qual": pl.Categorical,
+    "dewpoint": pl.Int32,
+    "dewpoint_qual": pl.Categorical,
+    "sealevel_pressure": pl.Int32,
+    "sealevel_pressure_qual": pl.Categorical,
+    "stationname": pl.Categorical,
+}
+
+SKY_COVER = {
+    "mm/dd/yyyy": pl.String,
+    "hh": pl.Int64,
+    "Sky Cov": pl.Float64,
+}
+
+MICRO_DATASET = {
+    "route_num1_mod": pl.String,
+    "routeside": pl.Int32,
+    "violent": pl.Int32,
+    "date": pl.Datetime("ms"),
+    "insample": pl.Int8,
+    "treatment": pl.Int8,
+    "num_crimes": pl.Int32,
+    "tmax": pl.Float64,
+    "valueTMAX_MIDWAY": pl.Float64,
+    "valuePRCP_MIDWAY": pl.Float64,
+    "avg_wind_speed": pl.Float64,
+    "stand_crimes": pl.Float64,
+    "routedate": pl.Int32,
+}
+
+
+# Intermediate data ----------------------------------------------------------------------------------------------------
+_CRIMES = {
+    "id": pl.Int64,
+    "case_number": pl.String,
+    "block": pl.String,
+    "iucr": pl.String,
+    "primary_type": pl.Categorical,
+    "description": pl.String,
+    "location_description": pl.String,
+    "arrest": pl.Boolean,
+    "domestic": pl.Boolean,
+    "beat": pl.Int64,
+    "district": pl.Int64,
+    "ward": pl.Int64,
+    "community_area": pl.Int64,
+    "fbi_code": pl.Categorical,
+    "x_coordinate": pl.Int64,
+    "y_coordinate": pl.Int64,
+    "year": pl.Int64,
+    "updated_on": pl.String,
+    "latitude": pl.Float64,
+    "longitude": pl.Float64,
+    "location": pl.String,
+    "date": pl.Date,
+    "hour": pl.Int8,
+    "minute": pl.Int8,
+    "second": pl.Int8,
+    "part1": pl.Int32,
+    "violent": pl.Int32,
+}
+
+
+def _daily_aqs(measurement_columns):
+    columns = {col.lower().replace(" ", "_"): dtype for col, dtype in AQS.items() if "GMT" not in col}
+    return {**columns,
+            "date_local": pl.Datetime("us"),
+            "monitor_id": pl.Int64,
+            **measurement_columns,
+            "date": pl.Date}
+
+
+INTERMEDIATE = {
+    "chicago_part1_crimes": _CRIMES,
+    "chicago_all_crimes": {col: dtype for col, dtype in _CRIMES.items()
+                           if col not in ["block", "description", "location_description", "beat", "district", "ward",
+                                          "community_area", "x_coordinate", "y_coordinate", "location"]},
+    "crime_road_distances": {
+        "id": pl.Int64,
+        "latitude": pl.Float64,
+        "longitude": pl.Float64,
+        "near_dist_1": pl.Float64,
+        "near_dist_2": pl.Float64,
+        "near_angle_1": pl.Float64,
+        "near_angle_2": pl.Float64,
+        "route_num_1": pl.Categorical,
+        "route_num_2": pl.Categorical,
+        "near_dir_1": pl.Float64,
+        "near_dir_2": pl.Float64,
+        "route_num_1_mod": pl.Categorical,
+        "sample_set": pl.Int32,
+    },
+    "chicago_aqi_2000_2015": {**AQI, "datelocal": pl.Date},
+    "chicago_co_2000_2012_daily": _daily_aqs(
+        {"num_hrly_obs_co": pl.Int64, "max_co": pl.Float64, "avg_co": pl.Float64, "max8hr_co": pl.Float64}),
+    "chicago_pm10_2000_2012_daily": {
+        ("daily_pm10_notderived" if col == "sample_measurement" else col): dtype
+        for col, dtype in _daily_aqs({
+            "temp_obs": pl.Int64, "temp_max": pl.Float64, "temp_avg": pl.Float64,
+            "num_hrly_obs_pm10": pl.Int64, "max24hr_pm10_derived": pl.Float64,
+            "avg24hr_pm10_derived": pl.Float64}).items()},
+    "chicago_no2_2000_2012_daily": _daily_aqs(
+        {"num_hrly_obs_no2": pl.Int64, "max_no2": pl.Float64, "avg_no2": pl.Float64}),
+    "chicago_ozone_2000_2012_daily": _daily_aqs(
+        {"num_hrly_obs_ozone": pl.Int64, "max_ozone": pl.Float64, "avg_ozone": pl.Float64,
+         "max8hr_ozone": pl.Float64}),
+    "chicago_pollution_2000_2012": {
+        "avg_pm10_mean": pl.Float64,
+        "max_pm10_mean": pl.Float64,
+        "date": pl.Date,
+        "monitor_pct_pm10": pl.Float64,
+        "avg_co_mean": pl.Float64,
+        "avg_co_mean_drop_290": pl.Float64,
+        "max_co_mean": pl.Float64,
+        "max_co_mean_drop_290": pl.Float64,
+        "monitor_pct_co": pl.Float64,
+        "monitor_pct_co_drop_290": pl.Float64,
+        "avg_ozone_mean": pl.Float64,
+        "max_ozone_mean": pl.Float64,
+        "monitor_pct_ozone": pl.Float64,
+        "avg_no2_mean": pl.Float64,
+        "max_no2_mean": pl.Float64,
+        "monitor_pct_no2": pl.Float64,
+        "max_aqi_sample": pl.Float64,
+        "max_aqi_sample_poll": POLLUTANT,
+        "max_aqi_chicago": pl.Float64,
+        "max_aqi_chicago_poll": POLLUTANT,
+    },
+    "chicago_pollution_hourly": {
+        "pollutant": POLLUTANT,
+        "monitor_id": pl.Int64,
+        "latitude": pl.Float64,
+        "longitude": pl.Float64,
+        "datetime": pl.Datetime("us"),
+        "value": pl.Float64,
+    },
+    "chicago_midwayohare_daily_weather": {
+        "date": pl.Date,
+        **{f"{element}_{airport}": dtype
+           for element, dtype in [("AWND", pl.Int64), ("PRCP", pl.Float64), ("SNOW", pl.Int64),
+                                  ("SNWD", pl.Int64), ("TMAX", pl.Float64), ("TMIN", pl.Float64)]
+           for airport in ["MIDWAY", "OHARE"]},
+        "mean_TMAX_1991_2000": pl.Float64,
+        "mean_TMIN_1991_2000": pl.Float64,
+        "mean_PRCP_1991_2000": pl.Float64,
+    },
+    "chicago_hourly_weather_stations": HOURLY_WEATHER,
+    "chicago_weather_daily_from_hourly": {
+        "usaf": pl.Int32,
+        "wban": pl.Int32,
+        "date": pl.Date,
+        "wind_dir_avg": pl.Float64,
+        "wind_speed_dir_avg": pl.Float64,
+        "wind_power_dir_avg": pl.Float64,
+        "avg_wind_speed": pl.Float64,
+        "windobs": pl.Int64,
+        "speed_norm": pl.Float64,
+        "power_norm": pl.Float64,
+        "calmday": pl.Boolean,
+        "tempdataflag": pl.Boolean,
+        "tmax": pl.Int32,
+        "tavg": pl.Float64,
+        "tmin": pl.Int32,
+        "dew_point_avg": pl.Float64,
+        "sealevel_pressure_avg": pl.Float64,
+    },
+    "midway_daily_sky_cover": {
+        "date": pl.Date,
+        "avg_sky_cover": pl.Float64,
+    },
+}
+
+# Pivoted files get a column per GHCN element, so elements beyond the ones declared above are accepted
+INTERMEDIATE_EXTRA_COLUMNS = {
+    "chicago_midwayohare_daily_weather": (r"^[A-Z0-9]+_(MIDWAY|OHARE)$", pl.Float64),
+}
+
+
+def _resolve(source, columns, schema, extra_columns=None):
+    resolved = {}
+    unexpected = []
+    for col in columns:
+        if col in schema:
+            resolved[col] = schema[col]
+        elif extra_columns is not None and re.match(extra_columns[0], col):
+            resolved[col] = extra_columns[1]
+        else:
+            unexpected.append(col)
+    missing = [col for col in schema if col not in columns]
+    if missing or unexpected:
+        raise SchemaDriftError(f"{source}: missing columns {missing}, unexpected columns {unexpected}")
+    return resolved
+
+
+def file_schema(source, columns, schema, extra_columns=None):
+    # polars matches an explicit csv schema to the columns by position, so it is built in the file's own order
+    return _resolve(source, columns, schema, extra_columns)
+
+
+def check_schema(source, actual, schema, extra_columns=None):
+    expected = _resolve(source, list(actual), schema, extra_columns)
+    mismatched = {col: f"{actual[col]} (expected {dtype})" for col, dtype in expected.items()
+                  if actual[col] != dtype and not (col not in schema and actual[col].is_numeric())}
+    if mismatched:
+        raise SchemaDriftError(f"{source}: unexpected dtypes {mismatched}")
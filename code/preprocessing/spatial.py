@@ -0,0 +1,42 @@
+import numpy as np
+
+# Nearest-site assignment of points (crimes) to sites (monitors, weather stations) by great-circle distance. There are
+# only tens of sites, so a brute force over chunks of points is cheaper than building a tree, and the
+# (chunk x sites) distance block keeps the memory use flat whatever the number of points.
+EARTH_RADIUS_KM = 6371.0088
+
+CHUNK_SIZE = 65_536
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in [lat1, lon1, lat2, lon2])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def nearest_sites(lat, lon, site_lat, site_lon, k=1, chunk_size=CHUNK_SIZE):
+    # Indices (points x k) of the k nearest sites of every point, nearest first, and their distances in km. Points
+    # with a missing coordinate get index -1 and distance nan.
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    site_lat, site_lon = np.asarray(site_lat, dtype=np.float64), np.asarray(site_lon, dtype=np.float64)
+    k = min(k, len(site_lat))
+    index = np.full((len(lat), k), -1, dtype=np.int64)
+    distance = np.full((len(lat), k), np.nan)
+    valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    for start in range(0, len(valid), chunk_size):
+        rows = valid[start:start + chunk_size]
+        block = haversine_km(lat[rows, None], lon[rows, None], site_lat[None, :], site_lon[None, :])
+        nearest = np.argsort(block, axis=1, kind="stable")[:, :k]
+        index[rows] = nearest
+        distance[rows] = np.take_along_axis(block, nearest, axis=1)
+    return index, distance
+
+
+def inverse_distance_weights(distance, power=2):
+    # Rows of weights proportional to distance^-power that sum to one. A point on top of a site gets all the weight
+    # of that site; rows without sites (nan distances) get nan weights.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = 1 / distance ** power
+        exact = distance == 0
+        weights = np.where(exact.any(axis=1, keepdims=True), exact, weights)
+        return weights / weights.sum(axis=1, keepdims=True)
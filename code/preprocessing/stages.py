@@ -0,0 +1,121 @@
+# Stage registry of DataPreprocessor. Kept free of heavy imports so that command-line tools can list the stages
+# before polars is imported (POLARS_MAX_THREADS is only read at import time).
+
+STAGES = {
+    "extract_crime": "_extract_crime_data",
+    "extract_crime_interstate_distance": "_extract_crime_interstate_distance",
+    "extract_aqi": "_extract_chicago_aqi",
+    "extract_co": "_extract_chicago_co",
+    "extract_pm10": "_extract_chicago_pm10",
+    "extract_no2": "_extract_chicago_no2",
+    "extract_ozone": "_extract_chicago_ozone",
+    "merge_pollution": "_merge_pollution",
+    "extract_hourly_pollution": "_extract_hourly_pollution",
+    "extract_ghcn_weather": "_extract_midwayohare_daily_weather",
+    "extract_hourly_weather": "_extract_chicago_hourly_weather",
+    "generate_weather_variables": "_generate_weather_variables",
+    "read_sky_cover": "_read_midway_skycover",
+    "citylevel": "_build_citylevel_dataset",
+    "micro": "_build_micro_datasets",
+    "micro_bands": "_build_distance_band_datasets",
+    "micro_original": "save_original_micro_dataset",
+    "hourly": "create_hourly_crime_pollution",
+    "crime_weather": "create_crime_weather",
+    "crime_grid": "create_crime_grid",
+    "episodes": "create_pollution_episodes",
+    "forest_design": "create_forest_designs",
+}
+
+STAGE_DEPENDENCIES = {
+    "extract_crime": [],
+    "extract_crime_interstate_distance": [],
+    "extract_aqi": [],
+    "extract_co": [],
+    "extract_pm10": [],
+    "extract_no2": [],
+    "extract_ozone": [],
+    "merge_pollution": ["extract_aqi", "extract_co", "extract_pm10", "extract_no2", "extract_ozone"],
+    "extract_hourly_pollution": [],
+    "extract_ghcn_weather": [],
+    "extract_hourly_weather": [],
+    "generate_weather_variables": ["extract_hourly_weather"],
+    "read_sky_cover": [],
+    "citylevel": ["extract_crime", "merge_pollution", "extract_ghcn_weather", "generate_weather_variables",
+                  "read_sky_cover"],
+    "micro": ["extract_crime", "extract_crime_interstate_distance", "extract_ghcn_weather",
+              "generate_weather_variables"],
+    "micro_bands": ["extract_crime", "extract_crime_interstate_distance", "extract_ghcn_weather",
+                    "generate_weather_variables"],
+    "micro_original": [],
+    "hourly": ["extract_crime", "extract_hourly_pollution"],
+    "crime_weather": ["extract_crime", "extract_hourly_weather", "generate_weather_variables"],
+    "crime_grid": ["extract_crime"],
+    "episodes": ["extract_crime", "merge_pollution"],
+    "forest_design": ["micro_original"],
+}
+
+# Raw files of every stage, in the order in which the stage reads them
+RAW_INPUTS = {
+    "extract_crime": ["chicago_crime.csv"],
+    "extract_crime_interstate_distance": ["Chicago_Crime_Interstate_Distance_0606.csv"],
+    "extract_aqi": ["chicago_aqi_2000_2015.dta"],
+    "extract_co": ["co_chicago_20000101_20041231.txt", "co_chicago_20050101_20091231.txt",
+                   "co_chicago_20100101_20121231.txt"],
+    "extract_pm10": ["pm10_chicago_20000101_20041231.txt", "pm10_chicago_20050101_20091231.txt",
+                     "pm10_chicago_20100101_20121231.txt"],
+    "extract_no2": ["no2_chicago_20000101_20041231.txt", "no2_chicago_20050101_20091231.txt",
+                    "no2_chicago_20100101_20121231.txt"],
+    "extract_ozone": ["ozone_chicago_20000101_20050101.txt", "ozone_chicago_20050102_20091231.txt",
+                      "ozone_chicago_20100101_20121231.txt"],
+    "extract_ghcn_weather": ["chicago_midwayohare_ghcn_daily_1991_2012.csv"],
+    "extract_hourly_weather": ["chicago_hourly_weather_stations.dta"],
+    "read_sky_cover": ["sky_cover_MDW.txt"],
+    "micro_original": ["micro_dataset.dta"],
+}
+
+# Targets are named groups of stages. Unlike stages, they are always built together with their dependencies.
+TARGETS = {
+    "crime": ["extract_crime", "extract_crime_interstate_distance"],
+    "pollution": ["merge_pollution"],
+    "weather": ["extract_ghcn_weather", "generate_weather_variables", "read_sky_cover"],
+    "citylevel": ["citylevel"],
+    "micro": ["micro"],
+    "micro_bands": ["micro_bands"],
+    "micro_original": ["micro_original"],
+    "hourly": ["hourly"],
+    "crime_weather": ["crime_weather"],
+    "crime_grid": ["crime_grid"],
+    "episodes": ["episodes"],
+    "forest_design": ["forest_design"],
+    "all": ["citylevel", "micro", "micro_original", "forest_design"],
+}
+
+
+def with_dependencies(stages):
+    resolved = []
+
+    def visit(stage):
+        if stage in resolved:
+            return
+        for dependency in STAGE_DEPENDENCIES[stage]:
+            visit(dependency)
+        resolved.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return resolved
+
+
+def execution_waves(stages):
+    # Group the requested stages into waves that only depend on earlier waves. Dependencies outside the
+    # requested set are assumed to have been built by an earlier run.
+    remaining = [stage for stage in STAGES if stage in set(stages)]
+    done = []
+    waves = []
+    while remaining:
+        wave = [stage for stage in remaining
+                if all(dependency in done or dependency not in remaining for dependency in STAGE_DEPENDENCIES[stage])]
+        waves.append(wave)
+        done.extend(wave)
+        remaining = [stage for stage in remaining if stage not in wave]
+    return waves
@@ -0,0 +1,133 @@
+import argparse
+import fnmatch
+import threading
+from pathlib import Path
+
+import polars as pl
+
+# Descriptive statistics (Table 1, code/01-summary_statistics.R) from mergeable moments. A batch of rows is reduced to
+# (n, mean, M2, min, max) per group and variable, where M2 is the sum of squared deviations from the batch mean, and
+# partial moments of any number of batches are combined exactly with the parallel formula of Chan et al.:
+# mean = sum(n_i mean_i) / n and M2 = sum(M2_i) + sum(n_i (mean_i - mean)^2). Statistics therefore accumulate while
+# the datasets are written, or over the files of a partitioned store one at a time, without holding the data.
+# Summaries collected by DataPreprocessor when it writes a final dataset: file name pattern -> (columns, groups,
+# row filter). The columns of Table 1 are kept in their stored units; 01-summary_statistics.R rescales some of them.
+TABLE_SUMMARIES = {
+    "chicago_citylevel_dataset.csv": (["total_violent", "total_property", "PRCP_MIDWAY", "TMAX_MIDWAY", "avg_co_mean",
+                                       "avg_no2_mean", "avg_ozone_mean", "avg_pm10_mean", "avg_wind_speed",
+                                       "dew_point_avg", "sealevel_pressure_avg", "avg_sky_cover"], [], None),
+    "micro_dataset_original.csv": (["num_crimes"], ["violent"], pl.col("insample") == 1),
+    "micro_dataset_replicated_dir_thresh_*.csv": (["num_crimes"], ["violent"], pl.col("in_sample") == 1),
+    "micro_distance_bands_*.csv": (["num_crimes"], ["violent", "distance_band"], pl.col("in_sample") == 1),
+}
+
+
+def batch_moments(data, columns, by=()):
+    # Lazy partial moments of one batch, one row per group and variable; missing values are skipped
+    by = list(by)
+    return (data.lazy()
+            .select(*by, *[pl.col(col).cast(pl.Float64) for col in columns])
+            .unpivot(index=by, on=columns, variable_name="variable", value_name="value")
+            .drop_nulls("value")
+            .group_by(*by, "variable")
+            .agg(
+        pl.len().alias("n"),
+        pl.col("value").mean().alias("mean"),
+        ((pl.col("value") - pl.col("value").mean()) ** 2).sum().alias("m2"),
+        pl.col("value").min().alias("min"),
+        pl.col("value").max().alias("max")))
+
+
+def merge_moments(partials, by=()):
+    # Combines partial moments of the same groups and variables
+    by = list(by)
+    return (pl.concat([partial.lazy() for partial in partials])
+            .with_columns(
+        ((pl.col("n") * pl.col("mean")).sum() / pl.col("n").sum()).over(*by, "variable").alias("total_mean"))
+            .group_by(*by, "variable")
+            .agg(
+        pl.col("n").sum(),
+        pl.col("total_mean").first().alias("mean"),
+        (pl.col("m2") + pl.col("n") * (pl.col("mean") - pl.col("total_mean")) ** 2).sum().alias("m2"),
+        pl.col("min").min(),
+        pl.col("max").max())
+            .collect())
+
+
+def finalize(moments, by=(), variable_order=None):
+    # n, mean, sample standard deviation (n - 1, as R's sd), min and max
+    data = (moments
+            .with_columns(
+        (pl.col("m2") / (pl.col("n") - 1)).sqrt().alias("sd"))
+            .select(*by, "variable", "n", "mean", "sd", "min", "max"))
+    if variable_order is not None:
+        data = data.sort(pl.col("variable").replace_strict(variable_order, range(len(variable_order))), *by)
+    return data
+
+
+class SummaryStatistics:
+    # Accumulates the TABLE_SUMMARIES of the datasets written by DataPreprocessor. Stages may write concurrently.
+    def __init__(self, specs=TABLE_SUMMARIES):
+        self.specs = specs
+        self.moments = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, data):
+        for pattern, (columns, by, row_filter) in self.specs.items():
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+            rows = data.lazy() if row_filter is None else data.lazy().filter(row_filter)
+            # A rewritten dataset replaces its earlier statistics
+            partial = batch_moments(rows, columns, by).collect()
+            with self._lock:
+                self.moments[name] = partial
+            return
+
+    def table(self):
+        tables = []
+        for name, moments in sorted(self.moments.items()):
+            columns, by, _ = next(spec for pattern, spec in self.specs.items() if fnmatch.fnmatch(name, pattern))
+            group = (pl.concat_str([pl.lit(f"{col}=") + pl.col(col).cast(pl.String) for col in by], separator=", ")
+                     if by else pl.lit(None, dtype=pl.String))
+            tables.append(finalize(moments, by, columns)
+                          .select(
+                pl.lit(name).alias("dataset"), group.alias("group"), "variable", "n", "mean", "sd", "min", "max"))
+        return pl.concat(tables) if tables else None
+
+
+def summarize_files(paths, columns, by=(), row_filter=None):
+    # One pass over the files of a (partitioned) store, one file in memory at a time
+    partials = []
+    for path in paths:
+        path = Path(path)
+        data = (pl.scan_parquet(path) if path.suffix == ".parquet" else
+                pl.scan_ipc(path) if path.suffix in [".ipc", ".arrow"] else
+                pl.scan_csv(path, infer_schema_length=None))
+        if row_filter is not None:
+            data = data.filter(row_filter)
+        partials.append(batch_moments(data, columns, by).collect(engine="streaming"))
+    return finalize(merge_moments(partials, by), by, columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Means, standard deviations, minima and maxima of dataset columns "
+                                                 "in one pass over one or more files.")
+    parser.add_argument("files", type=Path, nargs="+", help=".csv, .parquet or .ipc files of one dataset.")
+    parser.add_argument("--columns", nargs="+", required=True)
+    parser.add_argument("--by", nargs="+", default=[], help="Group the statistics by these columns.")
+    parser.add_argument("--in-sample", default=None,
+                        help="Only rows where this column equals 1, e.g. in_sample of the micro datasets.")
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    row_filter = None if args.in_sample is None else pl.col(args.in_sample) == 1
+    results = summarize_files(args.files, args.columns, args.by, row_filter)
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        results.write_csv(args.output)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
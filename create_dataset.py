@@ -1,15 +1,180 @@
+import argparse
 import os
+import re
 from pathlib import Path
 
-from code.preprocessing.preprocess import DataPreprocessor
+from code.preprocessing.stages import STAGES, TARGETS, execution_waves, with_dependencies
 
-source_path = Path("replication_package")
-input_data_path = source_path/"Raw-Data"
-output_data_path = Path("data")
 
-preprocessor = DataPreprocessor(input_data_path,
-                                output_data_path,)
+def parse_memory_size(value):
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", value.upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"Invalid memory size {value!r}. Use e.g. 512MB or 8GB.")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** "BKMGT".index(unit or "B"))
 
-preprocessor.create_citylevel_dataset(process_raw_data=True)
-preprocessor.save_original_micro_dataset()
-# preprocessor.create_micro_dataset(wind_dir_threshold=60)
\ No newline at end of file
+
+def parse_threshold(value):
+    column, _, threshold = value.partition("=")
+    try:
+        return column, float(threshold)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid threshold {value!r}. Use e.g. avg_pm10_mean=50.") from None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the preprocessed datasets from the raw replication package.")
+    parser.add_argument("--input", type=Path, default=Path("replication_package") / "Raw-Data",
+                        help="Folder with the raw data of the replication package.")
+    parser.add_argument("--output", type=Path, default=Path("data"),
+                        help="Folder for the preprocessed datasets.")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=None,
+                        help="Targets to build together with everything they depend on. "
+                             "Defaults to citylevel and micro_original.")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=[],
+                        help="Individual stages to (re)run, assuming their inputs already exist.")
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[60],
+                        help="Wind direction thresholds (degrees) of the replicated micro datasets.")
+    parser.add_argument("--band-width", type=int, default=1320,
+                        help="Width (feet) of the distance bands of the micro_bands target.")
+    parser.add_argument("--hourly-windows", type=int, nargs="+", default=[3, 6],
+                        help="Trailing windows (hours) of the pollution exposures of the hourly target.")
+    parser.add_argument("--weather-stations", type=int, default=3,
+                        help="Number of nearest weather stations averaged for every crime by the crime_weather target.")
+    parser.add_argument("--idw-power", type=float, default=2,
+                        help="Power of the inverse distance weights of the crime_weather target.")
+    parser.add_argument("--cell-size", type=int, default=1000,
+                        help="Cell size (feet) of the crime_grid target: side of a square, circumradius of a hexagon.")
+    parser.add_argument("--cell-shape", choices=["square", "hex"], default="square")
+    parser.add_argument("--grid-format", choices=["parquet", "npz"], default="parquet",
+                        help="Store the crime_grid cube as a parquet table or as COO arrays in an .npz file.")
+    parser.add_argument("--episode-thresholds", type=parse_threshold, nargs="+", default=None,
+                        help="Pollution columns and thresholds of the episodes target, e.g. avg_pm10_mean=50 "
+                             "avg_ozone_mean=0.04 (the default).")
+    parser.add_argument("--episode-min-days", type=int, default=2,
+                        help="Minimum number of consecutive days above the threshold of an episode.")
+    parser.add_argument("--episode-window", type=int, default=7,
+                        help="Days before and after every episode in which the episodes target also counts crimes.")
+    parser.add_argument("--aqi-source", choices=["file", "computed"], default="file",
+                        help="Take the daily AQI from the AQI file of the replication package, or compute it from the "
+                             "daily CO, NO2, ozone and PM10 concentrations with the EPA breakpoints (no AQI file "
+                             "needed). City specs of --cities set their own.")
+    parser.add_argument("--lags", type=int, nargs="+", default=[],
+                        help="Add these lags (days) of the feature columns to the city-level dataset.")
+    parser.add_argument("--leads", type=int, nargs="+", default=[],
+                        help="Add these leads (days) of the feature columns to the city-level dataset.")
+    parser.add_argument("--windows", type=int, nargs="+", default=[],
+                        help="Add trailing rolling windows of this many days of the feature columns to the "
+                             "city-level dataset.")
+    parser.add_argument("--window-stats", nargs="+", choices=["mean", "max", "sum"], default=["mean"],
+                        help="Statistics of the rolling windows.")
+    parser.add_argument("--feature-columns", nargs="+", default=None,
+                        help="Columns of the lags, leads and rolling windows (default: pollution and weather).")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of independent stages to run concurrently and of Polars threads.")
+    parser.add_argument("--memory-limit", type=parse_memory_size, default=None,
+                        help="Memory budget, e.g. 8GB. Lazy queries then run on the streaming engine, and the DuckDB "
+                             "queries of --engine duckdb spill to disk beyond it.")
+    parser.add_argument("--engine", choices=["polars", "duckdb"], default="polars",
+                        help="Run the crime extraction, the daily AQS and weather aggregations and the micro crime "
+                             "counts on Polars or out of core on an embedded DuckDB database (needs duckdb).")
+    parser.add_argument("--format", choices=["csv", "parquet", "ipc"], default="csv",
+                        help="Storage format of the intermediate files.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Collect lazy queries with the Polars streaming engine.")
+    parser.add_argument("--async-io", action="store_true",
+                        help="Prefetch raw files concurrently and write outputs in the background.")
+    parser.add_argument("--io-budget", type=parse_memory_size, default=512 * 1024 ** 2,
+                        help="Bytes held in prefetched files (and again in pending writes) with --async-io, "
+                             "e.g. 512MB.")
+    parser.add_argument("--summary", action="store_true",
+                        help="Write means, standard deviations, minima and maxima of the final datasets (Table 1) to "
+                             "<output>/summary_statistics.csv while they are written.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write a per-stage profiling report to <output>/profiling.")
+    parser.add_argument("--sample-years", type=int, nargs="+", default=None,
+                        help="Development mode: only these years of every raw file.")
+    parser.add_argument("--sample-fraction", type=float, default=None,
+                        help="Development mode: this fraction of the crimes, by a hash of their id.")
+    parser.add_argument("--sample-monitors", nargs="+", default=None,
+                        help="Development mode: only these pollution monitors (county_site_poc, e.g. 31_3103_1).")
+    parser.add_argument("--sample-stations", type=int, nargs="+", default=None,
+                        help="Development mode: only these hourly weather stations (USAF ids).")
+    parser.add_argument("--sample-seed", type=int, default=0,
+                        help="Seed of the crime id hash of --sample-fraction.")
+    parser.add_argument("--cities", type=Path, nargs="+", default=None,
+                        help="City spec JSON files (see code/preprocessing/city.py). Builds every city, reading "
+                             "<input>/<name> and writing <output>/<name>.")
+    parser.add_argument("--city-jobs", type=int, default=1,
+                        help="Number of cities of --cities to build concurrently, in separate processes.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the stages that would run and exit.")
+    args = parser.parse_args(argv)
+    if args.targets is None and not args.stages:
+        args.targets = ["citylevel", "micro_original"]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    stages = with_dependencies([stage for target in args.targets or [] for stage in TARGETS[target]])
+    stages += [stage for stage in args.stages if stage not in stages]
+    if args.dry_run:
+        for i, wave in enumerate(execution_waves(stages)):
+            print(f"wave {i + 1}: {', '.join(wave)}")
+        return
+
+    # Polars reads the size of its thread pool once, at import time
+    if args.jobs > 1 and args.city_jobs <= 1:
+        os.environ.setdefault("POLARS_MAX_THREADS", str(args.jobs))
+    from code.preprocessing.batch import run_cities
+    from code.preprocessing.city import CitySpec
+    from code.preprocessing.features import CITY_FEATURE_COLUMNS, FeatureSpec
+    from code.preprocessing.preprocess import DataPreprocessor
+    from code.preprocessing.sampling import SampleSpec
+
+    sample = None
+    if any(option is not None for option in [args.sample_years, args.sample_fraction, args.sample_monitors,
+                                             args.sample_stations]):
+        sample = SampleSpec(years=args.sample_years, id_fraction=args.sample_fraction, monitors=args.sample_monitors,
+                            stations=args.sample_stations, seed=args.sample_seed)
+    feature_spec = FeatureSpec(columns=args.feature_columns or CITY_FEATURE_COLUMNS, lags=args.lags, leads=args.leads,
+                               windows=args.windows, stats=args.window_stats)
+
+    preprocessor_options = {"profile": args.profile,
+                            "storage_format": args.format,
+                            "streaming": args.streaming,
+                            "jobs": args.jobs,
+                            "memory_limit": args.memory_limit,
+                            "engine": args.engine,
+                            "async_io": args.async_io,
+                            "max_inflight_bytes": args.io_budget,
+                            "summary_statistics": args.summary,
+                            "sample": sample,}
+    run_options = {"wind_dir_thresholds": args.thresholds, "band_width": args.band_width,
+                   "feature_spec": feature_spec, "hourly_windows": args.hourly_windows,
+                   "weather_stations": args.weather_stations, "idw_power": args.idw_power,
+                   "grid_options": {"cell_size": args.cell_size, "shape": args.cell_shape,
+                                    "file_format": args.grid_format},
+                   "episode_options": {"thresholds": None if args.episode_thresholds is None else
+                                       dict(args.episode_thresholds),
+                                       "min_days": args.episode_min_days, "window_days": args.episode_window}}
+
+    if args.cities is not None:
+        cities = [CitySpec.from_file(path) for path in args.cities]
+        run_cities(cities, args.input, args.output, stages, jobs=args.city_jobs,
+                   preprocessor_options=preprocessor_options, run_options=run_options)
+        return
+
+    preprocessor = DataPreprocessor(args.input, args.output, city=CitySpec(aqi_source=args.aqi_source),
+                                    **preprocessor_options)
+    preprocessor.run(stages, **run_options)
+
+    if args.profile:
+        preprocessor.write_profile_report()
+
+
+if __name__ == "__main__":
+    main()